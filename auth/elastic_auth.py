@@ -1,6 +1,7 @@
 import requests
 from dotenv import load_dotenv
 import os
+from functools import lru_cache
 from msal import ConfidentialClientApplication
 
 # Load environment variables from .env file
@@ -10,28 +11,56 @@ CLIENT_ID = os.getenv('COST_APIM_CLIENT_ID')
 CLIENT_SECRET = os.getenv('COST_APIM_CLIENT_SECRET')
 TENANT_ID = os.getenv('TENANT_ID')
 SCOPE = [os.getenv('COST_APIM_SCOPE')]
+TOKEN_CACHE_PATH = os.getenv('MSAL_TOKEN_CACHE_PATH', '')  # token cache file shared between processes; empty: per process
 from azure.identity import ClientSecretCredential
 
 # URL to request a token from Azure AD
 TOKEN_URL = f"https://login.microsoftonline.com/{TENANT_ID}/"
 
+@lru_cache(maxsize=None)
+def _msal_app():
+    """
+    One ConfidentialClientApplication per process, so MSAL's token cache is reused between calls.
+    With MSAL_TOKEN_CACHE_PATH the cache is a file kept by msal-extensions under a file lock, so
+    tokens also survive restarts and are shared by concurrent scripts.
+    """
+    cache = None
+    if TOKEN_CACHE_PATH:
+        from msal_extensions import FilePersistence, PersistedTokenCache
+        path = os.path.expanduser(TOKEN_CACHE_PATH)
+        os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))  # the file holds bearer tokens
+        cache = PersistedTokenCache(FilePersistence(path))
+    return ConfidentialClientApplication(client_id=CLIENT_ID, client_credential=CLIENT_SECRET, authority=TOKEN_URL, token_cache=cache)
+
 # Request token from Azure AD using Client Credentials flow
 def get_access_token():
-    app = ConfidentialClientApplication(client_id=CLIENT_ID, client_credential=CLIENT_SECRET, authority=TOKEN_URL)  
+    app = _msal_app()
     response = app.acquire_token_for_client(scopes=SCOPE)
     if 'error' in response:
         raise Exception(f"Error acquiring token: {response['error_description']}")
     return response['access_token']
 
 # Make a request to the OAuth Proxy endpoint
-def call_elastic_search():
+def call_elastic_search(query="skills:Nuclear Reactors", fields=("name", "email", "title", "department", "location", "skills"), size=10):
+    """
+    Search the hub people index and return a compact list of people records.
+    Only `fields` are requested through `_source` filtering and `filter_path` drops scores and shard metadata.
+    """
     access_token = get_access_token()
-    url = "https://labassist.pnnl.gov/proxy/actman/elasticsearch/hub-suggestions-people/_search?q=skills:Nuclear+Reactors"
+    url = "https://labassist.pnnl.gov/proxy/actman/elasticsearch/hub-suggestions-people/_search"
     headers = {
         'Authorization': f'Bearer {access_token}'
     }
-    response = requests.get(url, headers=headers)
-    return response
+    params = {
+        "q": query,
+        "size": size,
+        "_source_includes": ",".join(fields),
+        "filter_path": "hits.hits._id,hits.hits._source",
+    }
+    response = requests.get(url, headers=headers, params=params)
+    response.raise_for_status()
+    hits = response.json().get("hits", {}).get("hits", [])
+    return [{"id": hit.get("_id"), **(hit.get("_source") or {})} for hit in hits]
 
 def call_apim_search_get():
     """
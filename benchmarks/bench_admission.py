@@ -0,0 +1,91 @@
+"""
+Interactive latency while batch cost sweeps saturate a shared gateway, with and without the
+per-upstream admission controller, against the local stand-ins in fake_upstreams.py.
+
+The stand-in backend works on --capacity calls at once and queues the rest, as a saturated APIM
+backend does. Background summarize_project_costs sweeps (batch priority) run for the whole
+measurement while sequential hub searches (interactive) are timed. With UPSTREAM_MAX_CONCURRENCY
+near the backend's capacity the tools queue the excess calls themselves and admit interactive
+ones first; the batch call rate shows what the cap costs the sweeps.
+
+    python benchmarks/bench_admission.py --capacity 8 --caps 0 8 12 16
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from fake_upstreams import FakeUpstreams, UpstreamConfig, fake_credential_class
+from run_benchmarks import load_tool_module
+
+
+async def measure(hub, cost, upstreams, args, cap: int, sweeps: int) -> dict:
+    for tool in (hub, cost):
+        tool.valves.UPSTREAM_MAX_CONCURRENCY = cap
+    stop = asyncio.Event()
+
+    async def sweep(worker: int) -> None:
+        resources = [3000000 + worker * 1000 + i for i in range(args.resources)]
+        while not stop.is_set():
+            await cost.summarize_project_costs(83848, resources, ["2023", "2024"])
+
+    background = [asyncio.create_task(sweep(w)) for w in range(sweeps)]
+    await asyncio.sleep(0.5)  # let the sweeps fill the backend
+    before = upstreams.calls["costs"]
+    window = time.perf_counter()
+    latencies = []
+    errors = 0
+    for i in range(args.searches):
+        started = time.perf_counter()
+        result = await hub.search_internal_users(f"admission {cap} {sweeps} {i}", True)
+        latencies.append(time.perf_counter() - started)
+        errors += "error" in result
+    batch_rate = (upstreams.calls["costs"] - before) / (time.perf_counter() - window)
+    stop.set()
+    await asyncio.gather(*background)
+    cuts = statistics.quantiles(latencies, n=20, method="inclusive")
+    return {"p50": statistics.median(latencies), "p95": cuts[18], "errors": errors, "batch_rate": batch_rate}
+
+
+async def run(args) -> None:
+    config = UpstreamConfig(latency_ms=args.latency_ms, capacity=args.capacity)
+    with FakeUpstreams(config) as upstreams:
+        credential = fake_credential_class(upstreams.base_url)
+        hub_module = load_tool_module("cost_estimator/hub_search_tool.py")
+        cost_module = load_tool_module("cost_estimator/cost_estimator_tool.py")
+        hub_module.ClientSecretCredential = cost_module.ClientSecretCredential = credential
+        hub, cost = hub_module.Tools(), cost_module.Tools()
+        hub._ENDPOINT = f"{upstreams.base_url}/hub"
+        cost._ENDPOINT = f"{upstreams.base_url}/costs"
+        cost.valves.BATCH_CONCURRENCY = args.batch_concurrency
+        # The stand-in shares this process, so round trips carry GIL overhead on top of the
+        # backend latency; a cap a little above --capacity keeps the backend busy.
+        runs = [("idle gateway (reference)", 0, 0)]
+        runs += [(f"UPSTREAM_MAX_CONCURRENCY={cap}" if cap else "no admission control", cap, args.sweeps) for cap in args.caps]
+        for label, cap, sweeps in runs:
+            report = await measure(hub, cost, upstreams, args, cap, sweeps)
+            print(
+                f"{label:30s} interactive p50 {report['p50'] * 1000:7.1f} ms  p95 {report['p95'] * 1000:7.1f} ms  "
+                f"errors {report['errors']}  batch {report['batch_rate']:6.1f} calls/s"
+            )
+        print("admission:", hub_module.admission_stats())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--capacity", type=int, default=8, help="calls the stand-in backend serves at once")
+    parser.add_argument("--caps", type=int, nargs="+", default=[0, 8, 12, 16], help="UPSTREAM_MAX_CONCURRENCY values (0: off)")
+    parser.add_argument("--sweeps", type=int, default=4, help="concurrent background cost sweeps")
+    parser.add_argument("--resources", type=int, default=50, help="resources per sweep")
+    parser.add_argument("--batch-concurrency", type=int, default=8, help="BATCH_CONCURRENCY of each sweep")
+    parser.add_argument("--searches", type=int, default=40, help="timed sequential interactive searches")
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
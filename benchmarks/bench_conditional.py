@@ -0,0 +1,72 @@
+"""
+Repeat Hub name lookups after their cache entries expire, with plain, gzip-compressed and
+conditional (If-None-Match -> 304) transfers, against the local stand-ins in fake_upstreams.py.
+
+Every round looks up the same names once their NAME_CACHE_TTL has run out (CACHE_STALE_TTL 0, so
+each refresh happens in the call), which is where an unchanged profile is downloaded and decoded
+again. Reports the p50 call latency of the refreshing rounds and the response bytes sent per
+lookup.
+
+    python benchmarks/bench_conditional.py --names 20 --rounds 5 --people 200
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from fake_upstreams import FakeUpstreams, UpstreamConfig, fake_credential_class
+from run_benchmarks import load_tool_module
+
+MODES = {
+    "plain": {"compress": False, "conditional": False},
+    "gzip": {"compress": True, "conditional": False},
+    "gzip + conditional": {"compress": True, "conditional": True},
+}
+
+
+async def run(args) -> None:
+    config = UpstreamConfig(latency_ms=args.latency_ms, jitter_ms=0, people=args.people)
+    with FakeUpstreams(config) as upstreams:
+        for mode, options in MODES.items():
+            config.compress = options["compress"]
+            module = load_tool_module("cost_estimator/hub_search_tool.py")
+            module.ClientSecretCredential = fake_credential_class(upstreams.base_url)
+            tool = module.Tools()
+            tool._ENDPOINT = f"{upstreams.base_url}/hub"
+            tool.valves.NAME_CACHE_TTL = args.ttl
+            tool.valves.CACHE_STALE_TTL = 0.0
+            tool.valves.CONDITIONAL_REQUESTS = options["conditional"]
+            names = [f"{mode} name {i}" for i in range(args.names)]
+            for name in names:  # first fetch, not measured
+                await tool.search_internal_users_by_name(name)
+            bytes_before = upstreams.bytes_sent
+            latencies = []
+            for _ in range(args.rounds):
+                await asyncio.sleep(args.ttl)
+                for name in names:
+                    started = time.perf_counter()
+                    await tool.search_internal_users_by_name(name)
+                    latencies.append(time.perf_counter() - started)
+            per_lookup = (upstreams.bytes_sent - bytes_before) / len(latencies)
+            print(
+                f"{mode:20s} p50 {statistics.median(latencies) * 1000:7.2f} ms  "
+                f"{per_lookup / 1024:8.1f} KiB/lookup  revalidated {module.response_cache_stats()['revalidated']}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--names", type=int, default=20, help="distinct names looked up each round")
+    parser.add_argument("--rounds", type=int, default=5, help="refreshing rounds measured")
+    parser.add_argument("--people", type=int, default=200, help="people per Hub response (response size)")
+    parser.add_argument("--ttl", type=float, default=0.2, help="NAME_CACHE_TTL in seconds")
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
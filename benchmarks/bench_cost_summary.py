@@ -0,0 +1,90 @@
+"""
+Benchmark of cost_estimator_tool.summarize_project_costs at hundreds of resources x several
+fiscal years against the local stand-ins in fake_upstreams.py.
+
+Reports wall time, the aggregation phase on its own, a cold and a warm run through the on-disk
+cost cache (the lookups are for closed fiscal years), and the size of the summary next to the
+raw rows search_costs_many would hand to the model for the same lookups.
+
+    python benchmarks/bench_cost_summary.py --resources 300 --years 4 --concurrency 8 32
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+from fake_upstreams import FakeUpstreams, UpstreamConfig, fake_credential_class
+from run_benchmarks import load_tool_module
+
+
+async def run(args) -> None:
+    config = UpstreamConfig(latency_ms=args.latency_ms, cost_rows=args.cost_rows)
+    with FakeUpstreams(config) as upstreams:
+        module = load_tool_module("cost_estimator/cost_estimator_tool.py")
+        module.ClientSecretCredential = fake_credential_class(upstreams.base_url)
+        tool = module.Tools()
+        tool._ENDPOINT = f"{upstreams.base_url}/costs"
+        resources = [3000000 + i for i in range(args.resources)]
+        years = [str(2025 - i) for i in range(args.years)]
+
+        raw = await tool.search_costs_many([[fy, r, 83848] for fy in years for r in resources])
+        raw_bytes = len(json.dumps(raw))
+        for concurrency in args.concurrency:
+            tool.valves.BATCH_CONCURRENCY = concurrency
+            events = []
+
+            async def capture(event):
+                events.append(event)
+
+            before = upstreams.calls["costs"]
+            started = time.perf_counter()
+            summary = await tool.summarize_project_costs(83848, resources, years, __event_emitter__=capture)
+            wall = time.perf_counter() - started
+            status = events[-1]["data"]["description"] if events else ""
+            print(
+                f"{len(resources)} resources x {len(years)} years, concurrency {concurrency:3d}: "
+                f"{wall:6.2f} s, {upstreams.calls['costs'] - before} upstream calls, "
+                f"{summary['rows']} rows, errors {len(summary['errors'])}"
+            )
+            print(f"    {status}")
+        with tempfile.TemporaryDirectory() as tmp:
+            tool.valves.COST_CACHE_PATH = str(Path(tmp) / "costs.db")
+            for label in ("disk cache cold", "disk cache warm"):
+                before = upstreams.calls["costs"]
+                started = time.perf_counter()
+                await tool.summarize_project_costs(83848, resources, years)
+                print(
+                    f"{label}: {time.perf_counter() - started:6.2f} s, "
+                    f"{upstreams.calls['costs'] - before} upstream calls, "
+                    f"{Path(tool.valves.COST_CACHE_PATH).stat().st_size:,} bytes on disk"
+                )
+            tool.valves.COST_CACHE_PATH = ""
+        aggregate = module._aggregate_costs
+        responses = {tuple(key.split("/")[:2]): value for key, value in raw["results"].items()}
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            aggregate(responses, "amount", "costCategory", 20)
+        per_run = (time.perf_counter() - started) / args.repeat
+        print(f"aggregation alone: {per_run * 1000:.2f} ms for {summary['rows']} rows")
+        print(f"summary {len(json.dumps(summary)):,} bytes vs raw search_costs_many {raw_bytes:,} bytes")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--resources", type=int, default=300)
+    parser.add_argument("--years", type=int, default=4)
+    parser.add_argument("--cost-rows", type=int, default=12, help="rows per cost response")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32], help="BATCH_CONCURRENCY values")
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    parser.add_argument("--repeat", type=int, default=20, help="timed aggregation passes")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
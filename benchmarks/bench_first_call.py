@@ -0,0 +1,86 @@
+"""
+First-call latency of each tool after it is loaded, with and without the background warm-up,
+against steady-state latency, using the local stand-ins in fake_upstreams.py.
+
+Each measurement loads a fresh copy of the tool module, so the token cache and connection pool
+start empty as after a worker start or a valve change. "cold" sets the credentials with
+WARMUP_ON_LOAD off and calls at once; "warm" lets the warm-up started by the valve assignment
+finish first, as it does while Open WebUI is still registering the tool.
+
+    python benchmarks/bench_first_call.py --latency-ms 40 --samples 5
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from fake_upstreams import FakeUpstreams, UpstreamConfig, fake_credential_class
+from run_benchmarks import load_tool_module
+
+TOOLS = {
+    "hub.search_internal_users": (
+        "cost_estimator/hub_search_tool.py",
+        "/hub",
+        lambda tool, i: tool.search_internal_users(f"first call {i}", True),
+    ),
+    "cost.search_costs": (
+        "cost_estimator/cost_estimator_tool.py",
+        "/costs",
+        lambda tool, i: tool.search_costs("2025", 3000000 + i, 83848),
+    ),
+    "prf.search_projects": (
+        "prf/pfr_tool.py",
+        "/projects",
+        lambda tool, i: tool.search_projects(f"first call {i}"),
+    ),
+}
+
+
+async def first_call(base_url: str, path: str, route: str, call, warm_up: bool, i: int) -> tuple[float, float]:
+    module = load_tool_module(path)
+    module.ClientSecretCredential = fake_credential_class(base_url)
+    tool = module.Tools()
+    tool._ENDPOINT = f"{base_url}{route}"
+    # The assignment is what Open WebUI does with the saved valves; it starts the warm-up.
+    tool.valves = tool.Valves(TENANT_ID="tenant", CLIENT_ID="client", CLIENT_SECRET="secret", WARMUP_ON_LOAD=warm_up)
+    await asyncio.gather(*module._WARM_UPS.values())
+    started = time.perf_counter()
+    await call(tool, i)
+    elapsed = time.perf_counter() - started
+    steady = []
+    for j in range(1, 6):
+        started = time.perf_counter()
+        await call(tool, i * 100 + j)
+        steady.append(time.perf_counter() - started)
+    return elapsed, statistics.median(steady)
+
+
+async def run(args) -> None:
+    with FakeUpstreams(UpstreamConfig(latency_ms=args.latency_ms, jitter_ms=0)) as upstreams:
+        for name, (path, route, call) in TOOLS.items():
+            cold, warm, steady = [], [], []
+            for i in range(args.samples):
+                first, _ = await first_call(upstreams.base_url, path, route, call, False, 2 * i)
+                cold.append(first)
+                first, median = await first_call(upstreams.base_url, path, route, call, True, 2 * i + 1)
+                warm.append(first)
+                steady.append(median)
+            print(
+                f"{name:28s} first call cold {statistics.median(cold) * 1000:7.1f} ms  "
+                f"warm {statistics.median(warm) * 1000:7.1f} ms  steady {statistics.median(steady) * 1000:7.1f} ms"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--samples", type=int, default=5, help="fresh tool loads per mode")
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="stand-in latency, token endpoint included")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Throughput of the Hub MCP server: the original synchronous stdio handler vs the async
+streamable-HTTP server, both against the local stand-ins in fake_upstreams.py.
+
+The legacy handler took credentials as tool arguments, minted a token per call and blocked the
+server's event loop, so a stdio session processed calls one after another; it is reproduced
+here as `legacy_search_user`. The current server is started on a local port with uvicorn and
+driven by concurrent MCP clients over streamable HTTP.
+
+    python benchmarks/bench_mcp_transport.py --calls 200 --clients 20 --latency-ms 40
+"""
+
+import argparse
+import asyncio
+import logging
+import threading
+import time
+
+import requests
+import uvicorn
+from mcp import ClientSession
+from mcp.client.streamable_http import streamablehttp_client
+
+from fake_upstreams import FakeUpstreams, UpstreamConfig, fake_credential_class
+from run_benchmarks import load_tool_module
+
+
+def legacy_search_user(base_url: str, query_string: str, TENANT_ID, CLIENT_ID, CLIENT_SECRET) -> dict:
+    """The search_user handler as it was before the server became async."""
+    credential = fake_credential_class(base_url)(TENANT_ID, CLIENT_ID, CLIENT_SECRET)
+    token = credential.get_token("https://labassist.pnnl.gov/proxy/.default").token
+    headers = {"Authorization": f"Bearer {token}"}
+    resp = requests.get(f"{base_url}/es/hub-suggestions-people/_search", params={"q": query_string}, headers=headers, timeout=10)
+    if resp.status_code == 200:
+        return resp.json()
+    return {"error": f"Failed to search for user: {resp.status_code} - {resp.text}"}
+
+
+def bench_legacy(base_url: str, calls: int) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        legacy_search_user(base_url, f"skills:S{i}", "tenant", "client", "secret")
+    return calls / (time.perf_counter() - started)
+
+
+def start_server(base_url: str, port: int):
+    module = load_tool_module("cost_estimator/hub_search_mcp.py")
+    module.ClientSecretCredential = fake_credential_class(base_url)
+    module.PEOPLE_SEARCH_URL = f"{base_url}/es/hub-suggestions-people/_search"
+    config = uvicorn.Config(module.mcp.streamable_http_app(), host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}{module.mcp.settings.streamable_http_path}"
+
+
+async def bench_streamable_http(url: str, calls: int, clients: int) -> float:
+    async def client(worker: int) -> None:
+        async with streamablehttp_client(url) as (read, write, _):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                for i in range(worker, calls, clients):
+                    result = await session.call_tool("search_user", {"query_string": f"skills:S{i}"})
+                    if result.isError:
+                        raise RuntimeError(result.content)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(w) for w in range(clients)))
+    return calls / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=20, help="concurrent MCP client sessions")
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    with FakeUpstreams(UpstreamConfig(latency_ms=args.latency_ms)) as upstreams:
+        legacy = bench_legacy(upstreams.base_url, args.calls)
+        server, url = start_server(upstreams.base_url, args.port)
+        try:
+            current = asyncio.run(bench_streamable_http(url, args.calls, args.clients))
+        finally:
+            server.should_exit = True
+    print(f"legacy sync stdio handler      {legacy:8.1f} calls/s")
+    print(f"async streamable-HTTP server   {current:8.1f} calls/s  ({args.clients} clients, {current / legacy:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Query latency and upstream call volume of people lookups answered by the local SQLite people
+index versus the Hub API / Elasticsearch, against the local stand-ins in fake_upstreams.py.
+
+The index is filled once by a full sync from the stand-in people index (timed and counted
+separately), then the same query mix runs with the index disabled and enabled for
+hub_search_mcp.search_user and hub_search_tool.search_internal_users_by_name.
+
+    python benchmarks/bench_people_index.py --people 5000 --requests 500 --latency-ms 40
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from fake_upstreams import FakeUpstreams, UpstreamConfig, fake_credential_class
+from run_benchmarks import load_tool_module, run_scenario
+
+
+def report(name: str, latencies: list, wall: float, calls: dict) -> None:
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    print(
+        f"{name:44s} p50 {cuts[49] * 1000:8.2f} ms  p95 {cuts[94] * 1000:8.2f} ms  "
+        f"{len(latencies) / wall:9.1f} req/s  upstream {calls}"
+    )
+
+
+async def measure(upstreams: FakeUpstreams, name: str, call, requests: int, concurrency: int) -> None:
+    before = dict(upstreams.calls)
+    latencies, errors, wall = await run_scenario(call, requests, concurrency)
+    calls = {k: v - before.get(k, 0) for k, v in upstreams.calls.items() if v - before.get(k, 0)}
+    report(name + (f" ({errors} errors)" if errors else ""), latencies, wall, calls)
+
+
+async def run(args, index_path: str) -> None:
+    with FakeUpstreams(UpstreamConfig(latency_ms=args.latency_ms, index_people=args.people)) as upstreams:
+        credential = fake_credential_class(upstreams.base_url)
+        mcp = load_tool_module("cost_estimator/hub_search_mcp.py")
+        mcp.ClientSecretCredential = credential
+        mcp.PEOPLE_SEARCH_URL = f"{upstreams.base_url}/es/hub-suggestions-people/_search"
+        hub = load_tool_module("cost_estimator/hub_search_tool.py")
+        hub.ClientSecretCredential = credential
+        tool = hub.Tools()
+        tool._ENDPOINT = f"{upstreams.base_url}/hub"
+
+        # The stand-in people are "Person <i>"; their number is the one word that tells them apart
+        # (only single-word lookups are answered locally by the hub tool).
+        def search_user(i):
+            return mcp.search_user(f"name:{i % args.people}", size=10)
+
+        def by_name(i):
+            return tool.search_internal_users_by_name(str(i % args.people))
+
+        await measure(upstreams, "mcp.search_user (Elasticsearch)", search_user, args.requests, args.concurrency)
+        await measure(upstreams, "hub.search_internal_users_by_name (Hub API)", by_name, args.requests, args.concurrency)
+
+        mcp._PEOPLE_INDEX.path = index_path
+        before = dict(upstreams.calls)
+        started = time.perf_counter()
+        synced = await mcp._PEOPLE_INDEX.sync()
+        calls = {k: v - before.get(k, 0) for k, v in upstreams.calls.items() if v - before.get(k, 0)}
+        print(f"{'full sync':44s} {synced['people']} people in {time.perf_counter() - started:.2f} s  upstream {calls}")
+        tool.valves.LOCAL_INDEX_PATH = index_path
+
+        await measure(upstreams, "mcp.search_user (local index)", search_user, args.requests, args.concurrency)
+        await measure(upstreams, "hub.search_internal_users_by_name (local index)", by_name, args.requests, args.concurrency)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--people", type=int, default=5000, help="documents in the stand-in people index")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args, str(Path(tmp) / "people.db")))
+
+
+if __name__ == "__main__":
+    main()
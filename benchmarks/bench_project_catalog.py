@@ -0,0 +1,104 @@
+"""
+PRF project look-ups with and without the local project catalog, against the local stand-ins in
+fake_upstreams.py.
+
+The query mix is what users type for a project: exact numbers, partial numbers, misspelled names
+and name fragments. For each kind the script reports how often find_projects ranks the intended
+project first or lists it at all (partial numbers and fragments are ambiguous) and its latency, and for search_projects with the catalog off (every query sent
+upstream as typed) and on (confident matches looked up by number) how often the intended project
+comes back first, which is how often the user does not have to retry, with latency and upstream
+calls per query.
+
+    python benchmarks/bench_project_catalog.py --queries 200 --latency-ms 40
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import time
+
+from fake_upstreams import FakeUpstreams, UpstreamConfig, _catalog_project, fake_credential_class
+from run_benchmarks import load_tool_module
+
+
+def _misspell(word: str, rng: random.Random) -> str:
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1:]
+
+
+QUERY_KINDS = {
+    "exact number": lambda project, rng: project["projectNumber"],
+    "partial number": lambda project, rng: project["projectNumber"][:4],
+    "misspelled name": lambda project, rng: " ".join(_misspell(word, rng) for word in project["name"].split()),
+    "name fragment": lambda project, rng: " ".join(project["name"].split()[:2]),
+}
+
+
+def build_tool(base_url: str, catalog: bool):
+    module = load_tool_module("prf/pfr_tool.py")
+    module.ClientSecretCredential = fake_credential_class(base_url)
+    tool = module.Tools()
+    tool._ENDPOINT = f"{base_url}/projects"
+    tool.valves.PROJECT_CATALOG_URL = f"{base_url}/projects/catalog" if catalog else ""
+    return tool
+
+
+async def timed(call) -> tuple:
+    started = time.perf_counter()
+    result = await call
+    return time.perf_counter() - started, result
+
+
+async def run(args) -> None:
+    rng = random.Random(args.seed)
+    config = UpstreamConfig(latency_ms=args.latency_ms, jitter_ms=0, catalog_projects=args.catalog)
+    with FakeUpstreams(config) as upstreams:
+        plain = build_tool(upstreams.base_url, catalog=False)
+        cataloged = build_tool(upstreams.base_url, catalog=True)
+        await cataloged.find_projects("warm up")  # first load, as the first look-up after a start
+        for kind, make in QUERY_KINDS.items():
+            wanted = [_catalog_project(rng.randrange(args.catalog)) for _ in range(args.queries)]
+            queries = [make(project, rng) for project in wanted]
+            hits, listed, find_latency = 0, 0, []
+            for project, query in zip(wanted, queries):
+                elapsed, result = await timed(cataloged.find_projects(query))
+                find_latency.append(elapsed)
+                numbers = [candidate.get("projectNumber") for candidate in result.get("candidates", [])]
+                hits += numbers[:1] == [project["projectNumber"]]
+                listed += project["projectNumber"] in numbers
+            report = []
+            for name, tool in (("off", plain), ("on", cataloged)):
+                before = upstreams.calls["projects"]
+                latencies, right = [], 0
+                for project, query in zip(wanted, queries):
+                    elapsed, result = await timed(tool.search_projects(query))
+                    latencies.append(elapsed)
+                    right += (result.get("projects") or [{}])[0].get("projectNumber") == project["projectNumber"]
+                calls = upstreams.calls["projects"] - before
+                report.append(
+                    f"catalog {name}: right project {right / len(queries):6.1%} p50 {statistics.median(latencies) * 1000:5.1f} ms "
+                    f"{calls / len(queries):.1f} calls/query"
+                )
+            print(
+                f"{kind:16s} find_projects top-1 {hits / len(queries):6.1%} listed {listed / len(queries):6.1%} p50 {statistics.median(find_latency) * 1000:5.2f} ms | "
+                f"search_projects {' | '.join(report)}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--queries", type=int, default=200, help="queries per kind")
+    parser.add_argument("--catalog", type=int, default=1000, help="projects in the catalog (names are distinct up to 1320)")
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Startup cost of each tool module: import time and resident memory, measured in a fresh
+interpreter per sample because Open WebUI re-imports a tool on every worker start and valve change.
+
+Each sample loads the file the way Open WebUI does (as run_benchmarks.load_tool_module, inlined so the
+harness's own imports are not preloaded) and reports wall time, the RSS it added and which heavy
+dependencies were imported at load.
+
+    python benchmarks/bench_startup.py --samples 5
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+
+MODULES = {
+    "hub_search_tool": "cost_estimator/hub_search_tool.py",
+    "cost_estimator_tool": "cost_estimator/cost_estimator_tool.py",
+    "pfr_tool": "prf/pfr_tool.py",
+    "hub_search_mcp": "cost_estimator/hub_search_mcp.py",
+    "pipeline": "cost_estimator/hub_search_pipeline_via_tools.py",
+}
+
+# Dependencies that should only be imported on first use.
+HEAVY = ("azure.identity", "msal", "msal_extensions", "dotenv", "open_webui.models.users")
+
+_PROBE = """
+import importlib.util, json, sys, time
+
+def rss_kib():
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+
+before = rss_kib()
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location("startup_probe", {path!r})
+module = importlib.util.module_from_spec(spec)
+sys.modules["startup_probe"] = module
+spec.loader.exec_module(module)
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "rss_kib": rss_kib() - before, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def sample(path: str) -> dict:
+    code = _PROBE.format(path=str(REPO / path), heavy=HEAVY)
+    done = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if done.returncode:
+        raise RuntimeError(done.stderr.strip().splitlines()[-1] if done.stderr.strip() else "failed")
+    return json.loads(done.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--samples", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--only", nargs="*", help="run only modules whose name contains one of these")
+    args = parser.parse_args()
+
+    for name, path in MODULES.items():
+        if args.only and not any(part in name for part in args.only):
+            continue
+        try:
+            runs = [sample(path) for _ in range(args.samples)]
+        except RuntimeError as e:  # missing optional runtime (e.g. pipelines blueprints)
+            print(f"{name:22s} skipped: {e}")
+            continue
+        seconds = min(r["seconds"] for r in runs)  # best of N: import time is noisy on shared machines
+        rss = statistics.median(r["rss_kib"] for r in runs)
+        heavy = ", ".join(runs[-1]["heavy"]) or "-"
+        print(f"{name:22s} import {seconds * 1000:8.1f} ms (best) rss +{rss / 1024:6.1f} MiB  loaded at import: {heavy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,503 @@
+"""
+Local stand-ins for the enterprise endpoints the tools talk to, for offline benchmarking.
+
+One threaded HTTP server answers every route:
+- POST /{tenant}/oauth2/v2.0/token   Entra ID client-credentials token endpoint
+- HEAD on any path                   bodiless 200, as the gateway answers the tools' connection warm-up
+- GET|POST /hub                      APIM Hub search (name lookup / searchTerm search)
+- POST /costs                        APIM cost search
+- GET /projects                      PRF project search
+- GET /projects/catalog              PRF project list (PROJECT_CATALOG_URL)
+- GET|POST /es/hub-suggestions-people/_search   Elasticsearch people index (search_after paging;
+  match_all, an updatedAt range, or a `[field:]words` query_string with Elasticsearch's defaults)
+- POST /es/hub-suggestions-people/_pit, POST /es/_search, DELETE /es/_pit   point-in-time paging
+
+Latency, jitter, payload sizes, backend capacity and injected slow calls, 429s and 503s are
+configurable and every route counts its calls, so a benchmark can report upstream call volume
+next to latency. GET responses carry an ETag and Last-Modified and are answered 304 when the
+request's If-None-Match still matches; with `compress` responses are gzip-encoded for clients
+that accept it. `bytes_sent` counts response body bytes as they went over the wire. Given a Cassette, the hub, cost and PRF routes answer with recorded responses
+instead (see replay_cassettes.py). `served_in_subprocess` runs the server in a child process
+instead, so its own allocations stay out of the benchmark process's traces.
+"""
+
+import gzip
+import json
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+import msal
+
+
+class UpstreamConfig:
+    def __init__(
+        self,
+        latency_ms=50.0,
+        jitter_ms=10.0,
+        people=25,
+        cost_rows=12,
+        projects=10,
+        catalog_projects=1000,
+        index_people=None,
+        error_rate=0.0,
+        slow_rate=0.0,
+        slow_ms=2000.0,
+        quota_per_second=0.0,
+        capacity=0,
+        compress=False,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.people = people
+        self.index_people = people if index_people is None else index_people  # documents in the ES people index
+        self.error_rate = error_rate  # share of calls answered 503, as during an APIM incident
+        self.slow_rate = slow_rate  # share of calls that take slow_ms instead of latency_ms
+        self.slow_ms = slow_ms
+        self.quota_per_second = quota_per_second  # APIM-style rate limit; excess calls get 429 (0: none)
+        self.capacity = capacity  # calls the backend works on at once; the rest queue (0: unlimited)
+        self.compress = compress  # gzip responses for clients sending Accept-Encoding: gzip
+        self.cost_rows = cost_rows
+        self.projects = projects
+        self.catalog_projects = catalog_projects  # projects in the PRF project list
+
+
+def _person(i: int) -> dict:
+    return {
+        "hanfordId": str(3000000 + i),
+        "name": f"Person {i}",
+        "email": f"person{i}@pnnl.gov",
+        "title": "Research Scientist",
+        "department": "Nuclear Sciences",
+        "location": "Richland",
+        "skills": ["Python", "Nuclear Reactors", "MCNP", "Thermal Hydraulics"][: 1 + i % 4],
+        "description": "Lorem ipsum dolor sit amet. " * 8,
+        "updatedAt": "2025-07-01T00:00:00Z",
+    }
+
+
+_PERSON_TEXT_FIELDS = ("name", "email", "title", "department", "location", "skills", "description")
+
+
+def _words(value) -> set:
+    return {word.lower() for item in (value if isinstance(value, list) else [value]) for word in re.findall(r"[^\W_]+", str(item or ""))}
+
+
+@lru_cache(maxsize=None)
+def _person_words(i: int) -> dict:
+    """Person i's lowercased words per text field, and under None all of them."""
+    person = _person(i)
+    words = {name: _words(person.get(name)) for name in _PERSON_TEXT_FIELDS}
+    words[None] = set().union(*words.values())
+    return words
+
+
+def _query_string_matches(i: int, query_string: str) -> bool:
+    """
+    Whether person i matches a `[field:]words` query_string with Elasticsearch's defaults: the
+    words are ORed and the field prefix scopes only the first word; the others search every text
+    field.
+    """
+    field, sep, text = query_string.partition(":")
+    words = _person_words(i)
+    terms = [word.lower() for word in (text if sep else query_string).split()]
+    return any(term in words.get(field.strip() if sep and n == 0 else None, ()) for n, term in enumerate(terms))
+
+
+def _cost_row(i: int, fiscal_year: str, resource_id: str, project: str) -> dict:
+    return {
+        "fiscalYear": fiscal_year,
+        "resourceID": resource_id,
+        "projectNumber": project,
+        "period": i % 12 + 1,
+        "costCategory": ["Labor", "Travel", "Materials", "Overhead"][i % 4],
+        "amount": round(1000 + (i * 37.5) % 900, 2),
+        "hours": 8 * (i % 20),
+    }
+
+
+_PROJECT_WORDS = (
+    ("Advanced", "Applied", "Coastal", "Grid", "Hydrogen", "Isotope", "Marine", "Nuclear", "Quantum", "Reactor", "Subsurface", "Wind"),
+    ("Carbon", "Climate", "Fuel", "Materials", "Modeling", "Resilience", "Safety", "Sensor", "Storage", "Transport", "Waste"),
+    ("Analytics", "Assessment", "Characterization", "Demonstration", "Development", "Initiative", "Operations", "Pilot", "Program", "Study"),
+)
+
+
+def _catalog_project(i: int) -> dict:
+    """Catalog project i: number 80000 + i and a distinct three-word name for i < 1320."""
+    first, second, third = _PROJECT_WORDS
+    name = f"{first[i % 12]} {second[i // 12 % 11]} {third[i // 132 % 10]}"
+    return {"projectNumber": str(80000 + i), "name": name, "manager": f"Person {i % 97}", "status": "Active"}
+
+
+class Cassette:
+    """
+    Upstream exchanges recorded by the tools' RECORD_CASSETTE_DIR valve. A request is answered with
+    the recordings of the same method and params in recorded order (so a recorded 429 is followed by
+    the retry's answer), falling back to any recording with the same param names; the URL path is
+    not matched, so recordings replay against any endpoint layout.
+    """
+
+    def __init__(self, entries: list, latency_scale: float = 1.0):
+        self.entries = sorted(entries, key=lambda entry: entry["ts"])
+        self.latency_scale = latency_scale  # multiplies the recorded latencies
+        self._exact = defaultdict(list)
+        self._shape = defaultdict(list)
+        for entry in self.entries:
+            self._exact[self._key(entry["method"], entry["params"])].append(entry)
+            self._shape[(entry["method"], tuple(sorted(entry["params"])))].append(entry)
+        self._turns = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, paths, latency_scale: float = 1.0) -> "Cassette":
+        """Read cassette files, or every *.jsonl file of a directory."""
+        entries = []
+        for path in map(Path, paths):
+            for file in sorted(path.glob("*.jsonl")) if path.is_dir() else [path]:
+                with open(file) as f:
+                    entries.extend(json.loads(line) for line in f if line.strip())
+        return cls(entries, latency_scale)
+
+    @staticmethod
+    def _key(method: str, params: dict) -> tuple:
+        return method, tuple(sorted(params.items()))
+
+    def lookup(self, method: str, params: dict) -> dict | None:
+        key = self._key(method, params)
+        candidates = self._exact.get(key) or self._shape.get((method, tuple(sorted(params))))
+        if not candidates:
+            return None
+        with self._lock:
+            turn = self._turns[key]
+            self._turns[key] += 1
+        return candidates[turn % len(candidates)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeUpstream/1.0"
+    # Headers and body go out in separate writes; with Nagle on, keep-alive connections would
+    # wait out the client's delayed ACK (~40 ms) on every response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _sleep(self, delay: float | None = None) -> None:
+        config = self.server.config
+        if delay is None:
+            delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+        if random.random() < config.slow_rate:
+            delay = config.slow_ms
+        time.sleep(max(0.0, delay) / 1000)
+
+    def _body(self) -> str:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length).decode() if length else ""
+
+    def _reply(self, payload, status: int = 200, headers: dict | None = None) -> None:
+        self._send_body(json.dumps(payload).encode(), status, {**(headers or {}), "Content-Type": "application/json"})
+
+    def _send_body(self, body: bytes, status: int, headers: dict) -> None:
+        if self.command == "GET" and status == 200:
+            # Replayed responses keep their recorded validators.
+            recorded = {k.lower(): v for k, v in headers.items()}
+            etag = recorded.get("etag") or f'"{zlib.crc32(body):08x}"'
+            headers = {k: v for k, v in headers.items() if k.lower() not in ("etag", "last-modified")}
+            headers.update({"ETag": etag, "Last-Modified": recorded.get("last-modified", "Tue, 01 Jul 2025 00:00:00 GMT")})
+            if self.headers.get("If-None-Match") == etag:
+                self.server.record("not_modified")
+                status, body = 304, b""
+        if body and self.server.config.compress and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=5)
+            headers = {**headers, "Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+        self.server.record_bytes(len(body))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _replay(self, recorded: dict | None, route: str) -> None:
+        if recorded is None:
+            self.server.record("unrecorded")
+            return self._reply({"error": f"no recording for {route}"}, 404)
+        self.server.record(f"replayed {recorded['tool']}")
+        headers = {"Content-Type": "application/json", **recorded["headers"]}
+        self._send_body(recorded["body"].encode(), recorded["status"], headers)
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+    def do_HEAD(self):
+        # Connection warm-ups: answered by the gateway itself, without auth or a body.
+        self.server.record("head")
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _route(self, method: str) -> None:
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self._body() if method in ("POST", "DELETE") else ""
+        is_json = self.headers.get("Content-Type", "").startswith("application/json")
+        form = {} if is_json else {k: v[0] for k, v in parse_qs(body).items()}
+        search = json.loads(body) if is_json and body else {}
+        route = url.path.rstrip("/")
+        config = self.server.config
+        if route.endswith("/oauth2/v2.0/token"):
+            self.server.record("token")
+            self._sleep()
+            return self._reply(
+                {"token_type": "Bearer", "expires_in": 3600, "access_token": "fake-token"}
+            )
+        if self.headers.get("Authorization") != "Bearer fake-token":
+            return self._reply({"error": "unauthorized"}, 401)
+        if not self.server.admit():
+            self.server.record("throttled")
+            return self._reply({"statusCode": 429, "message": "Rate limit is exceeded."}, 429, {"Retry-After": "1"})
+        cassette = self.server.cassette
+        recorded = delay = None
+        if cassette is not None and not route.startswith("/es"):
+            recorded = cassette.lookup(method, query if method == "GET" else form)
+            delay = recorded["latency"] * cassette.latency_scale * 1000 if recorded else 0.0
+        with self.server.working():
+            if config.capacity:
+                with self.server.backend:
+                    self._sleep(delay)
+            else:
+                self._sleep(delay)
+        if random.random() < config.error_rate:
+            self.server.record("failed")
+            return self._reply({"error": "service unavailable"}, 503)
+        if delay is not None:
+            return self._replay(recorded, route)
+        if route == "/hub":
+            self.server.record("hub")
+            # Different search terms find overlapping but different people, as the real Hub does.
+            start = zlib.crc32(form.get("searchTerm", "").encode()) % max(1, config.people)
+            people = [_person(start + i) for i in range(config.people)]
+            return self._reply({"query": query or form, "results": people})
+        if route == "/costs":
+            self.server.record("costs")
+            rows = [
+                _cost_row(i, form.get("fiscalYear", ""), form.get("resourceID", ""), form.get("projectNumber", ""))
+                for i in range(config.cost_rows)
+            ]
+            return self._reply({"costs": rows})
+        if route == "/projects/catalog":
+            self.server.record("project_catalog")
+            return self._reply({"projects": [_catalog_project(i) for i in range(config.catalog_projects)]})
+        if route == "/projects":
+            self.server.record("projects")
+            number = int(query["q"]) - 80000 if query.get("q", "").isdigit() else -1
+            if 0 <= number < config.catalog_projects:  # a project number: that project's full record
+                return self._reply({"projects": [{**_catalog_project(number), "budget": 250000, "tasks": ["01", "02"]}]})
+            projects = [
+                {"projectNumber": str(80000 + i), "name": f"Project {i}", "query": query.get("q")}
+                for i in range(config.projects)
+            ]
+            return self._reply({"projects": projects})
+        if route.endswith("/_pit"):
+            self.server.record("elasticsearch_pit")
+            if method == "DELETE":
+                return self._reply({"succeeded": True, "num_freed": 1})
+            return self._reply({"id": "fake-pit"})
+        if route.endswith("/_search"):
+            self.server.record("elasticsearch")
+            size = int(search.get("size", query.get("size", 10)))
+            fields = search.get("_source", query.get("_source_includes", "").split(",") if "_source_includes" in query else True)
+            updated_after = search.get("query", {}).get("range", {}).get("updatedAt", {}).get("gt")
+            query_string = search.get("query", {}).get("query_string", {}).get("query")
+            start = search["search_after"][-1] + 1 if search.get("search_after") else 0
+            hits = []
+            total = config.index_people
+            if query_string is None:
+                ids = range(start, min(start + size, config.index_people))
+            else:  # evaluated over the whole index for the total; fine at stand-in sizes
+                matching = [i for i in range(config.index_people) if _query_string_matches(i, query_string)]
+                total = len(matching)
+                ids = [i for i in matching if i >= start][:size]
+            for i in ids:
+                source = _person(i) if fields is True else {k: v for k, v in _person(i).items() if k in fields}
+                if updated_after is not None and _person(i)["updatedAt"] <= updated_after:
+                    continue
+                hits.append(
+                    {"_index": "hub-suggestions-people", "_id": str(i), "_score": 1.0, "_source": source, "sort": [1.0, i]}
+                )
+            payload = {"took": 1, "_shards": {"total": 1}, "hits": {"total": {"value": total}, "hits": hits}}
+            if "pit" in search:
+                payload["pit_id"] = search["pit"]["id"]
+            return self._reply(payload)
+        self._reply({"error": f"no route for {route}"}, 404)
+
+
+class FakeUpstreams(ThreadingHTTPServer):
+    """Threaded stand-in server; use as a context manager to run it in the background."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, config: UpstreamConfig | None = None, port: int = 0, cassette: Cassette | None = None):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.config = config or UpstreamConfig()
+        self.cassette = cassette
+        self.backend = threading.Semaphore(max(1, self.config.capacity))
+        self.calls = Counter()
+        self.bytes_sent = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0  # most calls the backend worked on (or queued for) at once
+        self._lock = threading.Lock()
+        self._allowance = None
+        self._allowance_at = time.monotonic()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def handle_error(self, request, client_address) -> None:
+        # Clients hang up on purpose (cancelled hedges, timeouts); only report real failures.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def admit(self) -> bool:
+        """Token bucket of quota_per_second calls (one second of burst), as APIM's rate-limit policy."""
+        rate = self.config.quota_per_second
+        if not rate:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self._allowance is None:
+                self._allowance = rate
+            self._allowance = min(rate, self._allowance + (now - self._allowance_at) * rate)
+            self._allowance_at = now
+            if self._allowance < 1:
+                return False
+            self._allowance -= 1
+            return True
+
+    def record(self, route: str) -> None:
+        with self._lock:
+            self.calls[route] += 1
+
+    @contextmanager
+    def working(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def record_bytes(self, count: int) -> None:
+        with self._lock:
+            self.bytes_sent += count
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class _AccessToken:
+    def __init__(self, token: str, expires_on: int):
+        self.token = token
+        self.expires_on = expires_on
+
+
+def fake_credential_class(base_url: str):
+    """
+    Return a drop-in for azure.identity.ClientSecretCredential that mints tokens from the
+    fake token endpoint (azure-identity only talks https to a real authority).
+    """
+
+    class FakeClientSecretCredential:
+        def __init__(self, tenant_id, client_id, client_secret, **kwargs):
+            self._url = f"{base_url}/{tenant_id or 'tenant'}/oauth2/v2.0/token"
+            self._form = {"client_id": client_id, "client_secret": client_secret, "grant_type": "client_credentials"}
+
+        def get_token(self, *scopes, **kwargs):
+            body = httpx.post(self._url, data={**self._form, "scope": " ".join(scopes)}).json()
+            return _AccessToken(body["access_token"], int(time.time()) + body["expires_in"])
+
+    return FakeClientSecretCredential
+
+
+def fake_msal_app_class(base_url: str):
+    """
+    Return a drop-in for msal.ConfidentialClientApplication backed by the fake token endpoint.
+    Like MSAL it answers from its token cache (the `token_cache` given, e.g. a file-backed
+    PersistedTokenCache, or a private in-memory one) until the token is within 5 minutes of expiry.
+    """
+
+    class FakeConfidentialClientApplication:
+        def __init__(self, client_id, client_credential=None, authority=None, token_cache=None, **kwargs):
+            self._client_id = client_id
+            self._authority = (authority or "https://login.microsoftonline.com/tenant/").rstrip("/")
+            self._credential = fake_credential_class(base_url)("tenant", client_id, client_credential)
+            self._cache = token_cache if token_cache is not None else msal.TokenCache()
+
+        def acquire_token_for_client(self, scopes, **kwargs):
+            cached = self._cache.search(
+                msal.TokenCache.CredentialType.ACCESS_TOKEN, target=scopes, query={"client_id": self._client_id}
+            )
+            for entry in cached:
+                if int(entry["expires_on"]) - 300 > time.time():
+                    return {"access_token": entry["secret"], "token_type": "Bearer", "token_source": "cache"}
+            token = self._credential.get_token(*scopes)
+            response = {"access_token": token.token, "expires_in": 3600, "token_type": "Bearer"}
+            self._cache.add(
+                {
+                    "client_id": self._client_id,
+                    "scope": scopes,
+                    "token_endpoint": f"{self._authority}/oauth2/v2.0/token",  # cache keys use the real authority
+                    "response": dict(response),
+                }
+            )
+            return response
+
+    return FakeConfidentialClientApplication
+
+
+@contextmanager
+def served_in_subprocess(config: UpstreamConfig | None = None):
+    """Run FakeUpstreams(config) in a child process and yield its base URL (no call counts)."""
+    options = json.dumps(vars(config or UpstreamConfig()))
+    process = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), options], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+    )
+    try:
+        yield process.stdout.readline().strip()
+    finally:
+        process.stdin.close()  # the child stops serving when its stdin closes
+        process.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    with FakeUpstreams(UpstreamConfig(**json.loads(sys.argv[1]))) as upstreams:
+        print(upstreams.base_url, flush=True)
+        sys.stdin.read()
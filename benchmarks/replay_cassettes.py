@@ -0,0 +1,156 @@
+"""
+Replay recorded production traffic against the tools offline, at a multiple of its recorded rate.
+
+Record by setting the RECORD_CASSETTE_DIR valve of the hub, cost and PRF tools: each upstream
+exchange is appended as a sanitized JSON line (no request headers or tokens). This script serves
+those recordings from the local stand-in in fake_upstreams.py, each after its recorded latency, and
+re-issues the recorded calls through the Tools open-loop at the recorded spacing divided by --rate,
+so --rate 5 offers five times the production load. Rates past the saturation point show up as
+throughput falling behind the offered rate and p95 climbing.
+
+    python benchmarks/replay_cassettes.py cassettes/ --rate 1 2 5 10
+    python benchmarks/replay_cassettes.py cassettes/hub-4242.jsonl --rate 20 --capacity 16 --valve SEARCH_CACHE_TTL=0
+
+Only first attempts are re-issued; the recorded retries are served to the Tools' own retries. Calls
+map to tool methods by their params: name -> search_internal_users_by_name, searchTerm ->
+search_internal_users, fiscalYear -> search_costs (search_costs_many when recorded as batch),
+q -> search_projects.
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import sys
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from fake_upstreams import Cassette, FakeUpstreams, UpstreamConfig, fake_credential_class
+from run_benchmarks import _configure, _is_error, load_tool_module
+
+
+def _local(base_url: str, endpoint: str) -> str:
+    """The stand-in URL for an endpoint, keeping its path (PRF's placeholder has no scheme)."""
+    return base_url + "/" + urlparse(endpoint).path.lstrip("/")
+
+
+def build_tools(base_url: str, valves: dict) -> dict:
+    """Fresh hub, cost and PRF Tools pointed at the stand-in, so no run starts with a warm cache."""
+    credential = fake_credential_class(base_url)
+    tools = {}
+    for name, path in (
+        ("hub", "cost_estimator/hub_search_tool.py"),
+        ("cost", "cost_estimator/cost_estimator_tool.py"),
+        ("prf", "prf/pfr_tool.py"),
+    ):
+        module = load_tool_module(path)
+        module.ClientSecretCredential = credential
+        tool = _configure(module.Tools(), {**valves, "RECORD_CASSETTE_DIR": ""})
+        tool._ENDPOINT = _local(base_url, tool._ENDPOINT)
+        if name == "cost":
+            tool._HUB_ENDPOINT = _local(base_url, tool._HUB_ENDPOINT)
+        tools[name] = tool
+    return tools
+
+
+def tool_call(tools: dict, entry: dict):
+    """Return (tool name, awaitable) re-issuing a recorded upstream call, or None if unknown."""
+    params = entry["params"]
+    if "name" in params:
+        return "hub", tools["hub"].search_internal_users_by_name(params["name"])
+    if "searchTerm" in params:
+        return "hub", tools["hub"].search_internal_users(params["searchTerm"], params.get("hasAvailability") != "False")
+    if "fiscalYear" in params:
+        lookup = (params["fiscalYear"], params["resourceID"], params["projectNumber"])
+        if entry.get("priority") == "batch":
+            return "cost", tools["cost"].search_costs_many([list(lookup)])
+        return "cost", tools["cost"].search_costs(*lookup)
+    if "q" in params:
+        return "prf", tools["prf"].search_projects(params["q"])
+    return None
+
+
+async def replay(entries: list, tools: dict, rate: float, loops: int) -> dict:
+    """Fire the recorded calls open-loop at `rate` x the recorded pace; return the outcome."""
+    span = entries[-1]["ts"] - entries[0]["ts"]
+    latencies = []
+    errors = Counter()
+    skipped = 0
+    tasks = []
+
+    async def one(name, call):
+        started = time.perf_counter()
+        try:
+            result = await call
+        except Exception:
+            result = {"error": "raised"}
+        latencies.append(time.perf_counter() - started)
+        errors[name] += _is_error(result)
+
+    started = time.perf_counter()
+    for loop in range(loops):
+        for entry in entries:
+            offset = (loop * span + entry["ts"] - entries[0]["ts"]) / rate
+            delay = started + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            call = tool_call(tools, entry)
+            if call is None:
+                skipped += 1
+                continue
+            tasks.append(asyncio.create_task(one(*call)))
+    offered = time.perf_counter() - started
+    await asyncio.gather(*tasks)
+    wall = time.perf_counter() - started
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "calls": len(tasks),
+        "skipped": skipped,
+        "offered_rps": len(tasks) / offered if offered else float(len(tasks)),
+        "throughput_rps": len(tasks) / wall if wall else 0.0,
+        "p50_ms": cuts[49] * 1000 if cuts else 0.0,
+        "p95_ms": cuts[94] * 1000 if cuts else 0.0,
+        "p99_ms": cuts[98] * 1000 if cuts else 0.0,
+        "errors": {name: count for name, count in errors.items() if count},
+    }
+
+
+async def run(args) -> None:
+    cassette = Cassette.load(args.cassettes, args.latency_scale)
+    entries = [entry for entry in cassette.entries if not entry.get("retry")]
+    if not entries:
+        sys.exit("no recorded calls found")
+    span = entries[-1]["ts"] - entries[0]["ts"]
+    mix = Counter(entry["tool"] for entry in entries)
+    print(f"{len(entries)} recorded calls over {span:.1f}s ({dict(mix)}), {len(cassette.entries)} exchanges")
+    valves = dict(item.split("=", 1) for item in args.valve or [])
+    config = UpstreamConfig(capacity=args.capacity, quota_per_second=args.quota)
+    with FakeUpstreams(config, cassette=cassette) as upstreams:
+        for rate in args.rate:
+            before = dict(upstreams.calls)
+            report = await replay(entries, build_tools(upstreams.base_url, valves), rate, args.loop)
+            calls = {k: v - before.get(k, 0) for k, v in upstreams.calls.items() if v - before.get(k, 0)}
+            print(
+                f"x{rate:<6g} offered {report['offered_rps']:8.1f} calls/s  served {report['throughput_rps']:8.1f} calls/s  "
+                f"p50 {report['p50_ms']:8.1f} ms  p95 {report['p95_ms']:8.1f} ms  p99 {report['p99_ms']:8.1f} ms  "
+                f"errors {report['errors']}  upstream {calls}"
+            )
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("cassettes", nargs="+", help="cassette files or RECORD_CASSETTE_DIR directories")
+    parser.add_argument("--rate", type=float, nargs="+", default=[1.0], help="multiples of the recorded rate to replay at")
+    parser.add_argument("--loop", type=int, default=1, help="replay the recording this many times back to back")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply the recorded upstream latencies")
+    parser.add_argument("--capacity", type=int, default=0, help="calls the stand-in serves at once (0: unlimited)")
+    parser.add_argument("--quota", type=float, default=0.0, help="stand-in calls per second before 429s (0: none)")
+    parser.add_argument("--valve", action="append", metavar="NAME=VALUE", help="override a tool valve, e.g. SEARCH_CACHE_TTL=0")
+    args = parser.parse_args(argv)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
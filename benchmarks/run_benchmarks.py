@@ -0,0 +1,280 @@
+"""
+Offline benchmark for the enterprise tools against the local stand-ins in fake_upstreams.py.
+
+Drives hub_search_tool.Tools, cost_estimator_tool.Tools, pfr_tool.Tools, the
+hub_search_pipeline_via_tools Pipeline and the hub_search_mcp tools at a fixed concurrency and
+reports p50/p95/p99 latency, throughput, peak allocation per call and upstream call counts.
+
+    python benchmarks/run_benchmarks.py --requests 500 --concurrency 50 --latency-ms 40
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --baseline bench.json --max-regression 0.25
+    python benchmarks/run_benchmarks.py --slow-rate 0.05 --valve HEDGE_GETS=true --only by_name prf
+    python benchmarks/run_benchmarks.py --quota 100 --valve RATE_LIMIT_PER_SECOND=95 --only cost
+
+With --baseline the run exits non-zero when any scenario's p95 latency or throughput regresses
+by more than --max-regression, so it can gate CI.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from pydantic import TypeAdapter
+
+from fake_upstreams import FakeUpstreams, UpstreamConfig, fake_credential_class, fake_msal_app_class, served_in_subprocess
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+def load_tool_module(relative_path: str):
+    """Load a tool file the way Open WebUI does: as a standalone module from its path."""
+    path = REPO / relative_path
+    name = "bench_" + path.stem
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _is_error(result) -> bool:
+    return isinstance(result, dict) and "error" in result
+
+
+def _query(prefix: str, i: int, distinct: int) -> str:
+    return f"{prefix} {i % distinct if distinct else i}"
+
+
+def _configure(tool, valves: dict):
+    """Apply the --valve overrides that exist on this tool's Valves, validated like Open WebUI does."""
+    fields = tool.Valves.model_fields
+    for name, value in valves.items():
+        if name in fields:
+            setattr(tool.valves, name, TypeAdapter(fields[name].annotation).validate_python(value))
+    return tool
+
+
+def build_scenarios(base_url: str, distinct: int, valves: dict | None = None) -> dict:
+    """
+    Return {scenario name: factory}. A factory returns `call(i)` producing an awaitable, or raises
+    to skip the scenario. Synchronous tools run in worker threads, as their servers would.
+    """
+    credential = fake_credential_class(base_url)
+    valves = valves or {}
+
+    def hub(method: str):
+        module = load_tool_module("cost_estimator/hub_search_tool.py")
+        module.ClientSecretCredential = credential
+        tool = _configure(module.Tools(), valves)
+        tool._ENDPOINT = f"{base_url}/hub"
+        if method == "search":
+            return lambda i: tool.search_internal_users(_query("skill", i, distinct), True)
+        if method == "terms":
+            return lambda i: tool.search_internal_users_by_terms(
+                [_query("skill", i, distinct), _query("topic", i, distinct), _query("tool", i, distinct)]
+            )
+        return lambda i: tool.search_internal_users_by_name(_query("name", i, distinct))
+
+    def cost(method: str = "search"):
+        module = load_tool_module("cost_estimator/cost_estimator_tool.py")
+        module.ClientSecretCredential = credential
+        tool = _configure(module.Tools(), valves)
+        tool._ENDPOINT = f"{base_url}/costs"
+        if method == "person":
+            tool._HUB_ENDPOINT = f"{base_url}/hub"
+            return lambda i: tool.search_person_costs(_query("name", i, distinct), 83848, ["2024", "2025"])
+        return lambda i: tool.search_costs("2025", 3000000 + (i % distinct if distinct else i), 83848)
+
+    def prf():
+        module = load_tool_module("prf/pfr_tool.py")
+        module.ClientSecretCredential = credential
+        tool = _configure(module.Tools(), valves)
+        tool._ENDPOINT = f"{base_url}/projects"
+        return lambda i: tool.search_projects(_query("project", i, distinct))
+
+    def pipeline():
+        module = load_tool_module("cost_estimator/hub_search_pipeline_via_tools.py")
+        module.ConfidentialClientApplication = fake_msal_app_class(base_url)
+        module.Pipeline._ENDPOINT = f"{base_url}/hub"
+        tools = module.Pipeline().tools
+        return lambda i: asyncio.to_thread(tools.search_internal_users, _query("skills:", i, distinct))
+
+    def mcp():
+        module = load_tool_module("cost_estimator/hub_search_mcp.py")
+        module.ClientSecretCredential = credential
+        module.PEOPLE_SEARCH_URL = f"{base_url}/es/hub-suggestions-people/_search"
+        # Every stand-in person lists Python, so each search still returns a full page.
+        return lambda i: module.search_user(_query("skills:Python", i, distinct))
+
+    return {
+        "hub.search_internal_users": lambda: hub("search"),
+        "hub.search_internal_users_by_name": lambda: hub("name"),
+        "hub.search_internal_users_by_terms": lambda: hub("terms"),
+        "cost.search_costs": cost,
+        "cost.search_person_costs": lambda: cost("person"),
+        "prf.search_projects": prf,
+        "pipeline.search_internal_users": pipeline,
+        "mcp.search_user": mcp,
+    }
+
+
+async def run_scenario(call, requests: int, concurrency: int, offset: int = 0) -> tuple[list, int, float]:
+    """Fire `requests` calls at `concurrency`; return (latencies in seconds, errors, wall time)."""
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            result = await call(offset + i)
+            latencies.append(time.perf_counter() - started)
+            errors += _is_error(result)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies, errors, time.perf_counter() - started
+
+
+async def measure_allocations(call, samples: int, offset: int) -> float:
+    """
+    Mean peak traced allocation, in KiB, of one sequential call. tracemalloc sees every thread of
+    the process, so `call` should talk to a stand-in served from another process.
+    """
+    peaks = []
+    tracemalloc.start()
+    try:
+        for i in range(samples):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            await call(offset + i)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return statistics.fmean(peaks) / 1024 if peaks else 0.0
+
+
+def summarize(name: str, latencies: list, errors: int, wall: float, alloc_kib: float, calls: dict, args) -> dict:
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "concurrency": args.concurrency,
+        "p50_ms": round(cuts[49] * 1000, 2),
+        "p95_ms": round(cuts[94] * 1000, 2),
+        "p99_ms": round(cuts[98] * 1000, 2),
+        "throughput_rps": round(len(latencies) / wall, 1) if wall else 0.0,
+        "alloc_kib_per_call": round(alloc_kib, 1),
+        "errors": errors,
+        "upstream_calls": calls,
+    }
+
+
+async def run_all(args) -> list:
+    config = UpstreamConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        people=args.people,
+        cost_rows=args.cost_rows,
+        projects=args.projects,
+        error_rate=args.error_rate,
+        slow_rate=args.slow_rate,
+        slow_ms=args.slow_ms,
+        quota_per_second=args.quota,
+    )
+    reports = []
+    with FakeUpstreams(config) as upstreams, served_in_subprocess(config) as alloc_url:
+        valves = dict(item.split("=", 1) for item in args.valve or [])
+        # Allocations are traced against the out-of-process stand-in, so its request handling
+        # does not count towards the tool's.
+        alloc_factories = build_scenarios(alloc_url, args.distinct, valves)
+        for name, factory in build_scenarios(upstreams.base_url, args.distinct, valves).items():
+            if args.only and not any(part in name for part in args.only):
+                continue
+            try:
+                call = factory()
+                alloc_call = alloc_factories[name]()
+            except Exception as e:  # missing optional runtime (e.g. pipelines blueprints)
+                print(f"{name:40s} skipped: {e}")
+                continue
+            await run_scenario(call, min(args.warmup, args.requests), args.concurrency, offset=-args.warmup)
+            before = dict(upstreams.calls)
+            latencies, errors, wall = await run_scenario(call, args.requests, args.concurrency)
+            calls = {k: v - before.get(k, 0) for k, v in upstreams.calls.items() if v - before.get(k, 0)}
+            await run_scenario(alloc_call, min(args.warmup, args.requests), args.concurrency, offset=-args.warmup)
+            alloc = await measure_allocations(alloc_call, args.alloc_samples, offset=args.requests)
+            report = summarize(name, latencies, errors, wall, alloc, calls, args)
+            reports.append(report)
+            print(
+                f"{name:40s} p50 {report['p50_ms']:8.1f} ms  p95 {report['p95_ms']:8.1f} ms  "
+                f"p99 {report['p99_ms']:8.1f} ms  {report['throughput_rps']:8.1f} req/s  "
+                f"{report['alloc_kib_per_call']:7.1f} KiB/call  errors {errors}  upstream {calls}"
+            )
+    return reports
+
+
+def check_regressions(reports: list, baseline_path: str, tolerance: float) -> list:
+    baseline = {r["scenario"]: r for r in json.loads(Path(baseline_path).read_text())}
+    failures = []
+    for report in reports:
+        previous = baseline.get(report["scenario"])
+        if previous is None:
+            continue
+        if report["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            failures.append(f"{report['scenario']}: p95 {previous['p95_ms']} -> {report['p95_ms']} ms")
+        if report["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            failures.append(
+                f"{report['scenario']}: throughput {previous['throughput_rps']} -> {report['throughput_rps']} req/s"
+            )
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=200, help="measured calls per scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="calls in flight at once")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured calls before each scenario")
+    parser.add_argument("--distinct", type=int, default=0, help="distinct queries in the mix (0: every call unique)")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="stand-in upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="+/- random latency jitter")
+    parser.add_argument("--people", type=int, default=25, help="people per Hub/ES response")
+    parser.add_argument("--cost-rows", type=int, default=12, help="rows per cost response")
+    parser.add_argument("--projects", type=int, default=10, help="projects per PRF response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls answered 503")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of upstream calls delayed to --slow-ms")
+    parser.add_argument("--slow-ms", type=float, default=2000.0, help="latency of the slow calls")
+    parser.add_argument("--quota", type=float, default=0.0, help="gateway calls per second before 429s (0: none)")
+    parser.add_argument("--alloc-samples", type=int, default=20, help="sequential calls traced for allocations")
+    parser.add_argument("--valve", action="append", metavar="NAME=VALUE", help="override a tool valve, e.g. HEDGE_GETS=true")
+    parser.add_argument("--only", nargs="*", help="run only scenarios whose name contains one of these")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report of a previous run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed p95/throughput regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    # httpx logs every request at INFO once FastMCP configures logging; keep the report readable.
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    reports = asyncio.run(run_all(args))
+    if args.output:
+        Path(args.output).write_text(json.dumps(reports, indent=2))
+    if args.baseline:
+        failures = check_regressions(reports, args.baseline, args.max_regression)
+        for failure in failures:
+            print("REGRESSION", failure)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
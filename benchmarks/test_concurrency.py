@@ -0,0 +1,43 @@
+"""
+Concurrency check for the async tool methods against the local stand-ins in fake_upstreams.py:
+50 calls gathered on one event loop must reach the upstream together, not one after another.
+
+    python -m pytest benchmarks/test_concurrency.py
+"""
+
+import asyncio
+import logging
+import time
+
+import pytest
+
+from fake_upstreams import FakeUpstreams, UpstreamConfig
+from run_benchmarks import build_scenarios
+
+CALLS = 50
+LATENCY_MS = 100.0
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+@pytest.mark.parametrize("scenario", ["hub.search_internal_users", "cost.search_costs", "prf.search_projects"])
+def test_concurrent_calls_overlap(scenario):
+    async def run(upstreams):
+        call = build_scenarios(upstreams.base_url, distinct=0)[scenario]()
+        await call(0)  # token and connection set-up, not measured
+        started = time.perf_counter()
+        result = await call(1)
+        single = time.perf_counter() - started
+        assert "error" not in result
+        upstreams.peak_in_flight = 0
+        started = time.perf_counter()
+        results = await asyncio.gather(*(call(2 + i) for i in range(CALLS)))
+        return single, time.perf_counter() - started, results
+
+    with FakeUpstreams(UpstreamConfig(latency_ms=LATENCY_MS, jitter_ms=0)) as upstreams:
+        single, wall, results = asyncio.run(run(upstreams))
+        peak = upstreams.peak_in_flight
+
+    assert not [result for result in results if isinstance(result, dict) and "error" in result]
+    assert peak > 1, f"{scenario}: the upstream never saw two calls at once"
+    assert wall < CALLS * single / 5, f"{scenario}: {CALLS} calls took {wall:.2f}s, one takes {single:.2f}s"
@@ -0,0 +1,99 @@
+"""
+Unit tests for the cost tool's roll-up of cost responses and its on-disk cost cache, which keeps
+closed fiscal years forever and lets the current one expire after COST_CACHE_TTL.
+
+    python -m pytest benchmarks/test_cost_estimator_tool.py
+"""
+
+from datetime import date
+
+import pytest
+
+from run_benchmarks import load_tool_module
+
+
+@pytest.fixture(scope="module")
+def cost():
+    return load_tool_module("cost_estimator/cost_estimator_tool.py")
+
+
+def params(fiscal_year, resource_id=3000001, project_number=83848):
+    return {"fiscalYear": fiscal_year, "resourceID": resource_id, "projectNumber": project_number}
+
+
+# Aggregation
+
+
+def test_costs_are_totalled_by_year_resource_and_category(cost):
+    responses = {
+        ("2024", "R1"): [{"amount": "10.5", "category": "Labor"}, {"amount": 4, "category": "Travel"}],
+        ("2025", "R1"): {"count": 1, "costs": [{"amount": 2.25, "category": "Labor"}]},
+        ("2025", "R2"): [{"amount": 1, "category": None}],
+    }
+    summary = cost._aggregate_costs(responses, "amount", "category", top_resources=5)
+    assert summary["total"] == 17.75
+    assert summary["rows"] == 4 and summary["skipped_rows"] == 0
+    assert summary["by_fiscal_year"] == {"2024": 14.5, "2025": 3.25}
+    assert summary["by_category"] == {"Labor": 12.75, "Travel": 4.0, "Uncategorized": 1.0}
+    assert summary["by_resource"] == {"R1": 16.75, "R2": 1.0}
+    assert summary["table"] == {
+        "columns": ["fiscalYear", "Labor", "Travel", "Uncategorized", "total"],
+        "rows": [["2024", 10.5, 4.0, 0.0, 14.5], ["2025", 2.25, 0.0, 1.0, 3.25]],
+    }
+
+
+def test_rows_without_a_numeric_amount_are_counted_and_skipped(cost):
+    responses = {("2025", "R1"): [{"amount": 1}, {"amount": None}, {"amount": "n/a"}, {"category": "Labor"}], ("2025", "R2"): {"error": "API call failed"}}
+    summary = cost._aggregate_costs(responses, "amount", "category", top_resources=5)
+    assert summary["total"] == 1.0
+    assert summary["rows"] == 1 and summary["skipped_rows"] == 3
+
+
+def test_resources_beyond_the_top_are_folded_together(cost):
+    responses = {("2025", f"R{i}"): [{"amount": i}] for i in range(1, 5)}
+    summary = cost._aggregate_costs(responses, "amount", "category", top_resources=2)
+    assert summary["by_resource"] == {"R4": 4.0, "R3": 3.0, "2 other resources": 3.0}
+    assert summary["total"] == 10.0
+
+
+def test_fiscal_year_starts_in_october(cost):
+    assert cost._current_fiscal_year(date(2025, 9, 30)) == "2025"
+    assert cost._current_fiscal_year(date(2025, 10, 1)) == "2026"
+
+
+# On-disk cost cache
+
+
+def test_cache_round_trips_responses_under_a_normalized_key(cost, tmp_path):
+    cache, path = cost._CostDiskCache(), str(tmp_path / "costs.db")
+    current = cost._current_fiscal_year()
+    assert cache.get(path, params(current), 60) is None
+    cache.put(path, params(current), [{"amount": 1.5}])
+    assert cache.get(path, {"fiscalYear": f" {current} ", "resourceID": "3000001", "projectNumber": "83848"}, 60) == [{"amount": 1.5}]
+    assert cache.get(path, params(current, resource_id=3000002), 60) is None
+    assert cache.stats == {"hits": 1, "misses": 2, "stores": 1}
+
+
+def test_only_the_current_fiscal_year_expires(cost, tmp_path):
+    cache, path = cost._CostDiskCache(), str(tmp_path / "costs.db")
+    current = cost._current_fiscal_year()
+    closed, future = str(int(current) - 1), str(int(current) + 1)
+    for fiscal_year in (closed, current, future):
+        cache.put(path, params(fiscal_year), [{"fiscalYear": fiscal_year}])
+    assert cache.get(path, params(closed), -1) == [{"fiscalYear": closed}]
+    assert cache.get(path, params(current), -1) is None
+    assert cache.get(path, params(future), -1) is None
+    assert cache.get(path, params("FY25"), -1) is None, "a year that is not a number is never treated as closed"
+
+
+def test_cache_is_shared_through_the_file(cost, tmp_path):
+    path = str(tmp_path / "costs.db")
+    cost._CostDiskCache().put(path, params("2020"), {"costs": []})
+    assert cost._CostDiskCache().get(path, params("2020"), 60) == {"costs": []}
+
+
+def test_an_unusable_cache_file_only_costs_a_miss(cost, tmp_path):
+    cache, path = cost._CostDiskCache(), str(tmp_path)  # a directory cannot be opened as a database
+    cache.put(path, params("2020"), [])
+    assert cache.get(path, params("2020"), 60) is None
+    assert cache.stats == {"hits": 0, "misses": 1, "stores": 0}
@@ -0,0 +1,347 @@
+"""
+Unit tests for the resilience and caching pieces of the hub tool: the response cache (TTL,
+stale-while-revalidate, LRU eviction, ETag revalidation), the per-upstream circuit breaker, the
+gateway token buckets, admission control and reciprocal rank fusion. Time is moved by editing
+the recorded timestamps rather than by sleeping, except where a wait is the behavior under test.
+
+    python -m pytest benchmarks/test_hub_search_tool.py
+"""
+
+import asyncio
+import logging
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from fake_upstreams import FakeUpstreams, UpstreamConfig, fake_credential_class
+from run_benchmarks import load_tool_module
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+@pytest.fixture(scope="module")
+def hub():
+    return load_tool_module("cost_estimator/hub_search_tool.py")
+
+
+def cache_valves(**overrides):
+    return SimpleNamespace(**{"CACHE_STALE_TTL": 60.0, "CACHE_MAX_ENTRIES": 100, "CACHE_MAX_BYTES": 1 << 20, **overrides})
+
+
+def breaker_valves(**overrides):
+    return SimpleNamespace(**{"CIRCUIT_FAILURE_THRESHOLD": 3, "CIRCUIT_RESET_TIMEOUT": 30.0, **overrides})
+
+
+def counting_fetch(*values):
+    """An async fetch returning `values` in turn, counting its calls in `.calls`."""
+    async def fetch():
+        fetch.calls += 1
+        return values[min(fetch.calls, len(values)) - 1]
+    fetch.calls = 0
+    return fetch
+
+
+def expire(cache, key, seconds_ago: float = 1.0) -> None:
+    value, size, _, validators = cache._entries[key]
+    cache._entries[key] = (value, size, time.monotonic() - seconds_ago, validators)
+
+
+# Response cache
+
+
+def test_cache_serves_fresh_entries_without_fetching(hub):
+    async def run():
+        cache, fetch = hub._ResponseCache(), counting_fetch({"v": 1})
+        first = await cache.get_or_fetch("k", fetch, 60, cache_valves())
+        second = await cache.get_or_fetch("k", fetch, 60, cache_valves())
+        return cache, fetch, first, second
+
+    cache, fetch, first, second = asyncio.run(run())
+    assert first == second == {"v": 1}
+    assert fetch.calls == 1
+    assert cache.stats["misses"] == 1 and cache.stats["hits"] == 1
+
+
+def test_cache_is_bypassed_with_a_zero_ttl_and_never_stores_errors(hub):
+    async def run():
+        cache = hub._ResponseCache()
+        uncached, errors = counting_fetch({"v": 1}), counting_fetch({"error": "API call failed"})
+        for _ in range(2):
+            await cache.get_or_fetch("zero", uncached, 0, cache_valves())
+            await cache.get_or_fetch("error", errors, 60, cache_valves())
+        return cache, uncached, errors
+
+    cache, uncached, errors = asyncio.run(run())
+    assert uncached.calls == 2 and errors.calls == 2
+    assert not cache._entries
+
+
+def test_cache_serves_stale_entries_while_refreshing_in_the_background(hub):
+    async def run():
+        cache, fetch = hub._ResponseCache(), counting_fetch({"v": 1}, {"v": 2})
+        await cache.get_or_fetch("k", fetch, 60, cache_valves())
+        expire(cache, "k")
+        stale = await cache.get_or_fetch("k", fetch, 60, cache_valves())
+        refreshing = list(cache._refreshing.values())
+        await asyncio.gather(*refreshing)
+        fresh = await cache.get_or_fetch("k", fetch, 60, cache_valves())
+        return cache, fetch, stale, len(refreshing), fresh
+
+    cache, fetch, stale, refreshes, fresh = asyncio.run(run())
+    assert stale == {"v": 1}, "the stale value is returned without waiting for the refresh"
+    assert refreshes == 1 and fetch.calls == 2
+    assert fresh == {"v": 2}
+    assert cache.stats["stale_hits"] == 1 and cache.stats["hits"] == 1
+
+
+def test_cache_refetches_once_the_stale_window_has_passed(hub):
+    async def run():
+        cache, fetch = hub._ResponseCache(), counting_fetch({"v": 1}, {"v": 2})
+        await cache.get_or_fetch("k", fetch, 60, cache_valves(CACHE_STALE_TTL=10))
+        expire(cache, "k", seconds_ago=11)
+        return cache, await cache.get_or_fetch("k", fetch, 60, cache_valves(CACHE_STALE_TTL=10))
+
+    cache, value = asyncio.run(run())
+    assert value == {"v": 2}
+    assert cache.stats["misses"] == 2 and cache.stats["stale_hits"] == 0
+
+
+def test_cache_evicts_the_least_recently_used_entry(hub):
+    async def run():
+        cache, valves = hub._ResponseCache(), cache_valves(CACHE_MAX_ENTRIES=2)
+        for key in ("a", "b"):
+            await cache.get_or_fetch(key, counting_fetch({"key": key}), 60, valves)
+        await cache.get_or_fetch("a", counting_fetch({"key": "a"}), 60, valves)  # a is now newer than b
+        await cache.get_or_fetch("c", counting_fetch({"key": "c"}), 60, valves)
+        return cache
+
+    cache = asyncio.run(run())
+    assert list(cache._entries) == ["a", "c"]
+    assert cache.stats["evictions"] == 1
+
+
+def test_cache_stays_within_its_byte_budget(hub):
+    async def run():
+        cache, valves = hub._ResponseCache(), cache_valves(CACHE_MAX_BYTES=100)
+        await cache.get_or_fetch("too big", counting_fetch({"v": "x" * 200}), 60, valves)
+        for key in ("a", "b", "c"):
+            await cache.get_or_fetch(key, counting_fetch({"v": "x" * 30}), 60, valves)
+        return cache
+
+    cache = asyncio.run(run())
+    assert "too big" not in cache._entries
+    assert cache.bytes <= 100 and list(cache._entries) == ["b", "c"]
+    assert cache.bytes == sum(entry[1] for entry in cache._entries.values())
+
+
+def test_cache_keeps_validators_and_revalidates_on_304(hub):
+    async def run():
+        cache, valves = hub._ResponseCache(), cache_valves()
+        value = {"v": 1}
+
+        async def fetch():
+            cache.note_validators("k", httpx.Response(200, headers={"ETag": '"a"', "Last-Modified": "Tue, 01 Jul 2025 00:00:00 GMT"}))
+            return value
+
+        await cache.get_or_fetch("k", fetch, 60, valves)
+        headers = cache.conditional_headers("k")
+        expire(cache, "k")
+
+        async def revalidate():
+            return cache.not_modified("k", httpx.Response(304, headers={"ETag": '"b"'}))
+
+        stale = await cache.get_or_fetch("k", revalidate, 60, valves)
+        await asyncio.gather(*cache._refreshing.values())
+        return cache, value, headers, stale
+
+    cache, value, headers, stale = asyncio.run(run())
+    assert headers == {"If-None-Match": '"a"', "If-Modified-Since": "Tue, 01 Jul 2025 00:00:00 GMT"}
+    assert stale is value and cache._entries["k"][0] is value
+    assert cache.conditional_headers("k")["If-None-Match"] == '"b"', "the 304's ETag replaces the old one"
+    assert cache._entries["k"][2] > time.monotonic(), "a 304 renews the entry's TTL"
+    assert cache.stats["revalidated"] == 1
+    assert cache.not_modified("gone", httpx.Response(304)) is None
+
+
+def test_name_lookups_revalidate_with_if_none_match(hub):
+    async def run(upstreams):
+        hub.ClientSecretCredential = fake_credential_class(upstreams.base_url)
+        tool = hub.Tools()
+        tool._ENDPOINT = f"{upstreams.base_url}/hub"
+        first = await tool.search_internal_users_by_name("name 1")
+        key = ("search_internal_users_by_name", "name 1")
+        expire(hub._RESPONSE_CACHE, key)
+        second = await tool.search_internal_users_by_name("name 1")
+        await asyncio.gather(*hub._RESPONSE_CACHE._refreshing.values())
+        return first, second
+
+    with FakeUpstreams(UpstreamConfig(latency_ms=0, jitter_ms=0)) as upstreams:
+        revalidated = hub._RESPONSE_CACHE.stats["revalidated"]
+        first, second = asyncio.run(run(upstreams))
+        assert "error" not in first and second == first
+        assert upstreams.calls["not_modified"] == 1
+    assert hub._RESPONSE_CACHE.stats["revalidated"] == revalidated + 1
+
+
+# Circuit breaker
+
+
+def test_circuit_opens_after_consecutive_failures(hub):
+    upstream, valves = hub._Upstream("hub.example"), breaker_valves()
+    for ok in (False, False, True, False, False):
+        upstream.admit(valves)
+        upstream.record(ok, 0.01, valves)
+    assert upstream.state == "closed", "a success resets the failure count"
+    upstream.record(False, 0.01, valves)
+    assert upstream.state == "open" and upstream.stats["opened"] == 1
+    with pytest.raises(hub._CircuitOpenError):
+        upstream.admit(valves)
+    assert upstream.stats["short_circuited"] == 1
+
+
+def test_circuit_lets_one_probe_through_after_the_reset_timeout(hub):
+    upstream, valves = hub._Upstream("hub.example"), breaker_valves()
+    for _ in range(3):
+        upstream.record(False, None, valves)
+    upstream.opened_at -= valves.CIRCUIT_RESET_TIMEOUT
+    upstream.admit(valves)
+    assert upstream.state == "half_open"
+    with pytest.raises(hub._CircuitOpenError):
+        upstream.admit(valves)  # only the probe goes through
+    upstream.record(False, None, valves)
+    assert upstream.state == "open" and upstream.stats["opened"] == 2, "a failed probe reopens the circuit"
+
+    upstream.opened_at -= valves.CIRCUIT_RESET_TIMEOUT
+    upstream.admit(valves)
+    upstream.record(True, 0.01, valves)
+    assert upstream.state == "closed" and upstream.failures == 0
+    upstream.admit(valves)
+
+
+def test_circuit_breaker_is_disabled_with_a_zero_threshold(hub):
+    upstream, valves = hub._Upstream("hub.example"), breaker_valves(CIRCUIT_FAILURE_THRESHOLD=0)
+    for _ in range(10):
+        upstream.admit(valves)
+        upstream.record(False, None, valves)
+    assert upstream.state == "closed"
+
+
+def test_adaptive_timeout_needs_enough_samples(hub):
+    upstream = hub._Upstream("hub.example")
+    valves = SimpleNamespace(HTTP_TIMEOUT=10.0, ADAPTIVE_TIMEOUT_MULTIPLIER=3.0, ADAPTIVE_TIMEOUT_FLOOR=1.0)
+    upstream.latencies.extend([0.5] * (upstream.MIN_SAMPLES - 1))
+    assert upstream.timeout(valves) == 10.0
+    upstream.latencies.append(0.5)
+    assert upstream.timeout(valves) == 1.5
+    upstream.latencies.extend([0.1] * upstream.WINDOW)
+    assert upstream.timeout(valves) == 1.0, "never below the floor"
+
+
+# Gateway limiter
+
+
+def test_token_bucket_allows_a_burst_then_paces_at_the_rate(hub):
+    bucket = hub._TokenBucket()
+    waits = [bucket.reserve(10.0, 3) for _ in range(5)]
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3] == pytest.approx(0.1, abs=0.01) and waits[4] == pytest.approx(0.2, abs=0.01)
+
+
+def test_gateway_limiter_keeps_separate_budgets_and_honors_retry_after(hub):
+    async def run():
+        limiter = hub._GatewayLimiter()
+        batch = [await limiter.acquire("batch", 1000.0, 1) for _ in range(2)]
+        interactive = await limiter.acquire("interactive", 1000.0, 1)
+        unlimited = await limiter.acquire("interactive", 0, 1)
+        limiter.block(0.05)
+        blocked = await limiter.acquire("interactive", 0, 1)
+        return limiter, batch, interactive, unlimited, blocked
+
+    limiter, batch, interactive, unlimited, blocked = asyncio.run(run())
+    assert batch[0] == 0.0 and batch[1] > 0
+    assert interactive == 0.0, "batch calls do not use up the interactive budget"
+    assert unlimited == 0.0
+    assert 0.0 < blocked <= 0.05
+    assert limiter.stats["throttled"] == 2
+
+
+# Admission control
+
+
+def test_admission_serves_interactive_waiters_before_batch_ones(hub):
+    async def run():
+        admission = hub._AdmissionController()
+        assert await admission.acquire("interactive", 1, 10, 5.0) == 0.0
+        batch = asyncio.ensure_future(admission.acquire("batch", 1, 10, 5.0))
+        interactive = asyncio.ensure_future(admission.acquire("interactive", 1, 10, 5.0))
+        await asyncio.sleep(0)
+        assert admission.depths() == {"interactive": 1, "batch": 1}
+        admission.release(0.01)
+        await interactive
+        assert not batch.done()
+        admission.release(0.01)
+        await batch
+        admission.release(0.01)
+        return admission, batch.result(), interactive.result()
+
+    admission, batch, interactive = asyncio.run(run())
+    assert isinstance(batch, float) and isinstance(interactive, float)
+    assert admission.in_flight == 0 and admission.stats["admitted"] == 3 and admission.stats["queued"] == 2
+
+
+def test_admission_sheds_a_batch_waiter_for_an_interactive_call_when_the_queue_is_full(hub):
+    async def run():
+        admission = hub._AdmissionController()
+        await admission.acquire("batch", 1, 1, 5.0)
+        batch = asyncio.ensure_future(admission.acquire("batch", 1, 1, 5.0))
+        await asyncio.sleep(0)
+        full = await admission.acquire("batch", 1, 1, 5.0)
+        interactive = asyncio.ensure_future(admission.acquire("interactive", 1, 1, 5.0))
+        shed = await batch
+        admission.release(0.01)
+        admitted = await interactive
+        return admission, full, shed, admitted
+
+    admission, full, shed, admitted = asyncio.run(run())
+    assert full == "1 calls are already waiting"
+    assert shed.startswith("shed from the queue")
+    assert isinstance(admitted, float)
+    assert admission.stats["shed"] == 1 and admission.stats["rejected_queue_full"] == 1
+
+
+def test_admission_rejects_calls_that_would_miss_their_deadline(hub):
+    async def run():
+        admission = hub._AdmissionController()
+        await admission.acquire("interactive", 1, 10, 5.0)
+        admission.hold_time = 10.0
+        expected = await admission.acquire("interactive", 1, 10, 5.0)
+        admission.hold_time = 0.0
+        timed_out = await admission.acquire("interactive", 1, 10, 0.2)
+        return admission, expected, timed_out
+
+    admission, expected, timed_out = asyncio.run(run())
+    assert expected.startswith("expected wait 10.0s exceeds")
+    assert timed_out == "no slot within the 0.2s deadline"
+    assert admission.stats["rejected_deadline"] == 2
+    assert admission.depths() == {"interactive": 0, "batch": 0}, "a timed-out waiter leaves the queue"
+
+
+# Reciprocal rank fusion
+
+
+def test_fusion_ranks_people_found_by_several_terms_first(hub):
+    ann, bob, cy = {"hanfordId": "1", "name": "Ann"}, {"hanfordId": "2", "name": "Bob"}, {"email": "cy@example.com"}
+    rankings = {"python": [ann, bob], "mcnp": [bob, cy, bob]}
+    people, matched = hub._fuse_rankings(rankings, "or", 10)
+    assert matched == 3
+    assert [p["name"] for p in people[:2]] == ["Bob", "Ann"]
+    assert people[0]["score"] == round(1 / 62 + 1 / 61, 5), "a duplicate in one ranking counts once, at its best rank"
+    assert people[0]["matched_terms"] == ["python", "mcnp"]
+
+    people, matched = hub._fuse_rankings(rankings, "and", 10)
+    assert matched == 1 and [p["name"] for p in people] == ["Bob"]
+
+    people, matched = hub._fuse_rankings(rankings, "or", 1)
+    assert matched == 3 and len(people) == 1
@@ -0,0 +1,75 @@
+"""
+The local people index must answer a query with the people Elasticsearch would return, so a
+result does not depend on whether the index happens to be fresh. The stand-in evaluates simple
+query_string queries with Elasticsearch's defaults (words ORed, a field prefix scoping only
+its word).
+
+    python -m pytest benchmarks/test_people_index.py
+"""
+
+import asyncio
+import logging
+
+import pytest
+
+from fake_upstreams import FakeUpstreams, UpstreamConfig, fake_credential_class
+from run_benchmarks import load_tool_module
+
+FIELDS = ["name", "skills"]
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+@pytest.fixture(scope="module")
+def index_path(tmp_path_factory):
+    return str(tmp_path_factory.mktemp("index") / "people.db")
+
+
+@pytest.fixture(scope="module")
+def people(index_path):
+    """Sync the index and return query -> (local index result, Elasticsearch result)."""
+    queries = ["skills:MCNP Thermal", "skills:Python Hydraulics", "Reactors Hydraulics", "name:17 MCNP", "skills:Python"]
+
+    async def run(upstreams):
+        mcp = load_tool_module("cost_estimator/hub_search_mcp.py")
+        mcp.ClientSecretCredential = fake_credential_class(upstreams.base_url)
+        mcp.PEOPLE_SEARCH_URL = f"{upstreams.base_url}/es/hub-suggestions-people/_search"
+        index = mcp._PeopleIndex(index_path)
+        await index.sync()
+        headers = {"Authorization": f"Bearer {await mcp._get_access_token()}"}
+        results = {}
+        for query in queries:
+            local = await asyncio.to_thread(index.search, query, FIELDS, 100, 0)
+            call = {"timings": {}, "status": None, "bytes": None}
+            upstream = await mcp._fetch_page(query, FIELDS, 100, None, headers, False, call)
+            results[query] = (local, upstream)
+        return results
+
+    with FakeUpstreams(UpstreamConfig(latency_ms=0, jitter_ms=0, index_people=40)) as upstreams:
+        return asyncio.run(run(upstreams))
+
+
+def test_multi_word_queries_match_upstream(people):
+    for query, (local, upstream) in people.items():
+        assert local is not None and local["source"] == "local_index", query
+        assert local["total"] == upstream["total"], query
+        assert {p["id"] for p in local["people"]} == {p["id"] for p in upstream["people"]}, query
+
+
+def test_words_are_ored_with_the_field_scoping_only_the_first(people):
+    # skills:MCNP OR Thermal anywhere: everyone with MCNP in their skills (i % 4 >= 2), not only
+    # those who also list Thermal Hydraulics (i % 4 == 3) as an AND would return.
+    local, _ = people["skills:MCNP Thermal"]
+    assert local["total"] == 20
+    # name:17 OR MCNP anywhere
+    local, _ = people["name:17 MCNP"]
+    assert "17" in {p["id"] for p in local["people"]} and local["total"] == 21
+
+
+def test_hub_tool_serves_only_single_words_locally(people, index_path):
+    hub = load_tool_module("cost_estimator/hub_search_tool.py")
+    index = hub._LocalPeopleIndex()
+    assert index.search(index_path, 3600, "Hydraulics", None, 100)["results"]
+    assert index.search(index_path, 3600, "Thermal Hydraulics", None, 100) is None
+    assert index.search(index_path, 3600, "Person 17", "name", 100, prefix=True) is None
+    assert index.stats == {"hits": 1, "misses": 2}
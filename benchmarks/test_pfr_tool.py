@@ -0,0 +1,92 @@
+"""
+Unit tests for the PRF tool's in-process project catalog: project number lookups by exact number
+and prefix, trigram matching of misspelled or partial names, confident resolution for
+search_projects, and one catalog per PROJECT_CATALOG_URL.
+
+    python -m pytest benchmarks/test_pfr_tool.py
+"""
+
+import asyncio
+import logging
+
+import pytest
+
+from fake_upstreams import FakeUpstreams, UpstreamConfig, fake_credential_class
+from run_benchmarks import load_tool_module
+
+PROJECTS = [
+    ("80001", "Hydrogen Fuel Storage Study"),
+    ("80002", "Hydrogen Fuel Transport Study"),
+    ("80110", "Coastal Resilience Modeling"),
+    ("81-234", "Nuclear Waste Characterization"),
+]
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+@pytest.fixture(scope="module")
+def prf():
+    return load_tool_module("prf/pfr_tool.py")
+
+
+@pytest.fixture
+def catalog(prf):
+    catalog = prf._ProjectCatalog()
+    records = [(number, name, {"projectNumber": number, "name": name}) for number, name in PROJECTS]
+    catalog.projects, catalog._numbers, catalog._grams, catalog._gram_counts = prf._ProjectCatalog._build(records)
+    return catalog
+
+
+def numbers(ranked):
+    return [number for _, number, _, _ in ranked]
+
+
+def test_an_exact_project_number_scores_one(catalog):
+    ranked = catalog.search("80110", 5)
+    assert numbers(ranked)[0] == "80110" and ranked[0][0] == 1.0
+    assert catalog.search("81234", 1)[0][1] == "81-234", "punctuation in project numbers is ignored"
+
+
+def test_a_number_prefix_ranks_by_the_share_of_digits_given(catalog):
+    ranked = catalog.search("800", 5)
+    assert sorted(numbers(ranked)) == ["80001", "80002"]
+    assert ranked[0][0] == pytest.approx(0.5 + 0.4 * 3 / 5)
+    assert catalog.search("8011", 1)[0][0] > ranked[0][0]
+    assert catalog.search("9", 5) == []
+
+
+def test_misspelled_and_partial_names_find_the_project(catalog):
+    assert numbers(catalog.search("Costal Resilence Modelling", 1)) == ["80110"]
+    assert numbers(catalog.search("nuclear waste", 1)) == ["81-234"]
+    ranked = catalog.search("hydrogen transport", 2)
+    assert numbers(ranked) == ["80002", "80001"] and ranked[0][0] > ranked[1][0]
+
+
+def test_resolve_needs_a_confident_and_clear_best_match(catalog):
+    assert catalog.resolve("80110", 0.7, 0.1)[1] == "80110"
+    assert catalog.resolve("Costal Resilence Modelling", 0.7, 0.1)[1] == "80110"
+    assert catalog.resolve("Hydrogen Fuel Study", 0.7, 0.1) is None, "two projects match about equally well"
+    assert catalog.resolve("quantum sensors", 0.7, 0.1) is None
+    assert catalog.stats["resolved"] == 2 and catalog.stats["lookups"] == 4
+
+
+def test_find_projects_reads_the_catalog_of_the_configured_url(prf):
+    # The URL changes while the old URL's catalog is still loading; the new URL's lookup must
+    # neither wait for that load nor rank the old URL's projects.
+    async def run(slow, fast):
+        prf.ClientSecretCredential = fake_credential_class(fast.base_url)
+        tool = prf.Tools()
+        tool.valves.PROJECT_CATALOG_URL = f"{slow.base_url}/projects/catalog"
+        before = asyncio.ensure_future(tool.find_projects("80005"))
+        await asyncio.sleep(0.1)
+        tool.valves.PROJECT_CATALOG_URL = f"{fast.base_url}/projects/catalog"
+        after = await tool.find_projects("80040")
+        return await before, after
+
+    with FakeUpstreams(UpstreamConfig(latency_ms=500, jitter_ms=0, catalog_projects=10)) as slow, \
+            FakeUpstreams(UpstreamConfig(latency_ms=0, jitter_ms=0, catalog_projects=50)) as fast:
+        before, after = asyncio.run(run(slow, fast))
+        assert slow.calls["project_catalog"] == 1 and fast.calls["project_catalog"] == 1
+    assert before["catalog_projects"] == 10 and before["candidates"][0]["projectNumber"] == "80005"
+    assert after["catalog_projects"] == 50 and after["candidates"][0]["projectNumber"] == "80040"
+    assert after["candidates"][0]["score"] == 1.0
@@ -5,13 +5,1193 @@ date: 2025-07-01
 version: 1.1
 license: MIT
 description: A tool pipeline for searching internal project costs on based on fiscal year, hanford id, and project number.
-requirements: requests, pydantic, open-webui, azure-identity
+requirements: httpx, pydantic, open-webui, azure-identity
 """
 
-import requests
+import asyncio
+import bisect
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from datetime import date
+from email.utils import parsedate_to_datetime
+from types import ModuleType
+from typing import Literal
+
+import httpx
 from pydantic import Field, BaseModel
-from open_webui.models.users import Users
-from azure.identity import ClientSecretCredential
+
+ClientSecretCredential = (
+    None  # imported from azure.identity on first use, see _credential_class
+)
+
+
+def _credential_class():
+    """
+    Import azure-identity on the first token fetch instead of at load: it pulls in msal and
+    cryptography, the bulk of the tool's import time, and Open WebUI re-imports tools often.
+    """
+    global ClientSecretCredential
+    if ClientSecretCredential is None:
+        from azure.identity import ClientSecretCredential
+    return ClientSecretCredential
+
+
+class _TokenBroker:
+    """
+    Process-wide cache of Entra ID access tokens keyed by (tenant, client, scope).
+    Tokens are served from memory until shortly before `expires_on` and are refreshed in the
+    background once they enter the refresh window. Concurrent callers share one in-flight fetch.
+    """
+
+    REFRESH_MARGIN = 300  # seconds before expiry at which a background refresh starts
+    EXPIRY_MARGIN = (
+        60  # seconds before expiry at which a cached token is no longer served
+    )
+
+    def __init__(self):
+        self._tokens = {}
+        self._credentials = {}
+        self._inflight = {}
+        self.stats = {"hits": 0, "misses": 0, "refreshes": 0, "fetches": 0}
+
+    async def get_token(
+        self, tenant_id: str, client_id: str, client_secret: str, scope: str
+    ) -> str:
+        key = (tenant_id, client_id, scope)
+        now = time.time()
+        cached = self._tokens.get(key)
+        if cached is not None and cached.expires_on - self.EXPIRY_MARGIN > now:
+            self.stats["hits"] += 1
+            if cached.expires_on - self.REFRESH_MARGIN <= now and not self._pending(
+                key
+            ):
+                self.stats["refreshes"] += 1
+                self._start_fetch(key, client_secret)
+            return cached.token
+
+        self.stats["misses"] += 1
+        task = self._pending(key) or self._start_fetch(key, client_secret)
+        return (await asyncio.shield(task)).token
+
+    def _pending(self, key):
+        task = self._inflight.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            return task
+        return None
+
+    def _start_fetch(self, key, client_secret: str) -> asyncio.Task:
+        tenant_id, client_id, scope = key
+        credential = self._credentials.get((tenant_id, client_id, client_secret))
+        if credential is None:
+            credential = _credential_class()(
+                tenant_id=tenant_id, client_id=client_id, client_secret=client_secret
+            )
+            self._credentials[(tenant_id, client_id, client_secret)] = credential
+        # azure-identity's ClientSecretCredential is synchronous, keep it off the event loop.
+        task = asyncio.get_running_loop().create_task(
+            asyncio.to_thread(credential.get_token, scope)
+        )
+        self._inflight[key] = task
+        self.stats["fetches"] += 1
+        task.add_done_callback(lambda done: self._finish_fetch(key, done))
+        return task
+
+    def _finish_fetch(self, key, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            self._tokens[key] = task.result()
+
+
+_TOKEN_BROKER = _TokenBroker()
+
+
+def token_cache_stats() -> dict:
+    """Return the hit, miss, background refresh and upstream fetch counters of the token cache."""
+    return dict(_TOKEN_BROKER.stats)
+
+
+_HTTP_CLIENTS = {}
+
+
+def _get_http_client(url: str, valves) -> httpx.AsyncClient:
+    """
+    Return the pooled keep-alive client for the host of `url`, creating it on first use.
+    A new client is built when the pool/timeout valves change or the event loop is replaced.
+    """
+    config = (
+        valves.HTTP_MAX_CONNECTIONS,
+        valves.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        valves.HTTP_TIMEOUT,
+        valves.HTTP_CONNECT_TIMEOUT,
+    )
+    loop = asyncio.get_running_loop()
+    host = httpx.URL(url).host
+    entry = _HTTP_CLIENTS.get(host)
+    if entry is not None and entry[1] is loop and entry[2] == config:
+        return entry[0]
+    # A replaced client is left to the garbage collector so in-flight requests can finish.
+    client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=config[0], max_keepalive_connections=config[1]
+        ),
+        timeout=httpx.Timeout(config[2], connect=config[3]),
+    )
+    _HTTP_CLIENTS[host] = (client, loop, config)
+    return client
+
+
+_WARM_UPS = {}
+_WARM_UP_STATS = {"runs": 0, "failures": 0, "seconds": 0.0}
+
+
+def _warm_up(valves, scopes: tuple, urls: tuple) -> None:
+    """
+    Fetch the tokens for `scopes` and open WARMUP_CONNECTIONS pooled connections to each host of
+    `urls` in the background, so the first call after a load or a credential change does not pay
+    for token minting, DNS and TLS. Runs once per credentials, endpoints, pool valves and event
+    loop; without credentials or a running loop it does nothing and the first call warms up.
+    """
+    if not (
+        valves.WARMUP_ON_LOAD
+        and valves.TENANT_ID
+        and valves.CLIENT_ID
+        and valves.CLIENT_SECRET
+    ):
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    hosts = {httpx.URL(url).host: url for url in urls if url.startswith("http")}
+    key = (
+        valves.TENANT_ID,
+        valves.CLIENT_ID,
+        valves.CLIENT_SECRET,
+        scopes,
+        tuple(hosts),
+        valves.WARMUP_CONNECTIONS,
+        valves.HTTP_MAX_CONNECTIONS,
+        valves.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        valves.HTTP_TIMEOUT,
+        valves.HTTP_CONNECT_TIMEOUT,
+    )
+    task = _WARM_UPS.get(key)
+    if task is not None and task.get_loop() is loop:
+        return
+    _WARM_UPS[key] = loop.create_task(
+        _run_warm_up(valves.model_copy(), scopes, tuple(hosts.values()))
+    )
+
+
+async def _run_warm_up(valves, scopes: tuple, urls: tuple) -> None:
+    started = time.perf_counter()
+    tokens = [
+        _TOKEN_BROKER.get_token(
+            valves.TENANT_ID, valves.CLIENT_ID, valves.CLIENT_SECRET, scope
+        )
+        for scope in scopes
+    ]
+    # Unauthenticated HEADs are answered by the gateway itself; the connections they open stay
+    # in the pool for the keep-alive expiry. Concurrent requests each open their own connection.
+    connections = [
+        _get_http_client(url, valves).head(url, timeout=valves.HTTP_CONNECT_TIMEOUT)
+        for url in urls
+        for _ in range(valves.WARMUP_CONNECTIONS)
+    ]
+    results = await asyncio.gather(*tokens, *connections, return_exceptions=True)
+    _WARM_UP_STATS["runs"] += 1
+    _WARM_UP_STATS["failures"] += sum(isinstance(r, Exception) for r in results)
+    _WARM_UP_STATS["seconds"] = time.perf_counter() - started
+
+
+def warm_up_stats() -> dict:
+    """Return how many warm-ups ran, their failed token fetches or connections and the last one's duration."""
+    return dict(_WARM_UP_STATS)
+
+
+class _SingleFlight:
+    """
+    Coalesces identical in-flight upstream requests. The first caller performs the request and
+    concurrent duplicates await the same result instead of going upstream themselves.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, fetch):
+        loop = asyncio.get_running_loop()
+        task = self._inflight.get(key)
+        if task is None or task.get_loop() is not loop:
+            task = loop.create_task(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # Shielded so a cancelled caller does not cancel the request for everyone else.
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+
+_SINGLE_FLIGHT = _SingleFlight()
+
+
+_TRACE_PHASES = {"connection.connect_tcp": "connect", "connection.start_tls": "tls"}
+
+
+def _trace_phases(timings: dict):
+    """httpx trace hook adding DNS+TCP connect and TLS handshake time to `timings`."""
+    started = {}
+
+    async def trace(event_name: str, info: dict) -> None:
+        step, _, stage = event_name.rpartition(".")
+        if step not in _TRACE_PHASES:
+            return
+        if stage == "started":
+            started[step] = time.perf_counter()
+        elif step in started:
+            phase = _TRACE_PHASES[step]
+            elapsed = time.perf_counter() - started.pop(step)
+            timings[phase] = timings.get(phase, 0.0) + elapsed
+
+    return trace
+
+
+class _CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class _Upstream:
+    """
+    Resilience state of one upstream host. A window of recent latencies sets the adaptive
+    timeout and the hedging delay; a circuit breaker fails calls fast after repeated
+    failures and lets a single probe through once CIRCUIT_RESET_TIMEOUT has passed.
+    """
+
+    WINDOW = 200  # latencies kept for the percentiles
+    MIN_SAMPLES = 20  # below this the valve timeouts apply and nothing is hedged
+
+    def __init__(self, host: str):
+        self.host = host
+        self.latencies = deque(maxlen=self.WINDOW)
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.stats = {"short_circuited": 0, "opened": 0, "hedged": 0, "hedge_wins": 0}
+
+    def percentile(self, q: float) -> float | None:
+        if len(self.latencies) < self.MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def timeout(self, valves) -> float:
+        """Read timeout: a multiple of the observed p99, within [floor, HTTP_TIMEOUT]."""
+        p99 = self.percentile(0.99)
+        if (
+            p99 is None
+            or self.state != "closed"
+            or not valves.ADAPTIVE_TIMEOUT_MULTIPLIER
+        ):
+            return valves.HTTP_TIMEOUT
+        adaptive = max(
+            valves.ADAPTIVE_TIMEOUT_FLOOR, p99 * valves.ADAPTIVE_TIMEOUT_MULTIPLIER
+        )
+        return min(valves.HTTP_TIMEOUT, adaptive)
+
+    def admit(self, valves) -> None:
+        if self.state == "closed" or not valves.CIRCUIT_FAILURE_THRESHOLD:
+            return
+        if time.monotonic() - self.opened_at >= valves.CIRCUIT_RESET_TIMEOUT:
+            # This caller is the half-open probe; the rest keep failing fast until it returns.
+            self.state = "half_open"
+            self.opened_at = time.monotonic()
+            return
+        self.stats["short_circuited"] += 1
+        raise _CircuitOpenError(
+            f"{self.host} is unavailable after {self.failures} consecutive failures; "
+            f"retrying in {valves.CIRCUIT_RESET_TIMEOUT - (time.monotonic() - self.opened_at):.0f}s"
+        )
+
+    def record(self, ok: bool, latency: float | None, valves) -> None:
+        if (
+            latency is not None
+        ):  # timeouts count too, so a slower upstream widens its timeout
+            self.latencies.append(latency)
+        if ok:
+            self.failures = 0
+            self.state = "closed"
+            return
+        self.failures += 1
+        threshold = valves.CIRCUIT_FAILURE_THRESHOLD
+        if self.state == "half_open" or (threshold and self.failures >= threshold):
+            if self.state != "open":
+                self.stats["opened"] += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+_UPSTREAMS = {}
+
+
+def upstream_stats() -> dict:
+    """Return circuit state, failure count, latency percentiles and counters per upstream host."""
+    return {
+        host: {
+            "state": upstream.state,
+            "failures": upstream.failures,
+            "p50": upstream.percentile(0.5),
+            "p95": upstream.percentile(0.95),
+            **upstream.stats,
+        }
+        for host, upstream in _UPSTREAMS.items()
+    }
+
+
+class _TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second up to `burst`. Callers reserve a token
+    and wait until it is due, so waiters are served in arrival order. Thread-safe and not
+    tied to an event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = None
+        self._updated = time.monotonic()
+
+    def reserve(self, rate: float, burst: int) -> float:
+        """Take one token and return the seconds to wait before it may be used."""
+        with self._lock:
+            now = time.monotonic()
+            if self._tokens is None:
+                self._tokens = float(burst)
+            self._tokens = min(burst, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / rate
+
+
+class _GatewayLimiter:
+    """
+    Client-side throttle for one API gateway, with separate interactive and batch budgets.
+    A 429 with Retry-After holds back every caller of the gateway until it has passed.
+    """
+
+    def __init__(self):
+        self.buckets = {"interactive": _TokenBucket(), "batch": _TokenBucket()}
+        self.blocked_until = 0.0
+        self.stats = {"throttled": 0, "throttled_seconds": 0.0, "retries": 0}
+
+    async def acquire(self, priority: str, rate: float, burst: int) -> float:
+        """Wait for a token of the `priority` budget (unlimited when `rate` is 0); return the wait."""
+        wait = self.blocked_until - time.monotonic()
+        if rate > 0:
+            wait = max(wait, self.buckets[priority].reserve(rate, burst))
+        if wait <= 0:
+            return 0.0
+        self.stats["throttled"] += 1
+        self.stats["throttled_seconds"] += wait
+        await asyncio.sleep(wait)
+        return wait
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+# Open WebUI loads every tool file as its own module, so the limiters live in a registry module
+# that all tools share: the hub, cost and PRF tools draw on one budget per gateway host.
+_GATEWAY_LIMITERS = sys.modules.setdefault(
+    "enterprise_connections_gateways", ModuleType("enterprise_connections_gateways")
+).__dict__.setdefault("limiters", {})
+
+
+def _gateway_limiter(host: str) -> "_GatewayLimiter":
+    return _GATEWAY_LIMITERS.get(host) or _GATEWAY_LIMITERS.setdefault(
+        host, _GatewayLimiter()
+    )
+
+
+def gateway_limiter_stats() -> dict:
+    """Return throttling and retry counters per gateway host, shared by all tools."""
+    return {host: dict(limiter.stats) for host, limiter in _GATEWAY_LIMITERS.items()}
+
+
+class _AdmissionRejected(Exception):
+    """Raised when an upstream's wait queue is full or a call cannot get a slot in time."""
+
+
+class _AdmissionController:
+    """
+    Caps the calls in flight to one upstream host across all tools. Calls over the cap wait in
+    a bounded queue where interactive calls are admitted before batch ones, each in arrival
+    order. A call is turned away at once when the queue is full or its expected wait (the calls
+    queued ahead of it x the mean slot hold time / the cap) exceeds its deadline, and when the
+    deadline passes while it waits. Thread-safe; waiters may belong to any event loop.
+    """
+
+    PRIORITIES = ("interactive", "batch")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.queues = {priority: deque() for priority in self.PRIORITIES}
+        self.hold_time = 0.0  # moving average of the seconds a slot is held
+        self.stats = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected_queue_full": 0,
+            "rejected_deadline": 0,
+            "shed": 0,
+            "wait_seconds": 0.0,
+            "max_queue_depth": 0,
+        }
+
+    def depths(self) -> dict:
+        return {priority: len(queue) for priority, queue in self.queues.items()}
+
+    async def acquire(
+        self, priority: str, limit: int, queue_size: int, deadline: float
+    ):
+        """Wait for a slot; return the seconds spent queued, or why the call was rejected."""
+        with self._lock:
+            depth = sum(len(queue) for queue in self.queues.values())
+            if self.in_flight < limit and not depth:
+                self.in_flight += 1
+                self.stats["admitted"] += 1
+                return 0.0
+            if depth >= queue_size:
+                if priority != "interactive" or not self.queues["batch"]:
+                    self.stats["rejected_queue_full"] += 1
+                    return f"{depth} calls are already waiting"
+                # Shed the newest batch waiter to make room for the interactive call.
+                self._decide(self.queues["batch"].pop(), False)
+                self.stats["shed"] += 1
+                depth -= 1
+            rank = self.PRIORITIES.index(priority)
+            ahead = sum(len(self.queues[p]) for p in self.PRIORITIES[: rank + 1])
+            expected = (ahead + 1) * self.hold_time / max(1, limit)
+            if expected > deadline:
+                self.stats["rejected_deadline"] += 1
+                return f"expected wait {expected:.1f}s exceeds the {deadline:.1f}s deadline"
+            waiter = [
+                asyncio.get_running_loop().create_future(),
+                None,
+            ]  # [wake-up, admitted?]
+            self.queues[priority].append(waiter)
+            self.stats["queued"] += 1
+            self.stats["max_queue_depth"] = max(
+                self.stats["max_queue_depth"], depth + 1
+            )
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[0]), deadline)
+        except asyncio.TimeoutError:
+            if self._withdraw(priority, waiter):
+                self.stats["rejected_deadline"] += 1
+                return f"no slot within the {deadline:.1f}s deadline"
+            # Decided just as the deadline passed; honor the decision.
+        except asyncio.CancelledError:
+            if not self._withdraw(priority, waiter) and waiter[1]:
+                self.release(None)
+            raise
+        if not waiter[1]:
+            return "shed from the queue to make room for interactive calls"
+        waited = time.monotonic() - started
+        self.stats["wait_seconds"] += waited
+        self.stats["admitted"] += 1
+        return waited
+
+    def _withdraw(self, priority: str, waiter: list) -> bool:
+        """Take an undecided waiter out of the queue; False when it was already admitted or shed."""
+        with self._lock:
+            if waiter[1] is not None:
+                return False
+            self.queues[priority].remove(waiter)
+            return True
+
+    def _decide(self, waiter: list, admitted: bool) -> bool:
+        """Record a queued waiter's fate and wake it; False when its event loop is gone."""
+        waiter[1] = admitted
+        try:
+            waiter[0].get_loop().call_soon_threadsafe(self._wake, waiter[0])
+        except RuntimeError:  # the waiter's event loop has been closed
+            return False
+        return True
+
+    def release(self, held: float | None) -> None:
+        """Free a slot held `held` seconds, handing it to the first interactive, else batch, waiter."""
+        with self._lock:
+            if held is not None:
+                self.hold_time = (
+                    held if not self.hold_time else 0.8 * self.hold_time + 0.2 * held
+                )
+            for queue in self.queues.values():
+                while queue:
+                    if self._decide(queue.popleft(), True):
+                        return
+            self.in_flight -= 1
+
+    @staticmethod
+    def _wake(future) -> None:
+        if not future.done():
+            future.set_result(None)
+
+
+# Shared through the same registry module as the gateway limiters, so the cap is per host
+# across the hub, cost and PRF tools.
+_ADMISSION_CONTROLLERS = sys.modules.setdefault(
+    "enterprise_connections_gateways", ModuleType("enterprise_connections_gateways")
+).__dict__.setdefault("admission", {})
+
+
+@asynccontextmanager
+async def _admitted(host: str, priority: str, valves, timings=None):
+    """
+    Hold one of the host's UPSTREAM_MAX_CONCURRENCY slots (no cap when 0) for the block and add
+    the time spent queued to `timings` as "queue"; raise _AdmissionRejected when turned away.
+    """
+    limit = valves.UPSTREAM_MAX_CONCURRENCY
+    if limit <= 0:
+        yield
+        return
+    controller = _ADMISSION_CONTROLLERS.get(host) or _ADMISSION_CONTROLLERS.setdefault(
+        host, _AdmissionController()
+    )
+    deadline = (
+        valves.UPSTREAM_MAX_WAIT
+        if priority == "interactive"
+        else valves.UPSTREAM_BATCH_MAX_WAIT
+    )
+    waited = await controller.acquire(
+        priority, limit, valves.UPSTREAM_QUEUE_SIZE, deadline
+    )
+    if isinstance(waited, str):
+        raise _AdmissionRejected(f"{host} is at capacity: {waited}")
+    if waited and timings is not None:
+        timings["queue"] = timings.get("queue", 0.0) + waited
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        controller.release(time.monotonic() - started)
+
+
+def admission_stats() -> dict:
+    """Return calls in flight, queue depths and admission counters per upstream host, shared by all tools."""
+    return {
+        host: {
+            "in_flight": controller.in_flight,
+            "queue_depth": controller.depths(),
+            **controller.stats,
+        }
+        for host, controller in _ADMISSION_CONTROLLERS.items()
+    }
+
+
+class _CassetteRecorder:
+    """
+    Appends upstream exchanges as JSON lines to `{tool}-{pid}.jsonl` under RECORD_CASSETTE_DIR,
+    for benchmarks/replay_cassettes.py. Entries are sanitized: request headers, and with them
+    the bearer token, are never written, and only a few response headers are kept.
+    """
+
+    KEPT_HEADERS = ("content-type", "retry-after", "etag", "last-modified")
+
+    def __init__(self, tool: str):
+        self._tool = tool
+        self._lock = threading.Lock()
+
+    def write(
+        self,
+        directory: str,
+        method: str,
+        url: str,
+        params: dict,
+        priority: str,
+        retry: int,
+        resp: httpx.Response,
+        latency: float,
+    ) -> None:
+        entry = {
+            "ts": time.time(),
+            "tool": self._tool,
+            "method": method,
+            "url": url,
+            "params": {k: str(v) for k, v in params.items()},
+            "priority": priority,
+            "retry": retry,
+            "status": resp.status_code,
+            "latency": round(latency, 4),
+            "headers": {
+                k: resp.headers[k] for k in self.KEPT_HEADERS if k in resp.headers
+            },
+            "body": resp.text,
+        }
+        line = json.dumps(entry) + "\n"
+        try:
+            with self._lock:
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, f"{self._tool}-{os.getpid()}.jsonl")
+                with open(path, "a") as f:
+                    f.write(line)
+        except OSError:
+            pass  # recording must never fail a call
+
+
+_CASSETTE = _CassetteRecorder("cost")
+
+
+def _retry_after(resp: httpx.Response) -> float | None:
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP-date), if any."""
+    value = resp.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+async def _send(
+    method: str,
+    url: str,
+    params: dict,
+    headers: dict,
+    valves,
+    timings=None,
+    priority: str = "interactive",
+) -> httpx.Response:
+    """
+    Send a GET (params in the query string) or POST (params form-encoded) over the pooled
+    client for the host of `url`, coalescing it with any identical request already in flight.
+    The host's `_Upstream` sets the timeout and may open its circuit. Connect and TLS handshake
+    time is added to `timings` when given.
+    Each attempt first waits for the gateway's `priority` budget; a 429 or 503 is retried
+    with jittered exponential backoff, or after its Retry-After.
+    """
+    key = (url, method, tuple(sorted((k, str(v)) for k, v in params.items())))
+    client = _get_http_client(url, valves)
+    host = httpx.URL(url).host
+    upstream = _UPSTREAMS.get(host) or _UPSTREAMS.setdefault(host, _Upstream(host))
+    limiter = _gateway_limiter(host)
+    extensions = {"trace": _trace_phases(timings)} if timings is not None else {}
+
+    async def send_once(retry: int = 0) -> httpx.Response:
+        upstream.admit(valves)
+        timeout = httpx.Timeout(
+            upstream.timeout(valves), connect=valves.HTTP_CONNECT_TIMEOUT
+        )
+        if method == "GET":
+            send = lambda: client.get(
+                url,
+                params=params,
+                headers=headers,
+                extensions=extensions,
+                timeout=timeout,
+            )
+        else:
+            send = lambda: client.post(
+                url,
+                data=params,
+                headers=headers,
+                extensions=extensions,
+                timeout=timeout,
+            )
+        started = time.perf_counter()
+        try:
+            resp = await send()
+        except httpx.TimeoutException:
+            upstream.record(False, timeout.read, valves)
+            raise
+        except httpx.HTTPError:
+            upstream.record(False, None, valves)
+            raise
+        latency = time.perf_counter() - started
+        upstream.record(resp.status_code < 500, latency, valves)
+        if valves.RECORD_CASSETTE_DIR:
+            _CASSETTE.write(
+                valves.RECORD_CASSETTE_DIR,
+                method,
+                url,
+                params,
+                priority,
+                retry,
+                resp,
+                latency,
+            )
+        return resp
+
+    async def attempt() -> httpx.Response:
+        rate = (
+            valves.RATE_LIMIT_PER_SECOND
+            if priority == "interactive"
+            else valves.RATE_LIMIT_BATCH_PER_SECOND
+        )
+        for retry in range(valves.RETRY_MAX_ATTEMPTS + 1):
+            waited = await limiter.acquire(priority, rate, valves.RATE_LIMIT_BURST)
+            if waited and timings is not None:
+                timings["throttle"] = timings.get("throttle", 0.0) + waited
+            async with _admitted(host, priority, valves, timings):
+                resp = await send_once(retry)
+            if resp.status_code not in (429, 503) or retry == valves.RETRY_MAX_ATTEMPTS:
+                return resp
+            retry_after = _retry_after(resp)
+            if retry_after is not None and retry_after > valves.RETRY_MAX_DELAY:
+                return resp
+            limiter.stats["retries"] += 1
+            if retry_after is not None:
+                limiter.block(retry_after)  # the next acquire waits it out
+            else:
+                backoff = valves.RETRY_BASE_DELAY * 2**retry
+                await asyncio.sleep(
+                    random.uniform(0, min(valves.RETRY_MAX_DELAY, backoff))
+                )
+
+    return await _SINGLE_FLIGHT.do(key, attempt)
+
+
+class _Emitter:
+    """
+    Wraps Open WebUI's `__event_emitter__` for a single tool call.
+    With EMIT_VERBOSITY "status" the call emits one status event carrying its phase timings,
+    "debug" additionally streams every step as a chat message and "off" emits nothing.
+    Every method is a no-op when no emitter was passed in. The phase timings, HTTP status and
+    response size collected here are also recorded into the module metrics.
+    """
+
+    def __init__(self, event_emitter, verbosity: str = "status"):
+        self._event_emitter = event_emitter if verbosity != "off" else None
+        self._debug = verbosity == "debug"
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.status = None
+        self.response_bytes = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time the enclosed block and add it to the `name` phase."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    async def debug(self, content: str) -> None:
+        if self._debug and self._event_emitter is not None:
+            with self.phase("emit"):
+                await self._event_emitter(
+                    {"type": "message", "data": {"content": content + "\n"}}
+                )
+
+    async def done(self, label: str, result=None) -> None:
+        """Emit the single status event that closes the call."""
+        if self._event_emitter is None:
+            return
+        failed = isinstance(result, dict) and "error" in result
+        description = f"{label} {'failed' if failed else 'complete'}"
+        if self.timings:
+            phases = ", ".join(
+                f"{name} {seconds * 1000:.0f} ms"
+                for name, seconds in self.timings.items()
+            )
+            description += f" ({phases})"
+        with self.phase("emit"):
+            await self._event_emitter(
+                {"type": "status", "data": {"description": description, "done": True}}
+            )
+
+
+class _Metrics:
+    """
+    In-process call metrics rendered in the Prometheus text exposition format: latency
+    histograms per phase, call counters per status and response size histograms.
+    Recording is a handful of dict updates, cheap enough to leave on in production.
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+    def __init__(self, tool: str):
+        self._tool = tool
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._written_at = 0.0
+        self._write_failed = False
+
+    def _observe(self, name: str, labels: tuple, value: float, buckets: tuple) -> None:
+        with self._lock:
+            series = self._histograms.get((name, labels))
+            if series is None:
+                series = self._histograms[(name, labels)] = [
+                    buckets,
+                    [0] * len(buckets),
+                    0.0,
+                    0,
+                ]
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                series[1][index] += 1
+            series[2] += value
+            series[3] += 1
+
+    def record_call(
+        self, method: str, timings: dict, status, response_bytes=None
+    ) -> None:
+        labels = (("tool", self._tool), ("method", method))
+        for phase, seconds in timings.items():
+            self._observe(
+                "enterprise_tool_phase_seconds",
+                labels + (("phase", phase),),
+                seconds,
+                self.LATENCY_BUCKETS,
+            )
+        if response_bytes is not None:
+            self._observe(
+                "enterprise_tool_response_bytes",
+                labels,
+                response_bytes,
+                self.SIZE_BUCKETS,
+            )
+        key = ("enterprise_tool_calls_total", labels + (("status", str(status)),))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def render(self) -> str:
+        with self._lock:
+            histograms = {
+                key: (series[0], list(series[1]), series[2], series[3])
+                for key, series in self._histograms.items()
+            }
+            counters = dict(self._counters)
+        lines = []
+        typed = set()
+        for (name, labels), (buckets, counts, total, count) in sorted(
+            histograms.items()
+        ):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{name}_sum{{{label_text}}} {total}")
+            lines.append(f"{name}_count{{{label_text}}} {count}")
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{name}{{{label_text}}} {value}")
+        controllers = sorted(_ADMISSION_CONTROLLERS.items())
+        if controllers:
+            lines.append("# TYPE enterprise_upstream_in_flight gauge")
+            for host, controller in controllers:
+                lines.append(
+                    f'enterprise_upstream_in_flight{{tool="{self._tool}",host="{host}"}} {controller.in_flight}'
+                )
+            lines.append("# TYPE enterprise_upstream_queue_depth gauge")
+            for host, controller in controllers:
+                for priority, depth in controller.depths().items():
+                    lines.append(
+                        f'enterprise_upstream_queue_depth{{tool="{self._tool}",host="{host}",priority="{priority}"}} {depth}'
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, interval: float) -> None:
+        """Atomically rewrite `path` (e.g. a node_exporter textfile) at most every `interval` seconds."""
+        now = time.monotonic()
+        if not path or now - self._written_at < interval:
+            return
+        self._written_at = now
+        try:
+            with open(f"{path}.tmp", "w") as f:
+                f.write(self.render())
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:  # an export must never fail a call
+            if not self._write_failed:
+                self._write_failed = True
+                logging.getLogger(__name__).warning(
+                    "Cannot write metrics to %s: %s", path, e
+                )
+
+
+_METRICS = _Metrics("cost")
+
+
+def metrics_text() -> str:
+    """Return this tool's call metrics in the Prometheus text exposition format."""
+    return _METRICS.render()
+
+
+def _current_fiscal_year(today: date | None = None) -> str:
+    """The federal fiscal year, which starts on October 1."""
+    today = today or date.today()
+    return str(today.year + 1 if today.month >= 10 else today.year)
+
+
+def _cost_rows(payload) -> list:
+    """The cost rows of a response: the payload itself if it is a list, else its first list of objects."""
+    if isinstance(payload, list):
+        return payload
+    if isinstance(payload, dict):
+        for value in payload.values():
+            if isinstance(value, list) and (not value or isinstance(value[0], dict)):
+                return value
+    return []
+
+
+def _aggregate_costs(
+    responses: dict, amount_field: str, category_field: str, top_resources: int
+) -> dict:
+    """
+    Roll cost responses keyed by (fiscal year, resource) up into totals by fiscal year,
+    resource and category and a fiscal year x category table, in a single pass over the
+    rows. Rows whose amount is missing or not numeric are counted and skipped.
+    """
+    by_year = defaultdict(float)
+    by_resource = defaultdict(float)
+    by_category = defaultdict(float)
+    by_year_category = defaultdict(float)
+    rows = skipped = 0
+    for (fiscal_year, resource_id), payload in responses.items():
+        for row in _cost_rows(payload):
+            try:
+                amount = float(row[amount_field])
+            except (KeyError, TypeError, ValueError):
+                skipped += 1
+                continue
+            category = str(row.get(category_field) or "Uncategorized")
+            rows += 1
+            by_year[fiscal_year] += amount
+            by_resource[resource_id] += amount
+            by_category[category] += amount
+            by_year_category[fiscal_year, category] += amount
+
+    categories = sorted(by_category, key=by_category.get, reverse=True)
+    ranked = sorted(by_resource.items(), key=lambda item: item[1], reverse=True)
+    top = dict(ranked[:top_resources])
+    rest = ranked[top_resources:]
+    if rest:
+        top[f"{len(rest)} other resources"] = sum(amount for _, amount in rest)
+    return {
+        "total": round(sum(by_year.values()), 2),
+        "rows": rows,
+        "skipped_rows": skipped,
+        "by_fiscal_year": {fy: round(by_year[fy], 2) for fy in sorted(by_year)},
+        "by_category": {c: round(by_category[c], 2) for c in categories},
+        "by_resource": {r: round(amount, 2) for r, amount in top.items()},
+        "table": {
+            "columns": ["fiscalYear", *categories, "total"],
+            "rows": [
+                [
+                    fy,
+                    *(round(by_year_category[fy, c], 2) for c in categories),
+                    round(by_year[fy], 2),
+                ]
+                for fy in sorted(by_year)
+            ],
+        },
+    }
+
+
+class _CostDiskCache:
+    """
+    Cost responses persisted in SQLite, keyed by (fiscalYear, resourceID, projectNumber), so
+    every Open WebUI worker on the host shares them. Bodies are zlib-compressed JSON and the
+    database runs in WAL mode so readers never wait on a writer. Closed fiscal years never
+    expire; the current (or a future) fiscal year expires after COST_CACHE_TTL.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS costs (
+        fiscal_year TEXT NOT NULL,
+        resource_id TEXT NOT NULL,
+        project_number TEXT NOT NULL,
+        body BLOB NOT NULL,
+        fetched_at REAL NOT NULL,
+        PRIMARY KEY (fiscal_year, resource_id, project_number)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0}
+
+    def _connect(self, path: str) -> sqlite3.Connection:
+        connections = self._local.__dict__.setdefault("connections", {})
+        conn = connections.get(path)
+        if conn is None:
+            conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            connections[path] = conn
+        return conn
+
+    @staticmethod
+    def _key(params: dict) -> tuple:
+        return tuple(
+            str(params[name]).strip()
+            for name in ("fiscalYear", "resourceID", "projectNumber")
+        )
+
+    @staticmethod
+    def _is_closed(fiscal_year: str) -> bool:
+        try:
+            return int(fiscal_year) < int(_current_fiscal_year())
+        except ValueError:
+            return False
+
+    def get(self, path: str, params: dict, ttl: float):
+        """Return the cached response for `params`, or None when absent or expired."""
+        key = self._key(params)
+        try:
+            row = (
+                self._connect(path)
+                .execute(
+                    "SELECT body, fetched_at FROM costs"
+                    " WHERE fiscal_year = ? AND resource_id = ? AND project_number = ?",
+                    key,
+                )
+                .fetchone()
+            )
+        except sqlite3.Error:  # an unusable cache file only costs the upstream call
+            row = None
+        if row is None or (not self._is_closed(key[0]) and time.time() - row[1] > ttl):
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, path: str, params: dict, value) -> None:
+        body = zlib.compress(json.dumps(value, separators=(",", ":")).encode())
+        try:
+            self._connect(path).execute(
+                "INSERT OR REPLACE INTO costs VALUES (?, ?, ?, ?, ?)",
+                (*self._key(params), body, time.time()),
+            )
+        except sqlite3.Error:
+            return
+        self.stats["stores"] += 1
+
+
+_COST_CACHE = _CostDiskCache()
+
+
+def cost_cache_stats() -> dict:
+    """Return hit/miss/store counters of the on-disk cost cache."""
+    return dict(_COST_CACHE.stats)
+
+
+class _Prefetcher:
+    """
+    Speculative cost lookups started before anyone asked for them. A later lookup for the same
+    (fiscalYear, resourceID, projectNumber) awaits the running or finished task instead of
+    calling the cost API; entries are dropped after their TTL or when MAX_ENTRIES is exceeded.
+    """
+
+    MAX_ENTRIES = 512
+
+    def __init__(self):
+        self._tasks = OrderedDict()  # key -> (task, expires_at)
+        self.stats = {"started": 0, "used": 0}
+
+    def start(self, key: tuple, fetch, ttl: float) -> bool:
+        now = time.monotonic()
+        entry = self._tasks.get(key)
+        if entry is not None and entry[1] > now:
+            return False
+        task = asyncio.get_running_loop().create_task(fetch())
+        # A failed prefetch is only a missed optimization; the real lookup reports errors.
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._tasks[key] = (task, now + ttl)
+        self._tasks.move_to_end(key)
+        while len(self._tasks) > self.MAX_ENTRIES:
+            self._tasks.popitem(last=False)
+        self.stats["started"] += 1
+        return True
+
+    def take(self, key: tuple) -> asyncio.Task | None:
+        entry = self._tasks.get(key)
+        if entry is None:
+            return None
+        task, expires_at = entry
+        if (
+            expires_at <= time.monotonic()
+            or task.get_loop() is not asyncio.get_running_loop()
+        ):
+            del self._tasks[key]
+            return None
+        self.stats["used"] += 1
+        return task
+
+
+_PREFETCHER = _Prefetcher()
+
+
+def prefetch_stats() -> dict:
+    """Return how many speculative cost lookups were started and how many were used."""
+    return dict(_PREFETCHER.stats)
+
+
+def _is_cost_result(result) -> bool:
+    return not (isinstance(result, dict) and "error" in result)
+
+
+_LOOKUP_KEYS = ("fiscalYear", "hanfordID", "projectNumber")
+
+
+_HANFORD_ID_KEY = re.compile(r"^hanford_?id$", re.IGNORECASE)
+
+
+def _people_with_hanford_ids(payload) -> list:
+    """
+    Return (hanford ID, record) for each Hub record carrying a Hanford ID, at any depth of the
+    response and in the order the Hub ranked them, without duplicates.
+    """
+    found = []
+    seen = set()
+    stack = [payload]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if _HANFORD_ID_KEY.match(key) and str(value or "").strip():
+                    hanford_id = str(value).strip()
+                    if hanford_id not in seen:
+                        seen.add(hanford_id)
+                        found.append((hanford_id, node))
+                    break
+            children = node.values()
+        elif isinstance(node, list):
+            children = node
+        else:
+            continue
+        stack.extend(
+            reversed([child for child in children if isinstance(child, (dict, list))])
+        )
+    return found
 
 
 class Tools:
@@ -21,57 +1201,325 @@ class Tools:
             default="", description="client secret for service account"
         )
         TENANT_ID: str = Field(default="", description="tenant ID for service account")
+        HTTP_MAX_CONNECTIONS: int = Field(
+            default=20, description="maximum pooled connections per upstream host"
+        )
+        HTTP_MAX_KEEPALIVE_CONNECTIONS: int = Field(
+            default=10,
+            description="maximum idle keep-alive connections per upstream host",
+        )
+        HTTP_TIMEOUT: float = Field(
+            default=10.0,
+            description="read/write/pool timeout for upstream calls in seconds",
+        )
+        HTTP_CONNECT_TIMEOUT: float = Field(
+            default=5.0, description="connect timeout for upstream calls in seconds"
+        )
+        WARMUP_ON_LOAD: bool = Field(
+            default=True,
+            description="fetch tokens and open upstream connections in the background when the tool loads or its credentials change",
+        )
+        WARMUP_CONNECTIONS: int = Field(
+            default=2,
+            description="connections per upstream host opened by the warm-up; 0 only fetches tokens",
+        )
+        ADAPTIVE_TIMEOUT_MULTIPLIER: float = Field(
+            default=3.0,
+            description="read timeout as a multiple of the upstream's observed p99 latency, capped at HTTP_TIMEOUT; 0 always uses HTTP_TIMEOUT",
+        )
+        ADAPTIVE_TIMEOUT_FLOOR: float = Field(
+            default=1.0,
+            description="lowest adaptive read timeout in seconds",
+        )
+        CIRCUIT_FAILURE_THRESHOLD: int = Field(
+            default=5,
+            description="consecutive failures (errors, timeouts, 5xx) that open an upstream's circuit; 0 disables the breaker",
+        )
+        CIRCUIT_RESET_TIMEOUT: float = Field(
+            default=30.0,
+            description="seconds an open circuit fails calls fast before letting a probe through",
+        )
+        RATE_LIMIT_PER_SECOND: float = Field(
+            default=0.0,
+            description="interactive calls per second allowed to each API gateway, shared by all enterprise tools; 0 disables throttling",
+        )
+        RATE_LIMIT_BATCH_PER_SECOND: float = Field(
+            default=0.0,
+            description="batch calls (e.g. search_costs_many) per second allowed to each API gateway; 0 disables throttling",
+        )
+        RATE_LIMIT_BURST: int = Field(
+            default=10,
+            description="calls a gateway budget may send at once after being idle",
+        )
+        RETRY_MAX_ATTEMPTS: int = Field(
+            default=3,
+            description="retries of a call answered 429 or 503",
+        )
+        RETRY_BASE_DELAY: float = Field(
+            default=0.5,
+            description="first retry backoff in seconds, doubled per retry with full jitter, when no Retry-After is given",
+        )
+        RETRY_MAX_DELAY: float = Field(
+            default=20.0,
+            description="longest retry wait in seconds; a longer Retry-After is returned to the caller instead",
+        )
+        UPSTREAM_MAX_CONCURRENCY: int = Field(
+            default=20,
+            description="calls in flight to each upstream host, shared by all enterprise tools; 0 disables admission control",
+        )
+        UPSTREAM_QUEUE_SIZE: int = Field(
+            default=1000,
+            description="calls that may wait for a slot per upstream host; further calls are rejected",
+        )
+        UPSTREAM_MAX_WAIT: float = Field(
+            default=5.0,
+            description="seconds an interactive call may wait for a slot before it is rejected",
+        )
+        UPSTREAM_BATCH_MAX_WAIT: float = Field(
+            default=60.0,
+            description="seconds a batch call may wait for a slot before it is rejected",
+        )
+        BATCH_CONCURRENCY: int = Field(
+            default=8,
+            description="maximum concurrent upstream calls per search_costs_many or summarize_project_costs",
+        )
+        COST_AMOUNT_FIELD: str = Field(
+            default="amount",
+            description="field of a cost row holding the amount summed by summarize_project_costs",
+        )
+        COST_CATEGORY_FIELD: str = Field(
+            default="costCategory",
+            description="field of a cost row holding the category summarize_project_costs breaks totals down by",
+        )
+        COST_CACHE_PATH: str = Field(
+            default="",
+            description="SQLite file that caches cost responses for all workers on the host; empty disables the cache",
+        )
+        COST_CACHE_TTL: float = Field(
+            default=3600.0,
+            description="seconds a cached response for the current fiscal year is used; closed fiscal years never expire",
+        )
+        PREFETCH_PEOPLE: int = Field(
+            default=3,
+            description="people ranked after those search_person_costs returns whose costs are prefetched for a follow-up question; 0 disables prefetching",
+        )
+        PREFETCH_TTL: float = Field(
+            default=300.0, description="seconds a prefetched cost lookup is kept"
+        )
+        SUMMARY_TOP_RESOURCES: int = Field(
+            default=20,
+            description="resources listed individually in a cost summary; the rest are totalled together",
+        )
+        EMIT_VERBOSITY: Literal["off", "status", "debug"] = Field(
+            default="status",
+            description="off: no events, status: one status event with phase timings per call, debug: every step as a chat message",
+        )
+        METRICS_FILE: str = Field(
+            default="",
+            description="path of a Prometheus textfile the call metrics are exported to; empty disables the export",
+        )
+        METRICS_FILE_INTERVAL: float = Field(
+            default=15.0, description="minimum seconds between rewrites of METRICS_FILE"
+        )
+        RECORD_CASSETTE_DIR: str = Field(
+            default="",
+            description="directory that sanitized upstream request/response pairs are appended to, for benchmarks/replay_cassettes.py; empty disables recording",
+        )
 
     _ENDPOINT = "https://apimdevgw.pnnl.gov/proof-of-concept-costs-mcp/v1/costs"
+    _HUB_ENDPOINT = "https://apimdevgw.pnnl.gov/proof-of-concept-hub-mcp/v1/hub"
+    _SCOPE = "api://proof-of-concept.pnnl.gov/cost-estimator/.default"
+    _HUB_SCOPE = "api://proof-of-concept.pnnl.gov/hub/.default"
 
     def __init__(self):
         """Initialize the Tool."""
         self.valves = self.Valves()
 
-    async def _get_access_token(self, __event_emitter__=None) -> str:
+    @property
+    def valves(self):
+        return self._valves
+
+    @valves.setter
+    def valves(self, valves) -> None:
+        # Open WebUI assigns the saved valves before every call; _warm_up only acts on a change.
+        self._valves = valves
+        _warm_up(
+            valves, (self._SCOPE, self._HUB_SCOPE), (self._ENDPOINT, self._HUB_ENDPOINT)
+        )
+
+    def _record(self, method: str, emitter: _Emitter) -> None:
+        """Record one call's phase timings, status and size, and refresh METRICS_FILE."""
+        timings = {**emitter.timings, "total": time.perf_counter() - emitter.started}
+        _METRICS.record_call(
+            method, timings, emitter.status or "cached", emitter.response_bytes
+        )
+        _METRICS.write(self.valves.METRICS_FILE, self.valves.METRICS_FILE_INTERVAL)
+
+    async def _get_access_token(self, emitter: _Emitter, scope: str = "") -> str:
         """
         Retrieve an access token from Azure AD using Client Credentials flow.
         This method uses the CLIENT_ID, CLIENT_SECRET, and TENANT_ID from the pipeline's valves.
+        :scope: the scope to request; defaults to the cost API.
         :return: Access token as a string.
         """
-        SCOPE = "api://proof-of-concept.pnnl.gov/cost-estimator/.default"
+        SCOPE = scope or self._SCOPE
 
-        await __event_emitter__(
-            {
-                "type": "message",
-                "data": {"content": "Inside the _get_access_token method\n"},
-            }
-        )
+        await emitter.debug("Inside the _get_access_token method")
         try:
-            credential = ClientSecretCredential(
-                tenant_id=self.valves.TENANT_ID,
-                client_id=self.valves.CLIENT_ID,
-                client_secret=self.valves.CLIENT_SECRET,
-            )
-            token = credential.get_token(SCOPE).token
+            with emitter.phase("token"):
+                token = await _TOKEN_BROKER.get_token(
+                    self.valves.TENANT_ID,
+                    self.valves.CLIENT_ID,
+                    self.valves.CLIENT_SECRET,
+                    SCOPE,
+                )
+        except Exception as e:
+            emitter.status = "exception"
+            await emitter.debug("The token creation was NOT successful.")
+            raise Exception(f"Failed to create ClientSecretCredential: {str(e)}")
+        await emitter.debug("The token was retrieved successfully.")
 
-            await __event_emitter__(
-                {
-                    "type": "message",
-                    "data": {"content": "The token was retrieved successfully.\n"},
-                }
+        return token
+
+    async def _request(
+        self,
+        params: dict,
+        headers: dict,
+        emitter: _Emitter,
+        priority: str = "interactive",
+    ) -> dict:
+        """
+        POST one cost lookup and return the decoded JSON body or an error dictionary.
+        Batch lookups pass priority="batch" to draw on the gateway's batch budget.
+        """
+        await emitter.debug("The params are " + str(params))
+        try:
+            with emitter.phase("upstream"):
+                resp = await _send(
+                    "POST",
+                    self._ENDPOINT,
+                    params,
+                    headers,
+                    self.valves,
+                    emitter.timings,
+                    priority,
+                )
+            emitter.status = resp.status_code
+            emitter.response_bytes = len(resp.content)
+            if resp.status_code == 200:
+                await emitter.debug("The endpoint was called successfully.")
+                with emitter.phase("decode"):
+                    return resp.json()
+            await emitter.debug(
+                "There was an error calling the endpoint. The error reads: " + resp.text
             )
+            return {
+                "error": f"API request failed: Status {resp.status_code}",
+                "details": resp.text,
+            }
+        except _AdmissionRejected as e:
+            emitter.status = "rejected"
+            await emitter.debug("The call was rejected by admission control: " + str(e))
+            return {"error": "Upstream busy, call rejected", "details": str(e)}
         except Exception as e:
-            await __event_emitter__(
-                {
-                    "type": "message",
-                    "data": {"content": "The token creation was NOT successful.\n"},
-                }
+            emitter.status = (
+                "circuit_open" if isinstance(e, _CircuitOpenError) else "exception"
             )
-            raise Exception(f"Failed to create ClientSecretCredential: {str(e)}")
-        await __event_emitter__(
-            {
-                "type": "message",
-                "data": {"content": "The token creation was successful.\n"},
-            }
+            await emitter.debug(
+                "There was an exception calling the endpoint. The error reads: "
+                + str(e)
+            )
+            return {"error": "API call exception", "details": str(e)}
+
+    async def _lookup(
+        self, params: dict, emitter: _Emitter, priority: str = "interactive"
+    ) -> dict:
+        """
+        Answer one cost lookup from a prefetched result when there is one, else from the
+        on-disk cache when COST_CACHE_PATH is set, else from the cost API.
+        """
+        task = _PREFETCHER.take(_CostDiskCache._key(params))
+        if task is not None:
+            with emitter.phase("prefetch"):
+                result = await asyncio.shield(task)
+            if _is_cost_result(result):
+                emitter.status = "prefetched"
+                return result
+        return await self._fetch_lookup(params, emitter, priority)
+
+    async def _fetch_lookup(
+        self, params: dict, emitter: _Emitter, priority: str = "interactive"
+    ) -> dict:
+        """
+        Answer one cost lookup from the on-disk cache when COST_CACHE_PATH is set, otherwise
+        from the cost API, persisting successful responses.
+        """
+        path = self.valves.COST_CACHE_PATH
+        if path:
+            with emitter.phase("disk_cache"):
+                cached = await asyncio.to_thread(
+                    _COST_CACHE.get, path, params, self.valves.COST_CACHE_TTL
+                )
+            if cached is not None:
+                emitter.status = "disk_cache"
+                return cached
+        headers = await self._headers(emitter)
+        result = await self._request(params, headers, emitter, priority)
+        if path and emitter.status == 200:
+            with emitter.phase("disk_cache"):
+                await asyncio.to_thread(_COST_CACHE.put, path, params, result)
+        return result
+
+    async def _hub_people(self, person: str, emitter: _Emitter) -> tuple[list, dict]:
+        """
+        Resolve `person` through the Hub, by name first and then as a search term, and return
+        ([(hanford ID, record), ...], error dictionary or None).
+        """
+        token = await self._get_access_token(emitter, self._HUB_SCOPE)
+        headers = {"Authorization": f"Bearer {token}", "User-Agent": "requests"}
+        error = None
+        attempts = (
+            ("GET", {"name": person}),
+            ("POST", {"searchTerm": person, "hasAvailability": "False"}),
         )
+        for method, params in attempts:
+            try:
+                with emitter.phase("hub"):
+                    resp = await _send(
+                        method,
+                        self._HUB_ENDPOINT,
+                        params,
+                        headers,
+                        self.valves,
+                        emitter.timings,
+                    )
+            except Exception as e:
+                error = {"error": "Hub call exception", "details": str(e)}
+                continue
+            if resp.status_code != 200:
+                error = {
+                    "error": f"Hub request failed: Status {resp.status_code}",
+                    "details": resp.text,
+                }
+                continue
+            try:
+                payload = resp.json()
+            except (
+                ValueError
+            ) as e:  # an HTML error page from the gateway, a truncated body
+                error = {"error": "Hub call exception", "details": str(e)}
+                continue
+            people = _people_with_hanford_ids(payload)
+            if people:
+                return people, None
+        return [], error
 
-        return token
+    async def _headers(self, emitter: _Emitter) -> dict:
+        token = await self._get_access_token(emitter)
+        return {
+            "Authorization": f"Bearer {token}",
+            "User-Agent": "requests",  # Example curl User-Agent value
+        }
 
     async def search_costs(
         self,
@@ -90,63 +1538,264 @@ class Tools:
 
         :return: A dictionary containing the search results or an error message.
         """
-        token = await self._get_access_token(__event_emitter__)
-        await __event_emitter__(
-            {
-                "type": "message",
-                "data": {"content": "The token was retrieved successfully.\n"},
-            }
-        )
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "User-Agent": "requests",  # Example curl User-Agent value
-        }
+        emitter = _Emitter(__event_emitter__, self.valves.EMIT_VERBOSITY)
         params = {
             "fiscalYear": fiscalYear,
             "resourceID": str(hanfordID),
             "projectNumber": str(projectNumber),
         }
-        await __event_emitter__(
-            {
-                "type": "message",
-                "data": {"content": "The params are " + str(params) + "\n"},
+        result = await self._lookup(params, emitter)
+        await emitter.done("Cost search", result)
+        self._record("search_costs", emitter)
+        return result
+
+    async def _fetch_many(
+        self, lookups: dict, emitter: _Emitter, method: str, priority: str = "batch"
+    ) -> tuple[dict, dict]:
+        """
+        Fetch {key: params} lookups concurrently (at most BATCH_CONCURRENCY at once) on the
+        gateway's `priority` budget and return ({key: result}, {key: error}).
+        """
+        results = {}
+        errors = {}
+        if not lookups:
+            return results, errors
+        semaphore = asyncio.Semaphore(max(1, self.valves.BATCH_CONCURRENCY))
+
+        async def fetch(key, params: dict) -> None:
+            # Per-lookup steps are not streamed; only the batch status event is emitted.
+            quiet = _Emitter(None)
+            async with semaphore:
+                try:
+                    result = await self._lookup(params, quiet, priority)
+                except Exception as e:  # e.g. the token fetch; fail this lookup only
+                    quiet.status = "exception"
+                    result = {"error": "API call exception", "details": str(e)}
+            # Under its own label, so calls_total{method=...} counts tool calls, not lookups.
+            self._record(f"{method}_lookup", quiet)
+            if not _is_cost_result(result):
+                errors[key] = result
+            else:
+                results[key] = result
+
+        with emitter.phase("upstream"):
+            await asyncio.gather(*(fetch(k, p) for k, p in lookups.items()))
+        return results, errors
+
+    async def search_costs_many(
+        self, lookups: list[dict], __event_emitter__=None
+    ) -> dict:
+        """
+        Search for costs for many fiscal year, hanford ID, and project number combinations in one call.
+        Use this instead of calling search_costs repeatedly, for example to cost a whole team across several fiscal years.
+
+        :lookups: A list of objects with the keys fiscalYear, hanfordID and projectNumber. Lists of [fiscalYear, hanfordID, projectNumber] are also accepted. Duplicate lookups are only fetched once.
+
+        :return: A dictionary with "results" keyed by "fiscalYear/hanfordID/projectNumber", "errors" keyed the same way for lookups that failed, and a "summary" of the counts.
+        """
+        emitter = _Emitter(__event_emitter__, self.valves.EMIT_VERBOSITY)
+        if not lookups:
+            emitter.status = "invalid"
+            result = {"error": "No lookups given"}
+            await emitter.done("Cost search", result)
+            self._record("search_costs_many", emitter)
+            return result
+        unique = {}
+        errors = {}
+        for item in lookups:
+            if isinstance(item, dict) and all(k in item for k in _LOOKUP_KEYS):
+                values = tuple(item[k] for k in _LOOKUP_KEYS)
+            elif isinstance(item, (list, tuple)) and len(item) == 3:
+                values = tuple(item)
+            else:  # a string or other iterable would be unpacked character by character
+                errors[str(item)] = {
+                    "error": "Invalid lookup",
+                    "details": "Expected fiscalYear, hanfordID and projectNumber.",
+                }
+                continue
+            params = {
+                "fiscalYear": str(values[0]).strip(),
+                "resourceID": str(values[1]).strip(),
+                "projectNumber": str(values[2]).strip(),
             }
-        )
+            unique.setdefault("/".join(params.values()), params)
+
         try:
-            resp = requests.post(
-                self._ENDPOINT, data=params, headers=headers, timeout=10
+            results, fetch_errors = await self._fetch_many(
+                unique, emitter, "search_costs_many"
             )
-            if resp.status_code == 200:
-                await __event_emitter__(
-                    {
-                        "type": "message",
-                        "data": {"content": "The endpoint was called successfully.\n"},
-                    }
-                )
-                return resp.json()
-            else:
-                await __event_emitter__(
-                    {
-                        "type": "message",
-                        "data": {
-                            "content": "There was an error calling the endpoint. The error reads: "
-                            + resp.text
-                        },
-                    }
+            errors.update(fetch_errors)
+
+            summary = {
+                "requested": len(lookups),
+                "unique": len(unique),
+                "succeeded": len(results),
+                "failed": len(errors),
+            }
+            emitter.status = 200 if not errors else "partial" if results else "error"
+            await emitter.done(
+                f"Cost search for {len(results)} of {len(unique)} lookups", summary
+            )
+            return {"results": results, "errors": errors, "summary": summary}
+        except Exception:
+            emitter.status = "exception"
+            raise
+        finally:
+            self._record("search_costs_many", emitter)
+
+    async def summarize_project_costs(
+        self,
+        projectNumber: int,
+        hanfordIDs: list[int],
+        fiscalYears: list[str] | None = None,
+        __event_emitter__=None,
+    ) -> dict:
+        """
+        Total a project's costs over many people and fiscal years in one call, instead of fetching raw cost rows with search_costs_many and adding them up.
+        Use this for questions like "what did the team cost on project X per year" or "which cost categories dominate".
+
+        :projectNumber: the project number to total.
+        :hanfordIDs: the hanford IDs of the people (resources) to include. These are seven digit numbers and can be sourced from users' hub profile responses.
+        :fiscalYears: the fiscal years to include, e.g. ["2024", "2025"]. Defaults to the current fiscal year.
+
+        :return: A dictionary with the grand "total", totals "by_fiscal_year", "by_category" and "by_resource" (largest first), a fiscal year x category "table", and "errors" for lookups that failed.
+        """
+        emitter = _Emitter(__event_emitter__, self.valves.EMIT_VERBOSITY)
+        years = sorted({str(fy).strip() for fy in fiscalYears or []}) or [
+            _current_fiscal_year()
+        ]
+        if isinstance(hanfordIDs, (str, int)):
+            hanfordIDs = [hanfordIDs]  # not one resource per character
+        resources = sorted({str(hanford_id).strip() for hanford_id in hanfordIDs or []})
+        resources = [resource_id for resource_id in resources if resource_id]
+        if not resources:
+            emitter.status = "invalid"
+            result = {"error": "No hanfordIDs given"}
+            await emitter.done("Cost summary", result)
+            self._record("summarize_project_costs", emitter)
+            return result
+        lookups = {
+            (fiscal_year, resource_id): {
+                "fiscalYear": fiscal_year,
+                "resourceID": resource_id,
+                "projectNumber": str(projectNumber).strip(),
+            }
+            for fiscal_year in years
+            for resource_id in resources
+        }
+        responses, errors = await self._fetch_many(
+            lookups, emitter, "summarize_project_costs"
+        )
+        with emitter.phase("aggregate"):
+            summary = _aggregate_costs(
+                responses,
+                self.valves.COST_AMOUNT_FIELD,
+                self.valves.COST_CATEGORY_FIELD,
+                self.valves.SUMMARY_TOP_RESOURCES,
+            )
+        emitter.status = "partial" if errors else 200
+        result = {
+            "projectNumber": str(projectNumber),
+            "fiscalYears": years,
+            "resources": len(resources),
+            **summary,
+            "errors": {"/".join(key): error for key, error in errors.items()},
+        }
+        await emitter.done(
+            f"Cost summary of {len(responses)} of {len(lookups)} lookups",
+            {"total": result["total"], "rows": result["rows"]},
+        )
+        self._record("summarize_project_costs", emitter)
+        return result
+
+    async def search_person_costs(
+        self,
+        person: str,
+        projectNumber: int,
+        fiscalYears: list[str] | None = None,
+        maxPeople: int = 1,
+        __event_emitter__=None,
+    ) -> dict:
+        """
+        Look up a person's costs on a project in one call: finds the person in the Hub by name or search term, reads their Hanford ID and fetches their costs for every fiscal year concurrently.
+        Use this instead of searching the Hub and then calling search_costs once per year.
+
+        :person: the person's name, or a Hub search term.
+        :projectNumber: the project number to query.
+        :fiscalYears: the fiscal years to include, e.g. ["2024", "2025"]. Defaults to the current fiscal year.
+        :maxPeople: how many of the best-matching people to return costs for. Default is 1.
+
+        :return: A dictionary with "people" (each with "hanfordID", Hub "profile" and "costs" keyed by fiscal year), "errors" for cost lookups that failed and "matches", the number of people the Hub found.
+        """
+        emitter = _Emitter(__event_emitter__, self.valves.EMIT_VERBOSITY)
+        years = sorted({str(fy).strip() for fy in fiscalYears or []}) or [
+            _current_fiscal_year()
+        ]
+        project_number = str(projectNumber).strip()
+        people, error = await self._hub_people(person, emitter)
+        if not people:
+            result = error or {
+                "error": "No matching person",
+                "details": f"The Hub returned nobody with a Hanford ID for {person!r}.",
+            }
+            emitter.status = "not_found"
+            await emitter.done("Person cost search", result)
+            self._record("search_person_costs", emitter)
+            return result
+
+        def params(hanford_id: str, fiscal_year: str) -> dict:
+            return {
+                "fiscalYear": fiscal_year,
+                "resourceID": hanford_id,
+                "projectNumber": project_number,
+            }
+
+        chosen = people[: max(1, maxPeople)]
+        lookups = {
+            (hanford_id, fy): params(hanford_id, fy)
+            for hanford_id, _ in chosen
+            for fy in years
+        }
+        results, errors = await self._fetch_many(
+            lookups, emitter, "search_person_costs", "interactive"
+        )
+
+        # Warm the next-ranked people's costs while the model reads this answer, so a
+        # follow-up about one of them is served from memory.
+        runners_up = people[len(chosen) : len(chosen) + self.valves.PREFETCH_PEOPLE]
+        prefetched = 0
+        for hanford_id, _ in runners_up:
+            for fy in years:
+                lookup = params(hanford_id, fy)
+                prefetched += _PREFETCHER.start(
+                    _CostDiskCache._key(lookup),
+                    lambda lookup=lookup: self._fetch_lookup(
+                        lookup, _Emitter(None), "batch"
+                    ),
+                    self.valves.PREFETCH_TTL,
                 )
-                return {
-                    "error": f"API request failed: Status {resp.status_code}",
-                    "details": resp.text,
-                }
-        except Exception as e:
-            await __event_emitter__(
+
+        emitter.status = "partial" if errors else 200
+        result = {
+            "matches": len(people),
+            "people": [
                 {
-                    "type": "message",
-                    "data": {
-                        "content": "There was an exception calling the endpoint. The error reads: "
-                        + str(e)
-                        + "\n"
+                    "hanfordID": hanford_id,
+                    "profile": record,
+                    "costs": {
+                        fy: results[hanford_id, fy]
+                        for fy in years
+                        if (hanford_id, fy) in results
                     },
                 }
-            )
-            return {"error": "API call exception", "details": str(e)}
+                for hanford_id, record in chosen
+            ],
+            "errors": {"/".join(key): error for key, error in errors.items()},
+            "prefetched": prefetched,
+        }
+        await emitter.done(
+            f"Person cost search for {len(chosen)} of {len(people)} matches",
+            {"lookups": len(lookups), "failed": len(errors)},
+        )
+        self._record("search_person_costs", emitter)
+        return result
@@ -1,38 +1,924 @@
 """
-FastMCP quickstart example.
+Hub Search MCP server.
 
-cd to the `examples/snippets/clients` directory and run:
-    uv run server fastmcp_quickstart stdio
+Searches the hub people index through the labassist proxy. Credentials are read once at
+startup from the environment (or a .env file): TENANT_ID, CLIENT_ID and CLIENT_SECRET. The
+access token is cached and refreshed in the background and upstream calls share a pooled
+keep-alive client, so tools are async and many clients are served concurrently.
+
+Run it on the streamable-HTTP transport described in hub_search_spec.yaml:
+    python hub_search_mcp.py
+or over stdio for local clients:
+    HUB_MCP_TRANSPORT=stdio python hub_search_mcp.py
+
+HUB_MCP_HOST, HUB_MCP_PORT and HUB_MCP_PATH set where the HTTP transport listens. It binds to
+127.0.0.1 by default, so only local clients (or a reverse proxy on the same host) reach it; set
+HUB_MCP_HOST=0.0.0.0, or one interface's address, to serve other machines.
+Elasticsearch calls get an adaptive timeout and a circuit breaker (HUB_MCP_ADAPTIVE_TIMEOUT_*,
+HUB_MCP_CIRCUIT_*); HUB_MCP_HEDGE_SEARCHES=1 hedges searches slower than their p95.
+HUB_MCP_RATE_LIMIT_* throttle searches (interactive) and index syncs (batch) to the gateway's
+quota, and 429/503 answers are retried (HUB_MCP_RETRY_*) honoring Retry-After.
+
+Set HUB_MCP_PEOPLE_INDEX to a file path to keep a local SQLite copy of the people index, synced
+in the background every HUB_MCP_PEOPLE_INDEX_SYNC_INTERVAL seconds; simple `field:words` queries
+are then answered locally while the copy is younger than HUB_MCP_PEOPLE_INDEX_MAX_AGE.
+    HUB_MCP_PEOPLE_INDEX=people.db python hub_search_mcp.py --sync-index
+runs a single sync and exits.
 """
 
-from mcp.server.fastmcp import FastMCP
-from azure.identity import ClientSecretCredential
-import requests
+import asyncio
+import base64
+import bisect
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import closing, contextmanager
+from email.utils import parsedate_to_datetime
+from types import SimpleNamespace
+
+import httpx
+from dotenv import load_dotenv
+from mcp.server.fastmcp import Context, FastMCP
+from starlette.responses import PlainTextResponse
+
+try:
+    import ijson
+except ImportError:  # listed in requirements.txt; without it stream_parse parses bodies whole and says so
+    ijson = None
+
+# Load credentials once at startup
+load_dotenv()
+TENANT_ID = os.getenv("TENANT_ID", "")
+CLIENT_ID = os.getenv("CLIENT_ID", "")
+CLIENT_SECRET = os.getenv("CLIENT_SECRET", "")
+SCOPE = "https://labassist.pnnl.gov/proxy/.default"
+
+# stdout carries the JSON-RPC stream under the stdio transport, so diagnostics go to logging (stderr)
+logger = logging.getLogger(__name__)
 
 # Create an MCP server
-mcp = FastMCP("Demo")
+mcp = FastMCP(
+    "Hub Search",
+    host=os.getenv("HUB_MCP_HOST", "127.0.0.1"),
+    port=int(os.getenv("HUB_MCP_PORT", "8000")),
+    streamable_http_path=os.getenv("HUB_MCP_PATH", "/sse"),
+    stateless_http=True,
+)
+
+
+ClientSecretCredential = None  # imported from azure.identity on first use, see _credential_class
+
+
+def _credential_class():
+    """Import azure-identity (and msal, cryptography) on the first token fetch rather than at server start."""
+    global ClientSecretCredential
+    if ClientSecretCredential is None:
+        from azure.identity import ClientSecretCredential
+    return ClientSecretCredential
+
+
+class _TokenBroker:
+    """
+    Process-wide cache of Entra ID access tokens keyed by (tenant, client, scope).
+    Tokens are served from memory until shortly before `expires_on` and are refreshed in the
+    background once they enter the refresh window. Concurrent callers share one in-flight fetch.
+    """
+
+    REFRESH_MARGIN = 300  # seconds before expiry at which a background refresh starts
+    EXPIRY_MARGIN = 60  # seconds before expiry at which a cached token is no longer served
+
+    def __init__(self):
+        self._tokens = {}
+        self._credentials = {}
+        self._inflight = {}
+        self.stats = {"hits": 0, "misses": 0, "refreshes": 0, "fetches": 0}
+
+    async def get_token(self, tenant_id: str, client_id: str, client_secret: str, scope: str) -> str:
+        key = (tenant_id, client_id, scope)
+        now = time.time()
+        cached = self._tokens.get(key)
+        if cached is not None and cached.expires_on - self.EXPIRY_MARGIN > now:
+            self.stats["hits"] += 1
+            if cached.expires_on - self.REFRESH_MARGIN <= now and not self._pending(key):
+                self.stats["refreshes"] += 1
+                self._start_fetch(key, client_secret)
+            return cached.token
+
+        self.stats["misses"] += 1
+        task = self._pending(key) or self._start_fetch(key, client_secret)
+        return (await asyncio.shield(task)).token
+
+    def _pending(self, key):
+        task = self._inflight.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            return task
+        return None
+
+    def _start_fetch(self, key, client_secret: str) -> asyncio.Task:
+        tenant_id, client_id, scope = key
+        credential = self._credentials.get((tenant_id, client_id, client_secret))
+        if credential is None:
+            credential = _credential_class()(tenant_id=tenant_id, client_id=client_id, client_secret=client_secret)
+            self._credentials[(tenant_id, client_id, client_secret)] = credential
+        # azure-identity's ClientSecretCredential is synchronous, keep it off the event loop.
+        task = asyncio.get_running_loop().create_task(asyncio.to_thread(credential.get_token, scope))
+        self._inflight[key] = task
+        self.stats["fetches"] += 1
+        task.add_done_callback(lambda done: self._finish_fetch(key, done))
+        return task
+
+    def _finish_fetch(self, key, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            self._tokens[key] = task.result()
+
+
+_TOKEN_BROKER = _TokenBroker()
+
+
+async def _get_access_token() -> str:
+    """
+    Return the server's cached access token for the labassist proxy.
+    :return: Access token as a string.
+    """
+    try:
+        return await _TOKEN_BROKER.get_token(TENANT_ID, CLIENT_ID, CLIENT_SECRET, SCOPE)
+    except Exception as e:
+        raise Exception(f"Failed to create ClientSecretCredential: {str(e)}")
+
+
+_HTTP_CLIENT = {}
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Return the pooled keep-alive client for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _HTTP_CLIENT.get(loop)
+    if client is None:
+        client = _HTTP_CLIENT[loop] = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("HUB_MCP_MAX_CONNECTIONS", "50")),
+                max_keepalive_connections=int(os.getenv("HUB_MCP_MAX_KEEPALIVE_CONNECTIONS", "20")),
+            ),
+            timeout=httpx.Timeout(10.0, connect=5.0),
+        )
+    return client
+
+
+class _SingleFlight:
+    """
+    Coalesces identical in-flight upstream requests. The first caller performs the request and
+    concurrent duplicates await the same result instead of going upstream themselves.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, fetch):
+        loop = asyncio.get_running_loop()
+        task = self._inflight.get(key)
+        if task is None or task.get_loop() is not loop:
+            task = loop.create_task(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # Shielded so a cancelled caller does not cancel the request for everyone else.
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+
+_SINGLE_FLIGHT = _SingleFlight()
+
+
+class _Metrics:
+    """
+    In-process call metrics rendered in the Prometheus text exposition format: latency
+    histograms per phase, call counters per status and response size histograms.
+    Recording is a handful of dict updates, cheap enough to leave on in production.
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+    def __init__(self, tool: str):
+        self._tool = tool
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._written_at = 0.0
+        self._write_failed = False
+
+    def _observe(self, name: str, labels: tuple, value: float, buckets: tuple) -> None:
+        with self._lock:
+            series = self._histograms.get((name, labels))
+            if series is None:
+                series = self._histograms[(name, labels)] = [buckets, [0] * len(buckets), 0.0, 0]
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                series[1][index] += 1
+            series[2] += value
+            series[3] += 1
+
+    def record_call(self, method: str, timings: dict, status, response_bytes=None) -> None:
+        labels = (("tool", self._tool), ("method", method))
+        for phase, seconds in timings.items():
+            self._observe("enterprise_tool_phase_seconds", labels + (("phase", phase),), seconds, self.LATENCY_BUCKETS)
+        if response_bytes is not None:
+            self._observe("enterprise_tool_response_bytes", labels, response_bytes, self.SIZE_BUCKETS)
+        key = ("enterprise_tool_calls_total", labels + (("status", str(status)),))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def render(self) -> str:
+        with self._lock:
+            histograms = {key: (series[0], list(series[1]), series[2], series[3]) for key, series in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = []
+        typed = set()
+        for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{name}_sum{{{label_text}}} {total}")
+            lines.append(f"{name}_count{{{label_text}}} {count}")
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, interval: float) -> None:
+        """Atomically rewrite `path` (e.g. a node_exporter textfile) at most every `interval` seconds."""
+        now = time.monotonic()
+        if not path or now - self._written_at < interval:
+            return
+        self._written_at = now
+        try:
+            with open(f"{path}.tmp", "w") as f:
+                f.write(self.render())
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:  # an export must never fail a call
+            if not self._write_failed:
+                self._write_failed = True
+                logger.warning("Cannot write metrics to %s: %s", path, e)
+
+_METRICS = _Metrics("hub_mcp")
+METRICS_FILE = os.getenv("HUB_MCP_METRICS_FILE", "")
+
+
+@contextmanager
+def _timed(timings: dict, phase: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - started
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics(request) -> PlainTextResponse:
+    """Prometheus scrape endpoint, served alongside the MCP endpoint on the HTTP transports."""
+    return PlainTextResponse(_METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+PEOPLE_SEARCH_URL = "https://labassist.pnnl.gov/proxy/actman/elasticsearch/hub-suggestions-people/_search"
+DEFAULT_PEOPLE_FIELDS = ["name", "email", "title", "department", "location", "skills"]
+PIT_KEEP_ALIVE = "2m"
+SCORE_SORT = ({"_score": "desc"},)
+
+
+class _CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class _Upstream:
+    """
+    Resilience state of one upstream host. A window of recent latencies sets the adaptive
+    timeout and the hedging delay; a circuit breaker fails calls fast after repeated
+    failures and lets a single probe through once CIRCUIT_RESET_TIMEOUT has passed. The
+    settings come from `_RESILIENCE`, which mirrors the Open WebUI tools' valves.
+    """
+
+    WINDOW = 200  # latencies kept for the percentiles
+    MIN_SAMPLES = 20  # below this the valve timeouts apply and nothing is hedged
+
+    def __init__(self, host: str):
+        self.host = host
+        self.latencies = deque(maxlen=self.WINDOW)
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.stats = {"short_circuited": 0, "opened": 0, "hedged": 0, "hedge_wins": 0}
+
+    def percentile(self, q: float) -> float | None:
+        if len(self.latencies) < self.MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def timeout(self, valves) -> float:
+        """Read timeout: a multiple of the observed p99, within [ADAPTIVE_TIMEOUT_FLOOR, HTTP_TIMEOUT]."""
+        p99 = self.percentile(0.99)
+        if p99 is None or self.state != "closed" or not valves.ADAPTIVE_TIMEOUT_MULTIPLIER:
+            return valves.HTTP_TIMEOUT
+        return min(valves.HTTP_TIMEOUT, max(valves.ADAPTIVE_TIMEOUT_FLOOR, p99 * valves.ADAPTIVE_TIMEOUT_MULTIPLIER))
+
+    def admit(self, valves) -> None:
+        if self.state == "closed" or not valves.CIRCUIT_FAILURE_THRESHOLD:
+            return
+        if time.monotonic() - self.opened_at >= valves.CIRCUIT_RESET_TIMEOUT:
+            # This caller is the half-open probe; the rest keep failing fast until it returns.
+            self.state = "half_open"
+            self.opened_at = time.monotonic()
+            return
+        self.stats["short_circuited"] += 1
+        raise _CircuitOpenError(
+            f"{self.host} is unavailable after {self.failures} consecutive failures; "
+            f"retrying in {valves.CIRCUIT_RESET_TIMEOUT - (time.monotonic() - self.opened_at):.0f}s"
+        )
+
+    def record(self, ok: bool, latency: float | None, valves) -> None:
+        if latency is not None:  # timeouts count too, so a slower upstream widens its timeout
+            self.latencies.append(latency)
+        if ok:
+            self.failures = 0
+            self.state = "closed"
+            return
+        self.failures += 1
+        threshold = valves.CIRCUIT_FAILURE_THRESHOLD
+        if self.state == "half_open" or (threshold and self.failures >= threshold):
+            if self.state != "open":
+                self.stats["opened"] += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+_UPSTREAMS = {}
+
+
+def upstream_stats() -> dict:
+    """Return circuit state, failure count, latency percentiles and counters per upstream host."""
+    return {
+        host: {
+            "state": upstream.state,
+            "failures": upstream.failures,
+            "p50": upstream.percentile(0.5),
+            "p95": upstream.percentile(0.95),
+            **upstream.stats,
+        }
+        for host, upstream in _UPSTREAMS.items()
+    }
+
+
+async def _hedged(send, delay: float, upstream: _Upstream) -> httpx.Response:
+    """
+    Await `send()`; if it has not answered within `delay`, send it again and return whichever
+    answers first. The other response is closed, since searches may be streamed.
+    """
+    first = asyncio.ensure_future(send())
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+    upstream.stats["hedged"] += 1
+    second = asyncio.ensure_future(send())
+    pending, winner = {first, second}, None
+    try:
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda task: task.exception() is not None):
+                if task.exception() is None or not pending:
+                    winner = task
+                    upstream.stats["hedge_wins"] += task is second
+                    return task.result()
+    finally:
+        for task in (first, second):
+            if task is winner:
+                continue
+            if task.done() and not task.cancelled() and task.exception() is None:
+                asyncio.get_running_loop().create_task(task.result().aclose())
+            task.cancel()
+
+
+class _TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second up to `burst`. Callers reserve a token
+    and wait until it is due, so waiters are served in arrival order. Thread-safe and not
+    tied to an event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = None
+        self._updated = time.monotonic()
+
+    def reserve(self, rate: float, burst: int) -> float:
+        """Take one token and return the seconds to wait before it may be used."""
+        with self._lock:
+            now = time.monotonic()
+            if self._tokens is None:
+                self._tokens = float(burst)
+            self._tokens = min(burst, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / rate
 
-def _get_access_token(TENANT_ID, CLIENT_ID, CLIENT_SECRET) -> str:
+
+class _GatewayLimiter:
+    """
+    Client-side throttle for one API gateway, with separate interactive and batch budgets.
+    A 429 with Retry-After holds back every caller of the gateway until it has passed.
+    """
+
+    def __init__(self):
+        self.buckets = {"interactive": _TokenBucket(), "batch": _TokenBucket()}
+        self.blocked_until = 0.0
+        self.stats = {"throttled": 0, "throttled_seconds": 0.0, "retries": 0}
+
+    async def acquire(self, priority: str, rate: float, burst: int) -> float:
+        """Wait for a token of the `priority` budget (unlimited when `rate` is 0); return the wait."""
+        wait = self.blocked_until - time.monotonic()
+        if rate > 0:
+            wait = max(wait, self.buckets[priority].reserve(rate, burst))
+        if wait <= 0:
+            return 0.0
+        self.stats["throttled"] += 1
+        self.stats["throttled_seconds"] += wait
+        await asyncio.sleep(wait)
+        return wait
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+_GATEWAY_LIMITERS = {}
+
+
+def _gateway_limiter(host: str) -> _GatewayLimiter:
+    return _GATEWAY_LIMITERS.get(host) or _GATEWAY_LIMITERS.setdefault(host, _GatewayLimiter())
+
+
+def _retry_after(resp: httpx.Response) -> float | None:
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP-date), if any."""
+    value = resp.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_RESILIENCE = SimpleNamespace(
+    HTTP_TIMEOUT=10.0,
+    ADAPTIVE_TIMEOUT_MULTIPLIER=float(os.getenv("HUB_MCP_ADAPTIVE_TIMEOUT_MULTIPLIER", "3.0")),
+    ADAPTIVE_TIMEOUT_FLOOR=float(os.getenv("HUB_MCP_ADAPTIVE_TIMEOUT_FLOOR", "1.0")),
+    CIRCUIT_FAILURE_THRESHOLD=int(os.getenv("HUB_MCP_CIRCUIT_FAILURE_THRESHOLD", "5")),
+    CIRCUIT_RESET_TIMEOUT=float(os.getenv("HUB_MCP_CIRCUIT_RESET_TIMEOUT", "30.0")),
+    HEDGE_SEARCHES=os.getenv("HUB_MCP_HEDGE_SEARCHES", "").lower() in ("1", "true", "yes"),
+    RATE_LIMIT_PER_SECOND=float(os.getenv("HUB_MCP_RATE_LIMIT_PER_SECOND", "0")),
+    RATE_LIMIT_BATCH_PER_SECOND=float(os.getenv("HUB_MCP_RATE_LIMIT_BATCH_PER_SECOND", "0")),
+    RATE_LIMIT_BURST=int(os.getenv("HUB_MCP_RATE_LIMIT_BURST", "10")),
+    RETRY_MAX_ATTEMPTS=int(os.getenv("HUB_MCP_RETRY_MAX_ATTEMPTS", "3")),
+    RETRY_BASE_DELAY=float(os.getenv("HUB_MCP_RETRY_BASE_DELAY", "0.5")),
+    RETRY_MAX_DELAY=float(os.getenv("HUB_MCP_RETRY_MAX_DELAY", "20.0")),
+)
+
+
+async def _send_search(request_args: dict, stream: bool, priority: str = "interactive", method: str = "POST", hedge: bool = True) -> httpx.Response:
+    """
+    POST a search through the Elasticsearch upstream's circuit breaker with an adaptive timeout;
+    with HUB_MCP_HEDGE_SEARCHES and `hedge` a search slower than the upstream's p95 is hedged
+    (searches are idempotent even though they are POSTs). Each attempt waits for the gateway's
+    `priority` budget (index syncs are "batch") and a 429 or 503 is retried after its Retry-After
+    or a jittered exponential backoff. Point-in-time calls use `method` and go the same way, unhedged.
+    """
+    client = _get_http_client()
+    host = httpx.URL(request_args["url"]).host
+    upstream = _UPSTREAMS.get(host) or _UPSTREAMS.setdefault(host, _Upstream(host))
+    limiter = _gateway_limiter(host)
+    config = _RESILIENCE
+    rate = config.RATE_LIMIT_PER_SECOND if priority == "interactive" else config.RATE_LIMIT_BATCH_PER_SECOND
+    for retry in range(config.RETRY_MAX_ATTEMPTS + 1):
+        await limiter.acquire(priority, rate, config.RATE_LIMIT_BURST)
+        upstream.admit(config)
+        timeout = httpx.Timeout(upstream.timeout(config), connect=5.0)
+        send = lambda: client.send(client.build_request(method, timeout=timeout, **request_args), stream=stream)
+        delay = upstream.percentile(0.95) if config.HEDGE_SEARCHES and hedge else None
+        started = time.perf_counter()
+        try:
+            resp = await (_hedged(send, delay, upstream) if delay else send())
+        except httpx.TimeoutException:
+            upstream.record(False, timeout.read, config)
+            raise
+        except httpx.HTTPError:
+            upstream.record(False, None, config)
+            raise
+        upstream.record(resp.status_code < 500, time.perf_counter() - started, config)
+        if resp.status_code not in (429, 503) or retry == config.RETRY_MAX_ATTEMPTS:
+            return resp
+        retry_after = _retry_after(resp)
+        if retry_after is not None and retry_after > config.RETRY_MAX_DELAY:
+            return resp
+        await resp.aclose()
+        limiter.stats["retries"] += 1
+        if retry_after is not None:
+            limiter.block(retry_after)  # the next acquire waits it out
+        else:
+            await asyncio.sleep(random.uniform(0, min(config.RETRY_MAX_DELAY, config.RETRY_BASE_DELAY * 2**retry)))
+
+
+def _compact_hit(hit: dict) -> dict:
+    """Flatten an ES hit into a people record: its id plus the requested `_source` fields."""
+    return {"id": hit.get("_id"), **(hit.get("_source") or {})}
+
+
+class _AsyncReader:
+    """Async file-like view of a response body, which ijson parses incrementally."""
+
+    def __init__(self, resp: httpx.Response):
+        self._chunks = resp.aiter_bytes()
+
+    async def read(self, size: int = -1) -> bytes:
+        if size == 0:  # ijson probes with read(0) to tell bytes from str
+            return b""
+        return await anext(self._chunks, b"")
+
+
+def _encode_page_token(after: list, pit: str | None) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"after": after, "pit": pit}).encode()).decode()
+
+
+def _decode_page_token(page_token: str) -> dict | None:
+    """The position in a next_page_token (`after` and `pit`, or a local `offset`); None if malformed."""
+    try:
+        page = json.loads(base64.urlsafe_b64decode(page_token.encode()))
+    except ValueError:  # bad base64, bad UTF-8 and bad JSON are all ValueErrors
+        return None
+    if not isinstance(page, dict):
+        return None
+    if "offset" in page:
+        return page if isinstance(page["offset"], int) and page["offset"] >= 0 else None
+    if isinstance(page.get("after"), list) and isinstance(page.get("pit"), (str, type(None))):
+        return page
+    return None
+
+
+_PIT_SUPPORT = {"enabled": True}  # cleared once the proxy refuses point-in-time calls
+
+
+async def _open_pit(index_url: str, headers: dict, priority: str) -> str | None:
+    """Open a point in time on the people index; None when it cannot be opened."""
+    if not _PIT_SUPPORT["enabled"]:
+        return None
+    request_args = {"url": f"{index_url}/_pit", "params": {"keep_alive": PIT_KEEP_ALIVE}, "headers": headers}
+    try:
+        resp = await _send_search(request_args, False, priority, hedge=False)
+    except (httpx.HTTPError, _CircuitOpenError):
+        return None
+    if resp.status_code in (400, 403, 404, 405):
+        _PIT_SUPPORT["enabled"] = False
+    if resp.status_code != 200:
+        return None
+    try:
+        payload = resp.json()
+    except ValueError:
+        return None
+    return payload.get("id") if isinstance(payload, dict) else None
+
+
+async def _close_pit(base_url: str, pit: str, headers: dict) -> None:
+    request_args = {"url": f"{base_url}/_pit", "json": {"id": pit}, "headers": headers}
+    try:
+        await _send_search(request_args, False, "batch", method="DELETE", hedge=False)
+    except (httpx.HTTPError, _CircuitOpenError):
+        pass  # it expires after PIT_KEEP_ALIVE anyway
+
+
+async def _search_page(query: dict, fields: list | None, size: int, page: dict | None, headers: dict, stream_parse: bool, call: dict, sort: list = SCORE_SORT, priority: str = "interactive", use_pit: bool = False) -> dict:
+    """
+    Fetch one page of people matching the ES `query` in `sort` order and return
+    {"total", "count", "people", "next_page_token"} or an error dict.
+    A page is a plain index search paged with `search_after` and a `_doc` tiebreaker, so the
+    common one-page lookup is a single round trip. With `use_pit` (streamed pages, index syncs)
+    the pages are read inside a point in time so results stay consistent across pages; when one
+    cannot be opened, or searching it fails on the first page (a proxy that forwards `_pit` but
+    not the index-less `_search`), the index is paged directly.
+    Phase timings, the status code and the body size are written into `call`.
+    """
+    index_url = PEOPLE_SEARCH_URL.rsplit("/_search", 1)[0]
+    base_url = index_url.rsplit("/", 1)[0]
+    if page:
+        return await _read_page(query, fields, size, page["after"], page.get("pit"), headers, stream_parse, call, sort, priority)
+    pit = await _open_pit(index_url, headers, priority) if use_pit else None
+    result = await _read_page(query, fields, size, None, pit, headers, stream_parse, call, sort, priority)
+    if pit and "error" in result:
+        if call["status"] in (400, 403, 404, 405):
+            _PIT_SUPPORT["enabled"] = False
+        asyncio.get_running_loop().create_task(_close_pit(base_url, pit, headers))
+        result = await _read_page(query, fields, size, None, None, headers, stream_parse, call, sort, priority)
+    return result
+
+
+async def _read_page(query: dict, fields: list | None, size: int, after: list | None, pit: str | None, headers: dict, stream_parse: bool, call: dict, sort: list, priority: str) -> dict:
+    """
+    One search request of _search_page, inside `pit` when given. `_source` filtering and
+    `filter_path` keep only the requested fields, ids and sort values; with `stream_parse` the
+    hits are decoded incrementally from the socket. A finished point in time is closed.
+    """
+    index_url = PEOPLE_SEARCH_URL.rsplit("/_search", 1)[0]
+    base_url = index_url.rsplit("/", 1)[0]
+    body = {"query": query, "size": size, "_source": fields if fields is not None else True, "track_total_hits": True}
+    if pit:
+        url = f"{base_url}/_search"
+        body["pit"] = {"id": pit, "keep_alive": PIT_KEEP_ALIVE}
+        body["sort"] = list(sort)  # Elasticsearch appends the _shard_doc tiebreaker
+    else:
+        url = PEOPLE_SEARCH_URL
+        body["sort"] = list(sort) + [{"_doc": "asc"}]
+    if after:
+        body["search_after"] = after
+    params = {"filter_path": "pit_id,hits.total.value,hits.hits._id,hits.hits._source,hits.hits.sort"}
+    stream = stream_parse and ijson is not None
+
+    try:
+        with _timed(call["timings"], "upstream"):
+            resp = await _send_search({"url": url, "params": params, "json": body, "headers": headers}, stream, priority)
+    except _CircuitOpenError as e:
+        call["status"] = "circuit_open"
+        return {"error": f"Failed to search for user: {e}"}
+    try:
+        call["status"] = resp.status_code
+        if resp.status_code != 200:
+            await resp.aread()
+            return {"error": f"Failed to search for user: {resp.status_code} - {resp.text}"}
+        with _timed(call["timings"], "decode"):
+            if stream:
+                total = None
+                hits = [hit async for hit in ijson.items(_AsyncReader(resp), "hits.hits.item", use_float=True)]
+            else:
+                call["bytes"] = len(resp.content)
+                payload = resp.json()
+                total = payload.get("hits", {}).get("total", {}).get("value")
+                hits = payload.get("hits", {}).get("hits", [])
+                pit = payload.get("pit_id", pit)
+    finally:
+        await resp.aclose()
+
+    next_page_token = None
+    if len(hits) == size and hits[-1].get("sort"):
+        next_page_token = _encode_page_token(hits[-1]["sort"], pit)
+    elif pit:
+        asyncio.get_running_loop().create_task(_close_pit(base_url, pit, headers))
+    people = [_compact_hit(hit) for hit in hits]
+    return {"total": total, "count": len(people), "people": people, "next_page_token": next_page_token}
+
+
+_IJSON_WARNING = {"logged": False}
+
+
+def _stream_parse_available() -> bool:
+    """Whether stream_parse can be honoured; logs once when ijson is missing."""
+    if ijson is None and not _IJSON_WARNING["logged"]:
+        _IJSON_WARNING["logged"] = True
+        logger.warning("stream_parse was requested but ijson is not installed; responses are parsed whole")
+    return ijson is not None
+
+
+async def _fetch_page(query_string: str, fields: list, size: int, page_token: str | None, headers: dict, stream_parse: bool, call: dict, use_pit: bool = False) -> dict:
+    page = _decode_page_token(page_token) if page_token else None
+    key = (PEOPLE_SEARCH_URL, "POST", query_string, tuple(fields), size, page_token, stream_parse, use_pit)
+    query = {"query_string": {"query": query_string}}
+    return await _SINGLE_FLIGHT.do(key, lambda: _search_page(query, fields, size, page, headers, stream_parse, call, use_pit=use_pit))
+
+
+async def _stream_pages(query_string: str, fields: list, size: int, page_token: str | None, max_results: int, headers: dict, stream_parse: bool, ctx: Context | None, call: dict) -> dict:
+    """
+    Page through the matches, sending each page to the client as an MCP progress notification
+    (the page's people as JSON in the message) so only one page is held in memory at a time.
+    Clients that did not ask for progress get the people collected into the result instead.
+    """
+    meta = ctx.request_context.meta if ctx is not None else None
+    progress = meta is not None and meta.progressToken is not None
+    total, count, collected = None, 0, []
+    while True:
+        # The last page is only as large as max_results leaves, so its next_page_token resumes exactly after it.
+        page_size = min(size, max_results - count)
+        result = await _fetch_page(query_string, fields, page_size, page_token, headers, stream_parse, call, use_pit=True)
+        if "error" in result:
+            return {**result, "count": count}
+        total = result["total"] if result["total"] is not None else total
+        count += result["count"]
+        if progress:
+            await ctx.report_progress(count, total, json.dumps(result["people"]))
+        else:
+            collected.extend(result["people"])
+        page_token = result["next_page_token"]
+        if page_token is None or count >= max_results:
+            break
+    summary = {"total": total, "count": count, "streamed": progress, "next_page_token": page_token}
+    if not progress:
+        summary["people"] = collected
+    return summary
+
+
+PEOPLE_INDEX_PATH = os.getenv("HUB_MCP_PEOPLE_INDEX", "")
+PEOPLE_INDEX_MAX_AGE = float(os.getenv("HUB_MCP_PEOPLE_INDEX_MAX_AGE", "3600"))
+PEOPLE_INDEX_SYNC_INTERVAL = float(os.getenv("HUB_MCP_PEOPLE_INDEX_SYNC_INTERVAL", "300"))
+PEOPLE_INDEX_FULL_SYNC_INTERVAL = float(os.getenv("HUB_MCP_PEOPLE_INDEX_FULL_SYNC_INTERVAL", "86400"))
+PEOPLE_INDEX_UPDATED_FIELD = os.getenv("HUB_MCP_PEOPLE_INDEX_UPDATED_FIELD", "updatedAt")
+PEOPLE_INDEX_COLUMNS = ("name", "email", "title", "department", "location", "skills", "description")
+PEOPLE_INDEX_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS people (id TEXT PRIMARY KEY, source TEXT NOT NULL);
+CREATE VIRTUAL TABLE IF NOT EXISTS people_fts USING fts5({", ".join(PEOPLE_INDEX_COLUMNS)});
+CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def _fts_query(query_string: str) -> str | None:
+    """
+    Translate the simple query shapes the index can answer, `field:words` and plain `words`, into
+    the FTS5 match Elasticsearch's query_string would run: the words are ORed (default_operator),
+    and a field prefix scopes only the word it is attached to, the others searching every column
+    (default_field). Only words the two analyzers split alike (letters and digits) are served;
+    anything richer (operators, quotes, wildcards, ranges, punctuation, unknown fields) returns
+    None and goes to Elasticsearch.
+    """
+    field, sep, text = query_string.partition(":")
+    column = field.strip() if sep else None
+    if column is not None and (column not in PEOPLE_INDEX_COLUMNS or text[:1].isspace()):
+        return None
+    words = (text if sep else query_string).split()
+    if not words or any(not re.fullmatch(r"[^\W_]+", word) or word in ("AND", "OR", "NOT", "TO") for word in words):
+        return None
+    terms = [f'"{word}"' for word in words]
+    if column:
+        terms[0] = f"{column} : {terms[0]}"
+    return " OR ".join(terms)
+
+
+class _PeopleIndex:
+    """
+    Local SQLite FTS5 copy of the people index. It is filled by scrolling the whole ES index and
+    kept current by incremental syncs of documents whose `PEOPLE_INDEX_UPDATED_FIELD` is newer than
+    the last one seen; a periodic full sync drops people deleted upstream. The database runs in
+    WAL mode so queries, here and in the Open WebUI hub tool, read while a sync writes.
+    """
+
+    SYNC_PAGE_SIZE = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self.stats = {"hits": 0, "misses": 0, "syncs": 0, "synced_people": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(PEOPLE_INDEX_SCHEMA)
+        return conn
+
+    def search(self, query_string: str, fields: list, size: int, offset: int) -> dict | None:
         """
-        Retrieve an access token from Azure AD using Client Credentials flow.
-        This method uses the CLIENT_ID, CLIENT_SECRET, and TENANT_ID from the pipeline's valves.
-        :return: Access token as a string.
+        Answer a search from the index, or None when it is missing, stale, unreadable (locked,
+        corrupt, mid-creation) or cannot express the query, so the caller asks Elasticsearch.
         """
-        SCOPE = "https://labassist.pnnl.gov/proxy/.default"
+        match = _fts_query(query_string)
+        if match is None or not self.path or not os.path.exists(self.path):
+            self.stats["misses"] += 1
+            return None
+        try:
+            with closing(sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)) as conn:
+                synced_at = conn.execute("SELECT value FROM sync_state WHERE key = 'synced_at'").fetchone()
+                if synced_at is None or time.time() - float(synced_at[0]) > PEOPLE_INDEX_MAX_AGE:
+                    self.stats["misses"] += 1
+                    return None
+                total = conn.execute("SELECT count(*) FROM people_fts WHERE people_fts MATCH ?", (match,)).fetchone()[0]
+                rows = conn.execute(
+                    "SELECT p.source FROM people_fts JOIN people p ON p.rowid = people_fts.rowid "
+                    "WHERE people_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+                    (match, size, offset),
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("People index %s unreadable, searching Elasticsearch: %s", self.path, e)
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        people = []
+        for (source,) in rows:
+            person = json.loads(source)
+            people.append({"id": person["id"], **{k: person[k] for k in fields if k in person}})
+        next_offset = offset + len(people)
+        next_page_token = _encode_offset_token(next_offset) if next_offset < total else None
+        return {"total": total, "count": len(people), "people": people, "next_page_token": next_page_token, "source": "local_index"}
+
+    def _write(self, people: list, state: dict, full: bool) -> None:
+        with closing(self._connect()) as conn, conn:
+            if full:
+                conn.execute("DELETE FROM people")
+                conn.execute("DELETE FROM people_fts")
+            for person in people:
+                row = conn.execute("SELECT rowid FROM people WHERE id = ?", (person["id"],)).fetchone()
+                if row is None:
+                    rowid = conn.execute("INSERT INTO people (id, source) VALUES (?, ?)", (person["id"], json.dumps(person))).lastrowid
+                else:
+                    rowid = row[0]
+                    conn.execute("UPDATE people SET source = ? WHERE rowid = ?", (json.dumps(person), rowid))
+                    conn.execute("DELETE FROM people_fts WHERE rowid = ?", (rowid,))
+                values = [" ".join(v) if isinstance(v, list) else str(v or "") for v in (person.get(c) for c in PEOPLE_INDEX_COLUMNS)]
+                conn.execute(f"INSERT INTO people_fts (rowid, {', '.join(PEOPLE_INDEX_COLUMNS)}) VALUES (?{', ?' * len(values)})", (rowid, *values))
+            conn.executemany("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", state.items())
+
+    async def sync(self) -> dict:
+        """Pull people changed since the last sync (everyone on the first and on full syncs) into the index."""
+        with closing(self._connect()) as conn:
+            state = dict(conn.execute("SELECT key, value FROM sync_state"))
+        high_water = state.get("high_water")
+        # Without an update timestamp on the documents every sync has to be a full one.
+        full = not high_water or time.time() - float(state.get("full_synced_at", 0)) > PEOPLE_INDEX_FULL_SYNC_INTERVAL
+        if full:
+            query, sort = {"match_all": {}}, ()
+        else:
+            query, sort = {"range": {PEOPLE_INDEX_UPDATED_FIELD: {"gt": high_water}}}, ({PEOPLE_INDEX_UPDATED_FIELD: "asc"},)
+        headers = {"Authorization": f"Bearer {await _get_access_token()}"}
+        started = time.time()
+        people, page = [], None
+        while True:
+            call = {"timings": {}, "status": None, "bytes": None}
+            result = await _search_page(query, None, self.SYNC_PAGE_SIZE, page, headers, False, call, sort, "batch", use_pit=True)
+            _METRICS.record_call("sync_people_index", call["timings"], call["status"], call["bytes"])
+            if "error" in result:
+                raise RuntimeError(result["error"])
+            people.extend(result["people"])
+            if result["next_page_token"] is None:
+                break
+            page = _decode_page_token(result["next_page_token"])
+        seen = [str(p[PEOPLE_INDEX_UPDATED_FIELD]) for p in people if p.get(PEOPLE_INDEX_UPDATED_FIELD) is not None]
+        state = {"synced_at": str(started), "high_water": max(seen + ([] if full else [high_water]), default="")}
+        if full:
+            state["full_synced_at"] = str(started)
+        await asyncio.to_thread(self._write, people, state, full)
+        self.stats["syncs"] += 1
+        self.stats["synced_people"] += len(people)
+        return {"full": full, "people": len(people)}
 
-       
+
+_PEOPLE_INDEX = _PeopleIndex(PEOPLE_INDEX_PATH)
+_INDEX_SYNC_TASKS = {}
+
+
+def _encode_offset_token(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode()
+
+
+async def _sync_people_index_forever() -> None:
+    while True:
         try:
-            credential = ClientSecretCredential(tenant_id=TENANT_ID, client_id=CLIENT_ID, client_secret=CLIENT_SECRET)
-            token = credential.get_token(SCOPE).token
-        except Exception as e:
-           
-            raise Exception(f"Failed to create ClientSecretCredential: {str(e)}")
-        return token
+            await _PEOPLE_INDEX.sync()
+        except Exception as e:  # keep serving from the last good copy (or upstream) and retry
+            logger.warning("People index sync failed: %s", e)
+        await asyncio.sleep(PEOPLE_INDEX_SYNC_INTERVAL)
+
+
+def _ensure_index_sync() -> None:
+    """Start the background index sync on the serving event loop the first time a tool runs."""
+    loop = asyncio.get_running_loop()
+    if PEOPLE_INDEX_PATH and loop not in _INDEX_SYNC_TASKS:
+        _INDEX_SYNC_TASKS[loop] = loop.create_task(_sync_people_index_forever())
 
 
 # Add a search user tool
 @mcp.tool()
-def search_user(query_string, TENANT_ID, CLIENT_ID, CLIENT_SECRET) -> dict:
+async def search_user(
+    query_string: str,
+    fields: list[str] | None = None,
+    size: int = 10,
+    stream_parse: bool = False,
+    page_token: str | None = None,
+    stream_pages: bool = False,
+    max_results: int = 1000,
+    ctx: Context | None = None,
+) -> dict:
     """Search for a user by query string. Use ElasticSearch query syntax.
     Some things you can search for:
     - skills
@@ -43,12 +929,58 @@ def search_user(query_string, TENANT_ID, CLIENT_ID, CLIENT_SECRET) -> dict:
     - department
     - description
     Example query: "skills:Nuclear Reactors"
+
+    fields: the profile fields to return for each person (default: name, email, title, department, location, skills).
+    size: the number of people per page (default 10).
+    stream_parse: parse large responses incrementally instead of loading them whole (needs ijson on the
+    server; without it the result carries "stream_parse": "unavailable" and the body is parsed whole).
+    page_token: the next_page_token of a previous call with the same query, to fetch the following page.
+    stream_pages: keep paging and send each page as a progress notification, up to max_results people.
+    Returns {"total": matches, "count": returned, "people": [{"id": ..., <fields>}], "next_page_token": token or null}.
     """
-    token = _get_access_token(TENANT_ID, CLIENT_ID, CLIENT_SECRET)
+    call = {"timings": {}, "status": "coalesced", "bytes": None}
+    started = time.perf_counter()
+    _ensure_index_sync()
+    fields = list(fields or DEFAULT_PEOPLE_FIELDS)
+    page = _decode_page_token(page_token) if page_token else {}
+    if page is None:
+        return {"error": "Invalid page_token; pass the next_page_token of a previous search unchanged."}
+    if stream_pages and "offset" in page:
+        return {"error": "This page_token pages the local people index and cannot be streamed; repeat the search without page_token."}
+    if size < 1 or (stream_pages and max_results < 1):
+        return {"error": "size and max_results must be at least 1."}
+    if not stream_pages and (not page or "offset" in page):
+        with _timed(call["timings"], "local_index"):
+            result = await asyncio.to_thread(_PEOPLE_INDEX.search, query_string, fields, size, page.get("offset", 0))
+        if result is None and "offset" in page:
+            return {"error": "The local people index went stale or unreadable while paging; repeat the search without page_token."}
+        if result is not None:
+            call["timings"]["total"] = time.perf_counter() - started
+            _METRICS.record_call("search_user", call["timings"], "local_index")
+            return result
+    with _timed(call["timings"], "token"):
+        token = await _get_access_token()
     headers = {"Authorization": f"Bearer {token}"}
-    params = {"q": query_string}
-    resp = requests.get("https://labassist.pnnl.gov/proxy/actman/elasticsearch/hub-suggestions-people/_search", params=params, headers=headers, timeout=10)
-    if resp.status_code == 200:
-        return resp.json()
+    unavailable = stream_parse and not _stream_parse_available()
+    try:
+        if stream_pages:
+            result = await _stream_pages(query_string, fields, size, page_token, max_results, headers, stream_parse, ctx, call)
+        else:
+            result = await _fetch_page(query_string, fields, size, page_token, headers, stream_parse, call)
+        return {**result, "stream_parse": "unavailable"} if unavailable else result
+    except Exception:
+        call["status"] = "exception"
+        raise
+    finally:
+        call["timings"]["total"] = time.perf_counter() - started
+        _METRICS.record_call("search_user", call["timings"], call["status"], call["bytes"])
+        _METRICS.write(METRICS_FILE, 15.0)
+
+
+if __name__ == "__main__":
+    if not (TENANT_ID and CLIENT_ID and CLIENT_SECRET):
+        raise SystemExit("TENANT_ID, CLIENT_ID and CLIENT_SECRET must be set in the environment or .env")
+    if "--sync-index" in sys.argv[1:]:  # one-off sync, e.g. from cron for hub tools reading the same file
+        print(asyncio.run(_PEOPLE_INDEX.sync()))
     else:
-        return {"error": f"Failed to search for user: {resp.status_code} - {resp.text}"}
\ No newline at end of file
+        mcp.run(transport=os.getenv("HUB_MCP_TRANSPORT", "streamable-http"))
@@ -5,22 +5,172 @@ date: 2025-07-01
 version: 1.1
 license: MIT
 description: A tool pipeline for searching internal users based on a query string.
-requirements: requests, msal, pydantic, open-webui
+requirements: requests, msal, msal-extensions, pydantic, open-webui
 """
 
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import requests
 from pydantic import Field
-import requests
-from open_webui.models.users import Users
-from msal import ConfidentialClientApplication
 from blueprints.function_calling_blueprint import Pipeline as FunctionCallingBlueprint
 
+ConfidentialClientApplication = None  # imported from msal by the first _msal_app call
+
+
+class _Metrics:
+    """
+    In-process call metrics rendered in the Prometheus text exposition format: latency
+    histograms per phase, call counters per status and response size histograms.
+    Recording is a handful of dict updates, cheap enough to leave on in production.
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+    def __init__(self, tool: str):
+        self._tool = tool
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._written_at = 0.0
+        self._write_failed = False
+
+    def _observe(self, name: str, labels: tuple, value: float, buckets: tuple) -> None:
+        with self._lock:
+            series = self._histograms.get((name, labels))
+            if series is None:
+                series = self._histograms[(name, labels)] = [buckets, [0] * len(buckets), 0.0, 0]
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                series[1][index] += 1
+            series[2] += value
+            series[3] += 1
+
+    def record_call(self, method: str, timings: dict, status, response_bytes=None) -> None:
+        labels = (("tool", self._tool), ("method", method))
+        for phase, seconds in timings.items():
+            self._observe("enterprise_tool_phase_seconds", labels + (("phase", phase),), seconds, self.LATENCY_BUCKETS)
+        if response_bytes is not None:
+            self._observe("enterprise_tool_response_bytes", labels, response_bytes, self.SIZE_BUCKETS)
+        key = ("enterprise_tool_calls_total", labels + (("status", str(status)),))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def render(self) -> str:
+        with self._lock:
+            histograms = {key: (series[0], list(series[1]), series[2], series[3]) for key, series in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = []
+        typed = set()
+        for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{name}_sum{{{label_text}}} {total}")
+            lines.append(f"{name}_count{{{label_text}}} {count}")
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, interval: float) -> None:
+        """Atomically rewrite `path` (e.g. a node_exporter textfile) at most every `interval` seconds."""
+        now = time.monotonic()
+        if not path or now - self._written_at < interval:
+            return
+        self._written_at = now
+        try:
+            with open(f"{path}.tmp", "w") as f:
+                f.write(self.render())
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:  # an export must never fail a call
+            if not self._write_failed:
+                self._write_failed = True
+                logging.getLogger(__name__).warning("Cannot write metrics to %s: %s", path, e)
+
+
+_METRICS = _Metrics("hub_pipeline")
+
+
+def metrics_text() -> str:
+    """Return the pipeline's call metrics in the Prometheus text exposition format."""
+    return _METRICS.render()
+
+
+_MSAL_APPS = {}
+_MSAL_APPS_LOCK = threading.Lock()
+
+
+def _msal_app(tenant_id: str, client_id: str, client_secret: str, cache_path: str = ""):
+    """
+    Return the process-wide ConfidentialClientApplication for these credentials. MSAL serves tokens
+    from the app's cache until they near expiry, so only the first call per process does authority
+    discovery and a token request. With `cache_path` the cache is a file shared by every worker on
+    the host (msal-extensions reloads it before lookups and rewrites it under a file lock), so
+    restarts and scale-outs reuse valid tokens too. msal and msal-extensions are imported here, on
+    first use, to keep pipeline reloads fast.
+    """
+    global ConfidentialClientApplication
+    key = (tenant_id, client_id, hashlib.sha256(client_secret.encode()).hexdigest(), cache_path)
+    with _MSAL_APPS_LOCK:
+        app = _MSAL_APPS.get(key)
+        if app is None:
+            if ConfidentialClientApplication is None:
+                from msal import ConfidentialClientApplication
+            cache = None
+            if cache_path:
+                try:
+                    from msal_extensions import FilePersistence, PersistedTokenCache
+                except ImportError:  # without msal-extensions tokens are only cached per process
+                    PersistedTokenCache = None
+            if cache_path and PersistedTokenCache is not None:
+                path = os.path.expanduser(cache_path)
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))  # the file holds bearer tokens
+                cache = PersistedTokenCache(FilePersistence(path))
+            app = _MSAL_APPS[key] = ConfidentialClientApplication(
+                client_id=client_id,
+                client_credential=client_secret,
+                authority=f"https://login.microsoftonline.com/{tenant_id}/",
+                token_cache=cache,
+            )
+        return app
+
+
+@contextmanager
+def _timed(timings: dict, phase: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - started
+
 
 class Pipeline(FunctionCallingBlueprint):
     class Valves(FunctionCallingBlueprint.Valves):
         CLIENT_ID: str = Field(default="", description="client ID for service account")
         CLIENT_SECRET: str = Field(default="", description="client secret for service account")
         TENANT_ID: str = Field(default="", description="tenant ID for service account")
+        TOKEN_CACHE_PATH: str = Field(default="", description="MSAL token cache file shared by the pipeline worker processes (needs msal-extensions); empty keeps tokens per process")
+        WARMUP_ON_LOAD: bool = Field(default=True, description="fetch the token in the background when the pipeline starts or its valves change")
+        METRICS_FILE: str = Field(default="", description="path of a Prometheus textfile the call metrics are exported to; empty disables the export")
+        METRICS_FILE_INTERVAL: float = Field(default=15.0, description="minimum seconds between rewrites of METRICS_FILE")
 
     _ENDPOINT = "https://apimdevgw.pnnl.gov/proof-of-concept-hub-mcp/v1/hub"
 
@@ -31,12 +181,13 @@ class Pipeline(FunctionCallingBlueprint):
         def _get_access_token(self) -> str:
             """
             Retrieve an access token from Azure AD using Client Credentials flow.
-            This method uses the CLIENT_ID, CLIENT_SECRET, and TENANT_ID from the pipeline's valves.
+            This method uses the CLIENT_ID, CLIENT_SECRET, and TENANT_ID from the pipeline's valves;
+            tokens come from the shared application's cache while they are valid.
             :return: Access token as a string.
             """
             SCOPE = ["https://labassist.pnnl.gov/proxy/.default"]
-            TOKEN_URL = f"https://login.microsoftonline.com/{self.pipeline.valves.TENANT_ID}/"
-            app = ConfidentialClientApplication(client_id=self.pipeline.valves.CLIENT_ID, client_credential=self.pipeline.valves.CLIENT_SECRET, authority=TOKEN_URL)
+            valves = self.pipeline.valves
+            app = _msal_app(valves.TENANT_ID, valves.CLIENT_ID, valves.CLIENT_SECRET, valves.TOKEN_CACHE_PATH)
             response = app.acquire_token_for_client(scopes=SCOPE)
             if 'error' in response:
                 raise Exception(f"Error acquiring token: {response['error_description']}")
@@ -51,13 +202,20 @@ class Pipeline(FunctionCallingBlueprint):
             :param query: The search query string.
             :return: A dictionary containing the search results or an error message.
             """
-            token = self._get_access_token()
+            timings = {}
+            status, size = "exception", None
+            started = time.perf_counter()
+            with _timed(timings, "token"):
+                token = self._get_access_token()
             headers = {"Authorization": f"Bearer {token}"}
             params = {"q": query}
             try:
-                resp = requests.get(self._ENDPOINT, params=params, headers=headers, timeout=10)
+                with _timed(timings, "upstream"):
+                    resp = requests.get(self.pipeline._ENDPOINT, params=params, headers=headers, timeout=10)
+                status, size = resp.status_code, len(resp.content)
                 if resp.status_code == 200:
-                    return resp.json()
+                    with _timed(timings, "decode"):
+                        return resp.json()
                 else:
                     return {
                         "error": f"API request failed: Status {resp.status_code}",
@@ -65,6 +223,10 @@ class Pipeline(FunctionCallingBlueprint):
                     }
             except Exception as e:
                 return {"error": "API call exception", "details": str(e)}
+            finally:
+                timings["total"] = time.perf_counter() - started
+                _METRICS.record_call("search_internal_users", timings, status, size)
+                _METRICS.write(self.pipeline.valves.METRICS_FILE, self.pipeline.valves.METRICS_FILE_INTERVAL)
 
     def __init__(self):
         super().__init__()
@@ -75,4 +237,24 @@ class Pipeline(FunctionCallingBlueprint):
                 "pipelines": ["*"],  # Connect to all pipelines
             },
         )
-        self.tools = self.Tools(self)
\ No newline at end of file
+        self.tools = self.Tools(self)
+        self._warm_up_task = None
+
+    async def on_startup(self):
+        await super().on_startup()
+        self._start_warm_up()
+
+    async def on_valves_updated(self):
+        self._start_warm_up()
+
+    def _start_warm_up(self) -> None:
+        """Mint the token off the event loop so the first call after a start or a credential change finds it cached."""
+        valves = self.valves
+        if valves.WARMUP_ON_LOAD and valves.TENANT_ID and valves.CLIENT_ID and valves.CLIENT_SECRET:
+            self._warm_up_task = asyncio.get_running_loop().create_task(self._warm_up())
+
+    async def _warm_up(self) -> None:
+        try:
+            await asyncio.to_thread(self.tools._get_access_token)
+        except Exception:
+            pass  # the first call reports the error
\ No newline at end of file
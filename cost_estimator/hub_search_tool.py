@@ -5,13 +5,1264 @@ date: 2025-07-01
 version: 1.1
 license: MIT
 description: A tool pipeline for searching internal users on based on a query string using the hub elastic search index.
-requirements: requests, pydantic, open-webui, azure-identity
+requirements: httpx, pydantic, open-webui, azure-identity
 """
 
-import requests
+import asyncio
+import bisect
+import logging
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import json
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, closing, contextmanager
+from email.utils import parsedate_to_datetime
+from types import ModuleType
+from typing import Literal
+
+import httpx
 from pydantic import Field, BaseModel
-from open_webui.models.users import Users
-from azure.identity import ClientSecretCredential
+
+ClientSecretCredential = (
+    None  # imported from azure.identity on first use, see _credential_class
+)
+
+
+def _credential_class():
+    """
+    Import azure-identity on the first token fetch instead of at load: it pulls in msal and
+    cryptography, the bulk of the tool's import time, and Open WebUI re-imports tools often.
+    """
+    global ClientSecretCredential
+    if ClientSecretCredential is None:
+        from azure.identity import ClientSecretCredential
+    return ClientSecretCredential
+
+
+class _TokenBroker:
+    """
+    Process-wide cache of Entra ID access tokens keyed by (tenant, client, scope).
+    Tokens are served from memory until shortly before `expires_on` and are refreshed in the
+    background once they enter the refresh window. Concurrent callers share one in-flight fetch.
+    """
+
+    REFRESH_MARGIN = 300  # seconds before expiry at which a background refresh starts
+    EXPIRY_MARGIN = (
+        60  # seconds before expiry at which a cached token is no longer served
+    )
+
+    def __init__(self):
+        self._tokens = {}
+        self._credentials = {}
+        self._inflight = {}
+        self.stats = {"hits": 0, "misses": 0, "refreshes": 0, "fetches": 0}
+
+    async def get_token(
+        self, tenant_id: str, client_id: str, client_secret: str, scope: str
+    ) -> str:
+        key = (tenant_id, client_id, scope)
+        now = time.time()
+        cached = self._tokens.get(key)
+        if cached is not None and cached.expires_on - self.EXPIRY_MARGIN > now:
+            self.stats["hits"] += 1
+            if cached.expires_on - self.REFRESH_MARGIN <= now and not self._pending(
+                key
+            ):
+                self.stats["refreshes"] += 1
+                self._start_fetch(key, client_secret)
+            return cached.token
+
+        self.stats["misses"] += 1
+        task = self._pending(key) or self._start_fetch(key, client_secret)
+        return (await asyncio.shield(task)).token
+
+    def _pending(self, key):
+        task = self._inflight.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            return task
+        return None
+
+    def _start_fetch(self, key, client_secret: str) -> asyncio.Task:
+        tenant_id, client_id, scope = key
+        credential = self._credentials.get((tenant_id, client_id, client_secret))
+        if credential is None:
+            credential = _credential_class()(
+                tenant_id=tenant_id, client_id=client_id, client_secret=client_secret
+            )
+            self._credentials[(tenant_id, client_id, client_secret)] = credential
+        # azure-identity's ClientSecretCredential is synchronous, keep it off the event loop.
+        task = asyncio.get_running_loop().create_task(
+            asyncio.to_thread(credential.get_token, scope)
+        )
+        self._inflight[key] = task
+        self.stats["fetches"] += 1
+        task.add_done_callback(lambda done: self._finish_fetch(key, done))
+        return task
+
+    def _finish_fetch(self, key, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            self._tokens[key] = task.result()
+
+
+_TOKEN_BROKER = _TokenBroker()
+
+
+def token_cache_stats() -> dict:
+    """Return the hit, miss, background refresh and upstream fetch counters of the token cache."""
+    return dict(_TOKEN_BROKER.stats)
+
+
+_HTTP_CLIENTS = {}
+
+
+def _get_http_client(url: str, valves) -> httpx.AsyncClient:
+    """
+    Return the pooled keep-alive client for the host of `url`, creating it on first use.
+    A new client is built when the pool/timeout valves change or the event loop is replaced.
+    """
+    config = (
+        valves.HTTP_MAX_CONNECTIONS,
+        valves.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        valves.HTTP_TIMEOUT,
+        valves.HTTP_CONNECT_TIMEOUT,
+    )
+    loop = asyncio.get_running_loop()
+    host = httpx.URL(url).host
+    entry = _HTTP_CLIENTS.get(host)
+    if entry is not None and entry[1] is loop and entry[2] == config:
+        return entry[0]
+    # A replaced client is left to the garbage collector so in-flight requests can finish.
+    client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=config[0], max_keepalive_connections=config[1]
+        ),
+        timeout=httpx.Timeout(config[2], connect=config[3]),
+    )
+    _HTTP_CLIENTS[host] = (client, loop, config)
+    return client
+
+
+_WARM_UPS = {}
+_WARM_UP_STATS = {"runs": 0, "failures": 0, "seconds": 0.0}
+
+
+def _warm_up(valves, scopes: tuple, urls: tuple) -> None:
+    """
+    Fetch the tokens for `scopes` and open WARMUP_CONNECTIONS pooled connections to each host of
+    `urls` in the background, so the first call after a load or a credential change does not pay
+    for token minting, DNS and TLS. Runs once per credentials, endpoints, pool valves and event
+    loop; without credentials or a running loop it does nothing and the first call warms up.
+    """
+    if not (
+        valves.WARMUP_ON_LOAD
+        and valves.TENANT_ID
+        and valves.CLIENT_ID
+        and valves.CLIENT_SECRET
+    ):
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    hosts = {httpx.URL(url).host: url for url in urls if url.startswith("http")}
+    key = (
+        valves.TENANT_ID,
+        valves.CLIENT_ID,
+        valves.CLIENT_SECRET,
+        scopes,
+        tuple(hosts),
+        valves.WARMUP_CONNECTIONS,
+        valves.HTTP_MAX_CONNECTIONS,
+        valves.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        valves.HTTP_TIMEOUT,
+        valves.HTTP_CONNECT_TIMEOUT,
+    )
+    task = _WARM_UPS.get(key)
+    if task is not None and task.get_loop() is loop:
+        return
+    _WARM_UPS[key] = loop.create_task(
+        _run_warm_up(valves.model_copy(), scopes, tuple(hosts.values()))
+    )
+
+
+async def _run_warm_up(valves, scopes: tuple, urls: tuple) -> None:
+    started = time.perf_counter()
+    tokens = [
+        _TOKEN_BROKER.get_token(
+            valves.TENANT_ID, valves.CLIENT_ID, valves.CLIENT_SECRET, scope
+        )
+        for scope in scopes
+    ]
+    # Unauthenticated HEADs are answered by the gateway itself; the connections they open stay
+    # in the pool for the keep-alive expiry. Concurrent requests each open their own connection.
+    connections = [
+        _get_http_client(url, valves).head(url, timeout=valves.HTTP_CONNECT_TIMEOUT)
+        for url in urls
+        for _ in range(valves.WARMUP_CONNECTIONS)
+    ]
+    results = await asyncio.gather(*tokens, *connections, return_exceptions=True)
+    _WARM_UP_STATS["runs"] += 1
+    _WARM_UP_STATS["failures"] += sum(isinstance(r, Exception) for r in results)
+    _WARM_UP_STATS["seconds"] = time.perf_counter() - started
+
+
+def warm_up_stats() -> dict:
+    """Return how many warm-ups ran, their failed token fetches or connections and the last one's duration."""
+    return dict(_WARM_UP_STATS)
+
+
+class _SingleFlight:
+    """
+    Coalesces identical in-flight upstream requests. The first caller performs the request and
+    concurrent duplicates await the same result instead of going upstream themselves.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, fetch):
+        loop = asyncio.get_running_loop()
+        task = self._inflight.get(key)
+        if task is None or task.get_loop() is not loop:
+            task = loop.create_task(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # Shielded so a cancelled caller does not cancel the request for everyone else.
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+
+_SINGLE_FLIGHT = _SingleFlight()
+
+
+_TRACE_PHASES = {"connection.connect_tcp": "connect", "connection.start_tls": "tls"}
+
+
+def _trace_phases(timings: dict):
+    """httpx trace hook adding DNS+TCP connect and TLS handshake time to `timings`."""
+    started = {}
+
+    async def trace(event_name: str, info: dict) -> None:
+        step, _, stage = event_name.rpartition(".")
+        if step not in _TRACE_PHASES:
+            return
+        if stage == "started":
+            started[step] = time.perf_counter()
+        elif step in started:
+            phase = _TRACE_PHASES[step]
+            elapsed = time.perf_counter() - started.pop(step)
+            timings[phase] = timings.get(phase, 0.0) + elapsed
+
+    return trace
+
+
+class _CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class _Upstream:
+    """
+    Resilience state of one upstream host. A window of recent latencies sets the adaptive
+    timeout and the hedging delay; a circuit breaker fails calls fast after repeated
+    failures and lets a single probe through once CIRCUIT_RESET_TIMEOUT has passed.
+    """
+
+    WINDOW = 200  # latencies kept for the percentiles
+    MIN_SAMPLES = 20  # below this the valve timeouts apply and nothing is hedged
+
+    def __init__(self, host: str):
+        self.host = host
+        self.latencies = deque(maxlen=self.WINDOW)
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.stats = {"short_circuited": 0, "opened": 0, "hedged": 0, "hedge_wins": 0}
+
+    def percentile(self, q: float) -> float | None:
+        if len(self.latencies) < self.MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def timeout(self, valves) -> float:
+        """Read timeout: a multiple of the observed p99, within [floor, HTTP_TIMEOUT]."""
+        p99 = self.percentile(0.99)
+        if (
+            p99 is None
+            or self.state != "closed"
+            or not valves.ADAPTIVE_TIMEOUT_MULTIPLIER
+        ):
+            return valves.HTTP_TIMEOUT
+        adaptive = max(
+            valves.ADAPTIVE_TIMEOUT_FLOOR, p99 * valves.ADAPTIVE_TIMEOUT_MULTIPLIER
+        )
+        return min(valves.HTTP_TIMEOUT, adaptive)
+
+    def admit(self, valves) -> None:
+        if self.state == "closed" or not valves.CIRCUIT_FAILURE_THRESHOLD:
+            return
+        if time.monotonic() - self.opened_at >= valves.CIRCUIT_RESET_TIMEOUT:
+            # This caller is the half-open probe; the rest keep failing fast until it returns.
+            self.state = "half_open"
+            self.opened_at = time.monotonic()
+            return
+        self.stats["short_circuited"] += 1
+        raise _CircuitOpenError(
+            f"{self.host} is unavailable after {self.failures} consecutive failures; "
+            f"retrying in {valves.CIRCUIT_RESET_TIMEOUT - (time.monotonic() - self.opened_at):.0f}s"
+        )
+
+    def record(self, ok: bool, latency: float | None, valves) -> None:
+        if (
+            latency is not None
+        ):  # timeouts count too, so a slower upstream widens its timeout
+            self.latencies.append(latency)
+        if ok:
+            self.failures = 0
+            self.state = "closed"
+            return
+        self.failures += 1
+        threshold = valves.CIRCUIT_FAILURE_THRESHOLD
+        if self.state == "half_open" or (threshold and self.failures >= threshold):
+            if self.state != "open":
+                self.stats["opened"] += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+_UPSTREAMS = {}
+
+
+def upstream_stats() -> dict:
+    """Return circuit state, failure count, latency percentiles and counters per upstream host."""
+    return {
+        host: {
+            "state": upstream.state,
+            "failures": upstream.failures,
+            "p50": upstream.percentile(0.5),
+            "p95": upstream.percentile(0.95),
+            **upstream.stats,
+        }
+        for host, upstream in _UPSTREAMS.items()
+    }
+
+
+async def _hedged(send, delay: float, upstream: _Upstream) -> httpx.Response:
+    """
+    Await `send()`; if it has not answered within `delay`, send it again and return whichever
+    answers first. Only for idempotent requests.
+    """
+    first = asyncio.ensure_future(send())
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+    upstream.stats["hedged"] += 1
+    second = asyncio.ensure_future(send())
+    pending = {first, second}
+    try:
+        while True:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in sorted(done, key=lambda task: task.exception() is not None):
+                if task.exception() is None or not pending:
+                    upstream.stats["hedge_wins"] += task is second
+                    return task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class _TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second up to `burst`. Callers reserve a token
+    and wait until it is due, so waiters are served in arrival order. Thread-safe and not
+    tied to an event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = None
+        self._updated = time.monotonic()
+
+    def reserve(self, rate: float, burst: int) -> float:
+        """Take one token and return the seconds to wait before it may be used."""
+        with self._lock:
+            now = time.monotonic()
+            if self._tokens is None:
+                self._tokens = float(burst)
+            self._tokens = min(burst, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / rate
+
+
+class _GatewayLimiter:
+    """
+    Client-side throttle for one API gateway, with separate interactive and batch budgets.
+    A 429 with Retry-After holds back every caller of the gateway until it has passed.
+    """
+
+    def __init__(self):
+        self.buckets = {"interactive": _TokenBucket(), "batch": _TokenBucket()}
+        self.blocked_until = 0.0
+        self.stats = {"throttled": 0, "throttled_seconds": 0.0, "retries": 0}
+
+    async def acquire(self, priority: str, rate: float, burst: int) -> float:
+        """Wait for a token of the `priority` budget (unlimited when `rate` is 0); return the wait."""
+        wait = self.blocked_until - time.monotonic()
+        if rate > 0:
+            wait = max(wait, self.buckets[priority].reserve(rate, burst))
+        if wait <= 0:
+            return 0.0
+        self.stats["throttled"] += 1
+        self.stats["throttled_seconds"] += wait
+        await asyncio.sleep(wait)
+        return wait
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+# Open WebUI loads every tool file as its own module, so the limiters live in a registry module
+# that all tools share: the hub, cost and PRF tools draw on one budget per gateway host.
+_GATEWAY_LIMITERS = sys.modules.setdefault(
+    "enterprise_connections_gateways", ModuleType("enterprise_connections_gateways")
+).__dict__.setdefault("limiters", {})
+
+
+def _gateway_limiter(host: str) -> "_GatewayLimiter":
+    return _GATEWAY_LIMITERS.get(host) or _GATEWAY_LIMITERS.setdefault(
+        host, _GatewayLimiter()
+    )
+
+
+def gateway_limiter_stats() -> dict:
+    """Return throttling and retry counters per gateway host, shared by all tools."""
+    return {host: dict(limiter.stats) for host, limiter in _GATEWAY_LIMITERS.items()}
+
+
+class _AdmissionRejected(Exception):
+    """Raised when an upstream's wait queue is full or a call cannot get a slot in time."""
+
+
+class _AdmissionController:
+    """
+    Caps the calls in flight to one upstream host across all tools. Calls over the cap wait in
+    a bounded queue where interactive calls are admitted before batch ones, each in arrival
+    order. A call is turned away at once when the queue is full or its expected wait (the calls
+    queued ahead of it x the mean slot hold time / the cap) exceeds its deadline, and when the
+    deadline passes while it waits. Thread-safe; waiters may belong to any event loop.
+    """
+
+    PRIORITIES = ("interactive", "batch")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.queues = {priority: deque() for priority in self.PRIORITIES}
+        self.hold_time = 0.0  # moving average of the seconds a slot is held
+        self.stats = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected_queue_full": 0,
+            "rejected_deadline": 0,
+            "shed": 0,
+            "wait_seconds": 0.0,
+            "max_queue_depth": 0,
+        }
+
+    def depths(self) -> dict:
+        return {priority: len(queue) for priority, queue in self.queues.items()}
+
+    async def acquire(
+        self, priority: str, limit: int, queue_size: int, deadline: float
+    ):
+        """Wait for a slot; return the seconds spent queued, or why the call was rejected."""
+        with self._lock:
+            depth = sum(len(queue) for queue in self.queues.values())
+            if self.in_flight < limit and not depth:
+                self.in_flight += 1
+                self.stats["admitted"] += 1
+                return 0.0
+            if depth >= queue_size:
+                if priority != "interactive" or not self.queues["batch"]:
+                    self.stats["rejected_queue_full"] += 1
+                    return f"{depth} calls are already waiting"
+                # Shed the newest batch waiter to make room for the interactive call.
+                self._decide(self.queues["batch"].pop(), False)
+                self.stats["shed"] += 1
+                depth -= 1
+            rank = self.PRIORITIES.index(priority)
+            ahead = sum(len(self.queues[p]) for p in self.PRIORITIES[: rank + 1])
+            expected = (ahead + 1) * self.hold_time / max(1, limit)
+            if expected > deadline:
+                self.stats["rejected_deadline"] += 1
+                return f"expected wait {expected:.1f}s exceeds the {deadline:.1f}s deadline"
+            waiter = [
+                asyncio.get_running_loop().create_future(),
+                None,
+            ]  # [wake-up, admitted?]
+            self.queues[priority].append(waiter)
+            self.stats["queued"] += 1
+            self.stats["max_queue_depth"] = max(
+                self.stats["max_queue_depth"], depth + 1
+            )
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[0]), deadline)
+        except asyncio.TimeoutError:
+            if self._withdraw(priority, waiter):
+                self.stats["rejected_deadline"] += 1
+                return f"no slot within the {deadline:.1f}s deadline"
+            # Decided just as the deadline passed; honor the decision.
+        except asyncio.CancelledError:
+            if not self._withdraw(priority, waiter) and waiter[1]:
+                self.release(None)
+            raise
+        if not waiter[1]:
+            return "shed from the queue to make room for interactive calls"
+        waited = time.monotonic() - started
+        self.stats["wait_seconds"] += waited
+        self.stats["admitted"] += 1
+        return waited
+
+    def _withdraw(self, priority: str, waiter: list) -> bool:
+        """Take an undecided waiter out of the queue; False when it was already admitted or shed."""
+        with self._lock:
+            if waiter[1] is not None:
+                return False
+            self.queues[priority].remove(waiter)
+            return True
+
+    def _decide(self, waiter: list, admitted: bool) -> bool:
+        """Record a queued waiter's fate and wake it; False when its event loop is gone."""
+        waiter[1] = admitted
+        try:
+            waiter[0].get_loop().call_soon_threadsafe(self._wake, waiter[0])
+        except RuntimeError:  # the waiter's event loop has been closed
+            return False
+        return True
+
+    def release(self, held: float | None) -> None:
+        """Free a slot held `held` seconds, handing it to the first interactive, else batch, waiter."""
+        with self._lock:
+            if held is not None:
+                self.hold_time = (
+                    held if not self.hold_time else 0.8 * self.hold_time + 0.2 * held
+                )
+            for queue in self.queues.values():
+                while queue:
+                    if self._decide(queue.popleft(), True):
+                        return
+            self.in_flight -= 1
+
+    @staticmethod
+    def _wake(future) -> None:
+        if not future.done():
+            future.set_result(None)
+
+
+# Shared through the same registry module as the gateway limiters, so the cap is per host
+# across the hub, cost and PRF tools.
+_ADMISSION_CONTROLLERS = sys.modules.setdefault(
+    "enterprise_connections_gateways", ModuleType("enterprise_connections_gateways")
+).__dict__.setdefault("admission", {})
+
+
+@asynccontextmanager
+async def _admitted(host: str, priority: str, valves, timings=None):
+    """
+    Hold one of the host's UPSTREAM_MAX_CONCURRENCY slots (no cap when 0) for the block and add
+    the time spent queued to `timings` as "queue"; raise _AdmissionRejected when turned away.
+    """
+    limit = valves.UPSTREAM_MAX_CONCURRENCY
+    if limit <= 0:
+        yield
+        return
+    controller = _ADMISSION_CONTROLLERS.get(host) or _ADMISSION_CONTROLLERS.setdefault(
+        host, _AdmissionController()
+    )
+    deadline = (
+        valves.UPSTREAM_MAX_WAIT
+        if priority == "interactive"
+        else valves.UPSTREAM_BATCH_MAX_WAIT
+    )
+    waited = await controller.acquire(
+        priority, limit, valves.UPSTREAM_QUEUE_SIZE, deadline
+    )
+    if isinstance(waited, str):
+        raise _AdmissionRejected(f"{host} is at capacity: {waited}")
+    if waited and timings is not None:
+        timings["queue"] = timings.get("queue", 0.0) + waited
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        controller.release(time.monotonic() - started)
+
+
+def admission_stats() -> dict:
+    """Return calls in flight, queue depths and admission counters per upstream host, shared by all tools."""
+    return {
+        host: {
+            "in_flight": controller.in_flight,
+            "queue_depth": controller.depths(),
+            **controller.stats,
+        }
+        for host, controller in _ADMISSION_CONTROLLERS.items()
+    }
+
+
+class _CassetteRecorder:
+    """
+    Appends upstream exchanges as JSON lines to `{tool}-{pid}.jsonl` under RECORD_CASSETTE_DIR,
+    for benchmarks/replay_cassettes.py. Entries are sanitized: request headers, and with them
+    the bearer token, are never written, and only a few response headers are kept.
+    """
+
+    KEPT_HEADERS = ("content-type", "retry-after", "etag", "last-modified")
+
+    def __init__(self, tool: str):
+        self._tool = tool
+        self._lock = threading.Lock()
+
+    def write(
+        self,
+        directory: str,
+        method: str,
+        url: str,
+        params: dict,
+        priority: str,
+        retry: int,
+        resp: httpx.Response,
+        latency: float,
+    ) -> None:
+        entry = {
+            "ts": time.time(),
+            "tool": self._tool,
+            "method": method,
+            "url": url,
+            "params": {k: str(v) for k, v in params.items()},
+            "priority": priority,
+            "retry": retry,
+            "status": resp.status_code,
+            "latency": round(latency, 4),
+            "headers": {
+                k: resp.headers[k] for k in self.KEPT_HEADERS if k in resp.headers
+            },
+            "body": resp.text,
+        }
+        line = json.dumps(entry) + "\n"
+        try:
+            with self._lock:
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, f"{self._tool}-{os.getpid()}.jsonl")
+                with open(path, "a") as f:
+                    f.write(line)
+        except OSError:
+            pass  # recording must never fail a call
+
+
+_CASSETTE = _CassetteRecorder("hub")
+
+
+def _retry_after(resp: httpx.Response) -> float | None:
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP-date), if any."""
+    value = resp.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+async def _send(
+    method: str,
+    url: str,
+    params: dict,
+    headers: dict,
+    valves,
+    timings=None,
+    priority: str = "interactive",
+) -> httpx.Response:
+    """
+    Send a GET (params in the query string) or POST (params form-encoded) over the pooled
+    client for the host of `url`, coalescing it with any identical request already in flight.
+    The host's `_Upstream` sets the timeout, may open its circuit and, with HEDGE_GETS, hedges
+    a GET once it is slower than the host's p95. Connect and TLS handshake time is added to
+    `timings` when given.
+    Each attempt first waits for the gateway's `priority` budget; a 429 or 503 is retried
+    with jittered exponential backoff, or after its Retry-After.
+    """
+    key = (
+        url,
+        method,
+        tuple(sorted((k, str(v)) for k, v in params.items())),
+        # A conditional request may be answered 304; only share it with identical ones.
+        headers.get("If-None-Match"),
+        headers.get("If-Modified-Since"),
+    )
+    client = _get_http_client(url, valves)
+    host = httpx.URL(url).host
+    upstream = _UPSTREAMS.get(host) or _UPSTREAMS.setdefault(host, _Upstream(host))
+    limiter = _gateway_limiter(host)
+    extensions = {"trace": _trace_phases(timings)} if timings is not None else {}
+
+    async def send_once(retry: int = 0) -> httpx.Response:
+        upstream.admit(valves)
+        timeout = httpx.Timeout(
+            upstream.timeout(valves), connect=valves.HTTP_CONNECT_TIMEOUT
+        )
+        if method == "GET":
+            send = lambda: client.get(
+                url,
+                params=params,
+                headers=headers,
+                extensions=extensions,
+                timeout=timeout,
+            )
+        else:
+            send = lambda: client.post(
+                url,
+                data=params,
+                headers=headers,
+                extensions=extensions,
+                timeout=timeout,
+            )
+        delay = (
+            upstream.percentile(0.95) if method == "GET" and valves.HEDGE_GETS else None
+        )
+        started = time.perf_counter()
+        try:
+            resp = await (_hedged(send, delay, upstream) if delay else send())
+        except httpx.TimeoutException:
+            upstream.record(False, timeout.read, valves)
+            raise
+        except httpx.HTTPError:
+            upstream.record(False, None, valves)
+            raise
+        latency = time.perf_counter() - started
+        upstream.record(resp.status_code < 500, latency, valves)
+        if valves.RECORD_CASSETTE_DIR:
+            _CASSETTE.write(
+                valves.RECORD_CASSETTE_DIR,
+                method,
+                url,
+                params,
+                priority,
+                retry,
+                resp,
+                latency,
+            )
+        return resp
+
+    async def attempt() -> httpx.Response:
+        rate = (
+            valves.RATE_LIMIT_PER_SECOND
+            if priority == "interactive"
+            else valves.RATE_LIMIT_BATCH_PER_SECOND
+        )
+        for retry in range(valves.RETRY_MAX_ATTEMPTS + 1):
+            waited = await limiter.acquire(priority, rate, valves.RATE_LIMIT_BURST)
+            if waited and timings is not None:
+                timings["throttle"] = timings.get("throttle", 0.0) + waited
+            async with _admitted(host, priority, valves, timings):
+                resp = await send_once(retry)
+            if resp.status_code not in (429, 503) or retry == valves.RETRY_MAX_ATTEMPTS:
+                return resp
+            retry_after = _retry_after(resp)
+            if retry_after is not None and retry_after > valves.RETRY_MAX_DELAY:
+                return resp
+            limiter.stats["retries"] += 1
+            if retry_after is not None:
+                limiter.block(retry_after)  # the next acquire waits it out
+            else:
+                backoff = valves.RETRY_BASE_DELAY * 2**retry
+                await asyncio.sleep(
+                    random.uniform(0, min(valves.RETRY_MAX_DELAY, backoff))
+                )
+
+    return await _SINGLE_FLIGHT.do(key, attempt)
+
+
+def _is_cacheable(result) -> bool:
+    """Only successful upstream payloads are cached; error dicts built by the tool are not."""
+    return not (isinstance(result, dict) and "error" in result)
+
+
+def _validators(resp: httpx.Response) -> dict:
+    """The ETag and Last-Modified of a response, for revalidating it later."""
+    return {k: resp.headers[k] for k in ("etag", "last-modified") if k in resp.headers}
+
+
+class _ResponseCache:
+    """
+    In-process LRU cache of upstream responses with a per-method TTL.
+    Once an entry's TTL has passed it is still served for up to CACHE_STALE_TTL seconds while a
+    background task refreshes it (stale-while-revalidate). Entries keep the response's ETag and
+    Last-Modified, so a GET can refresh them with a conditional request, and an expired entry
+    stays until it is replaced so that it can still be revalidated.
+    """
+
+    def __init__(self):
+        # key -> (value, size in bytes, expires_at, validators)
+        self._entries = OrderedDict()
+        self._validators = (
+            {}
+        )  # key -> validators of a response fetched but not stored yet
+        self._refreshing = {}
+        self.bytes = 0
+        self.stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "revalidated": 0,
+        }
+
+    async def get_or_fetch(self, key, fetch, ttl: float, valves, refresh=None):
+        """
+        Return the cached value for `key` or await `fetch()` and cache its result.
+        `refresh` is used for background revalidation and defaults to `fetch`.
+        """
+        if ttl <= 0:
+            value = await fetch()
+            self._validators.pop(key, None)
+            return value
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, _, expires_at, _ = entry
+            now = time.monotonic()
+            if now < expires_at:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return value
+            if now < expires_at + valves.CACHE_STALE_TTL:
+                self._entries.move_to_end(key)
+                self.stats["stale_hits"] += 1
+                self._refresh(key, refresh or fetch, ttl, valves)
+                return value
+
+        self.stats["misses"] += 1
+        value = await fetch()
+        self._store(key, value, ttl, valves)
+        return value
+
+    def _refresh(self, key, fetch, ttl: float, valves) -> None:
+        if key in self._refreshing:
+            return
+
+        async def revalidate():
+            try:
+                self._store(key, await fetch(), ttl, valves)
+            finally:
+                del self._refreshing[key]
+
+        task = asyncio.get_running_loop().create_task(revalidate())
+        self._refreshing[key] = task
+        # A failed refresh keeps serving the stale entry until CACHE_STALE_TTL runs out.
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+    def conditional_headers(self, key) -> dict:
+        """If-None-Match / If-Modified-Since headers that revalidate the entry for `key`."""
+        entry = self._entries.get(key)
+        validators = entry[3] if entry is not None else {}
+        headers = {}
+        if "etag" in validators:
+            headers["If-None-Match"] = validators["etag"]
+        if "last-modified" in validators:
+            headers["If-Modified-Since"] = validators["last-modified"]
+        return headers
+
+    def note_validators(self, key, resp: httpx.Response) -> None:
+        """Keep a fresh response's validators for when its value is stored under `key`."""
+        self._validators[key] = _validators(resp)
+
+    def not_modified(self, key, resp: httpx.Response):
+        """
+        The cached value for `key` after a 304, with the validators the 304 updated; None when
+        the entry was evicted while the request was in flight.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._validators[key] = {**entry[3], **_validators(resp)}
+        self.stats["revalidated"] += 1
+        return entry[0]
+
+    def _store(self, key, value, ttl: float, valves) -> None:
+        validators = self._validators.pop(key, {})
+        if not _is_cacheable(value):
+            return
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is value:  # revalidated by a 304
+            size = entry[1]
+        else:
+            size = len(json.dumps(value, default=str))
+        if size > valves.CACHE_MAX_BYTES:
+            return
+        self._remove(key)
+        self._entries[key] = (value, size, time.monotonic() + ttl, validators)
+        self.bytes += size
+        while self._entries and (
+            len(self._entries) > valves.CACHE_MAX_ENTRIES
+            or self.bytes > valves.CACHE_MAX_BYTES
+        ):
+            _, (_, evicted_size, _, _) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.stats["evictions"] += 1
+
+    def _remove(self, key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+
+_RESPONSE_CACHE = _ResponseCache()
+
+
+def response_cache_stats() -> dict:
+    """Return hit/miss/eviction counters, hit rate, entry count and byte usage of the response cache."""
+    stats = dict(_RESPONSE_CACHE.stats)
+    lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+    stats["hit_rate"] = (
+        (stats["hits"] + stats["stale_hits"]) / lookups if lookups else 0.0
+    )
+    stats["entries"] = len(_RESPONSE_CACHE._entries)
+    stats["bytes"] = _RESPONSE_CACHE.bytes
+    return stats
+
+
+def _normalize_term(value: str) -> str:
+    return " ".join(str(value).split()).casefold()
+
+
+_LOCAL_INDEX_COLUMNS = (
+    "name",
+    "email",
+    "title",
+    "department",
+    "location",
+    "skills",
+    "description",
+)
+
+
+class _LocalPeopleIndex:
+    """
+    Read side of the SQLite FTS5 people index that hub_search_mcp.py keeps in sync with the
+    hub-suggestions-people index (HUB_MCP_PEOPLE_INDEX). Lookups are answered from the file
+    while its last sync is younger than the configured age, and return None otherwise so
+    the caller goes upstream. Only single-word lookups are answered: how the Hub combines
+    several words is not known here, and a local AND would return other people than it does.
+    """
+
+    def __init__(self):
+        self.stats = {"hits": 0, "misses": 0}
+
+    def search(
+        self,
+        path: str,
+        max_age: float,
+        text: str,
+        column: str | None,
+        limit: int,
+        prefix: bool = False,
+        require_field: str = "",
+    ) -> dict | None:
+        words = str(text).split()
+        if (
+            not path
+            or len(words) != 1
+            or not re.fullmatch(r"[^\W_]+", words[0])
+            or not os.path.exists(path)
+        ):
+            self.stats["misses"] += 1
+            return None
+        phrase = f'"{words[0]}"' + ("*" if prefix else "")
+        match = f"{column} : {phrase}" if column else phrase
+        sql = (
+            "SELECT p.source FROM people_fts JOIN people p ON p.rowid = people_fts.rowid "
+            "WHERE people_fts MATCH ?"
+        )
+        args = [match]
+        if require_field:
+            sql += " AND json_extract(p.source, ?)"
+            args.append(f"$.{require_field}")
+        try:
+            with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as conn:
+                synced_at = conn.execute(
+                    "SELECT value FROM sync_state WHERE key = 'synced_at'"
+                ).fetchone()
+                if synced_at is None or time.time() - float(synced_at[0]) > max_age:
+                    self.stats["misses"] += 1
+                    return None
+                rows = conn.execute(
+                    sql + " ORDER BY rank LIMIT ?", (*args, limit)
+                ).fetchall()
+        except sqlite3.Error:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return {
+            "results": [json.loads(source) for (source,) in rows],
+            "source": "local_index",
+        }
+
+
+_LOCAL_INDEX = _LocalPeopleIndex()
+
+
+def local_index_stats() -> dict:
+    """Return hit/miss counters of the local people index."""
+    return dict(_LOCAL_INDEX.stats)
+
+
+_RRF_K = 60  # reciprocal rank fusion damping; keeps one top-ranked hit from outweighing agreement
+_PERSON_ID_KEYS = ("hanfordid", "hanford_id", "id", "email")
+
+
+def _people(payload) -> list:
+    """The people of a Hub or local index response, in rank order."""
+    if isinstance(payload, dict):
+        payload = payload.get(
+            "results", next((v for v in payload.values() if isinstance(v, list)), [])
+        )
+    if not isinstance(payload, list):
+        return []
+    return [person for person in payload if isinstance(person, dict)]
+
+
+def _person_id(person: dict) -> str:
+    keys = {str(k).casefold(): v for k, v in person.items()}
+    for key in _PERSON_ID_KEYS:
+        if keys.get(key) not in (None, ""):
+            return f"{key}:{keys[key]}"
+    return json.dumps(person, sort_keys=True, default=str)
+
+
+def _fuse_rankings(rankings: dict, combinator: str, limit: int) -> tuple[list, int]:
+    """
+    Merge {term: [people in rank order]} by person ID with reciprocal rank fusion: a person
+    scores the sum of 1 / (_RRF_K + rank) over the terms that found them, so people found by
+    several terms come first. With combinator "and" only people found by every term are kept.
+    Return the top `limit` people, each with its "score" and "matched_terms", and the match count.
+    """
+    merged = {}
+    for term, people in rankings.items():
+        for rank, person in enumerate(people, 1):
+            person_id = _person_id(person)
+            entry = merged.get(person_id)
+            if entry is None:
+                entry = merged[person_id] = [0.0, [], person]
+            if entry[1] and entry[1][-1] == term:
+                continue  # listed twice in one response; keep the better rank
+            entry[0] += 1.0 / (_RRF_K + rank)
+            entry[1].append(term)
+    entries = merged.values()
+    if combinator == "and":
+        entries = [entry for entry in entries if len(entry[1]) == len(rankings)]
+    ranked = sorted(entries, key=lambda entry: entry[0], reverse=True)
+    people = [
+        {**person, "score": round(score, 5), "matched_terms": terms}
+        for score, terms, person in ranked[:limit]
+    ]
+    return people, len(ranked)
+
+
+class _Emitter:
+    """
+    Wraps Open WebUI's `__event_emitter__` for a single tool call.
+    With EMIT_VERBOSITY "status" the call emits one status event carrying its phase timings,
+    "debug" additionally streams every step as a chat message and "off" emits nothing.
+    Every method is a no-op when no emitter was passed in. The phase timings, HTTP status and
+    response size collected here are also recorded into the module metrics.
+    """
+
+    def __init__(self, event_emitter, verbosity: str = "status"):
+        self._event_emitter = event_emitter if verbosity != "off" else None
+        self._debug = verbosity == "debug"
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.status = None
+        self.response_bytes = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time the enclosed block and add it to the `name` phase."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    async def debug(self, content: str) -> None:
+        if self._debug and self._event_emitter is not None:
+            with self.phase("emit"):
+                await self._event_emitter(
+                    {"type": "message", "data": {"content": content + "\n"}}
+                )
+
+    async def done(self, label: str, result=None) -> None:
+        """Emit the single status event that closes the call."""
+        if self._event_emitter is None:
+            return
+        failed = isinstance(result, dict) and "error" in result
+        description = f"{label} {'failed' if failed else 'complete'}"
+        if self.timings:
+            phases = ", ".join(
+                f"{name} {seconds * 1000:.0f} ms"
+                for name, seconds in self.timings.items()
+            )
+            description += f" ({phases})"
+        with self.phase("emit"):
+            await self._event_emitter(
+                {"type": "status", "data": {"description": description, "done": True}}
+            )
+
+
+class _Metrics:
+    """
+    In-process call metrics rendered in the Prometheus text exposition format: latency
+    histograms per phase, call counters per status and response size histograms.
+    Recording is a handful of dict updates, cheap enough to leave on in production.
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+    def __init__(self, tool: str):
+        self._tool = tool
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._written_at = 0.0
+        self._write_failed = False
+
+    def _observe(self, name: str, labels: tuple, value: float, buckets: tuple) -> None:
+        with self._lock:
+            series = self._histograms.get((name, labels))
+            if series is None:
+                series = self._histograms[(name, labels)] = [
+                    buckets,
+                    [0] * len(buckets),
+                    0.0,
+                    0,
+                ]
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                series[1][index] += 1
+            series[2] += value
+            series[3] += 1
+
+    def record_call(
+        self, method: str, timings: dict, status, response_bytes=None
+    ) -> None:
+        labels = (("tool", self._tool), ("method", method))
+        for phase, seconds in timings.items():
+            self._observe(
+                "enterprise_tool_phase_seconds",
+                labels + (("phase", phase),),
+                seconds,
+                self.LATENCY_BUCKETS,
+            )
+        if response_bytes is not None:
+            self._observe(
+                "enterprise_tool_response_bytes",
+                labels,
+                response_bytes,
+                self.SIZE_BUCKETS,
+            )
+        key = ("enterprise_tool_calls_total", labels + (("status", str(status)),))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def render(self) -> str:
+        with self._lock:
+            histograms = {
+                key: (series[0], list(series[1]), series[2], series[3])
+                for key, series in self._histograms.items()
+            }
+            counters = dict(self._counters)
+        lines = []
+        typed = set()
+        for (name, labels), (buckets, counts, total, count) in sorted(
+            histograms.items()
+        ):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{name}_sum{{{label_text}}} {total}")
+            lines.append(f"{name}_count{{{label_text}}} {count}")
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{name}{{{label_text}}} {value}")
+        controllers = sorted(_ADMISSION_CONTROLLERS.items())
+        if controllers:
+            lines.append("# TYPE enterprise_upstream_in_flight gauge")
+            for host, controller in controllers:
+                lines.append(
+                    f'enterprise_upstream_in_flight{{tool="{self._tool}",host="{host}"}} {controller.in_flight}'
+                )
+            lines.append("# TYPE enterprise_upstream_queue_depth gauge")
+            for host, controller in controllers:
+                for priority, depth in controller.depths().items():
+                    lines.append(
+                        f'enterprise_upstream_queue_depth{{tool="{self._tool}",host="{host}",priority="{priority}"}} {depth}'
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, interval: float) -> None:
+        """Atomically rewrite `path` (e.g. a node_exporter textfile) at most every `interval` seconds."""
+        now = time.monotonic()
+        if not path or now - self._written_at < interval:
+            return
+        self._written_at = now
+        try:
+            with open(f"{path}.tmp", "w") as f:
+                f.write(self.render())
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:  # an export must never fail a call
+            if not self._write_failed:
+                self._write_failed = True
+                logging.getLogger(__name__).warning(
+                    "Cannot write metrics to %s: %s", path, e
+                )
+
+
+_METRICS = _Metrics("hub")
+
+
+def metrics_text() -> str:
+    """Return this tool's call metrics in the Prometheus text exposition format."""
+    return _METRICS.render()
 
 
 class Tools:
@@ -21,57 +1272,263 @@ class Tools:
             default="", description="client secret for service account"
         )
         TENANT_ID: str = Field(default="", description="tenant ID for service account")
+        HTTP_MAX_CONNECTIONS: int = Field(
+            default=20, description="maximum pooled connections per upstream host"
+        )
+        HTTP_MAX_KEEPALIVE_CONNECTIONS: int = Field(
+            default=10,
+            description="maximum idle keep-alive connections per upstream host",
+        )
+        HTTP_TIMEOUT: float = Field(
+            default=10.0,
+            description="read/write/pool timeout for upstream calls in seconds",
+        )
+        HTTP_CONNECT_TIMEOUT: float = Field(
+            default=5.0, description="connect timeout for upstream calls in seconds"
+        )
+        WARMUP_ON_LOAD: bool = Field(
+            default=True,
+            description="fetch tokens and open upstream connections in the background when the tool loads or its credentials change",
+        )
+        WARMUP_CONNECTIONS: int = Field(
+            default=2,
+            description="connections per upstream host opened by the warm-up; 0 only fetches tokens",
+        )
+        ADAPTIVE_TIMEOUT_MULTIPLIER: float = Field(
+            default=3.0,
+            description="read timeout as a multiple of the upstream's observed p99 latency, capped at HTTP_TIMEOUT; 0 always uses HTTP_TIMEOUT",
+        )
+        ADAPTIVE_TIMEOUT_FLOOR: float = Field(
+            default=1.0,
+            description="lowest adaptive read timeout in seconds",
+        )
+        CIRCUIT_FAILURE_THRESHOLD: int = Field(
+            default=5,
+            description="consecutive failures (errors, timeouts, 5xx) that open an upstream's circuit; 0 disables the breaker",
+        )
+        CIRCUIT_RESET_TIMEOUT: float = Field(
+            default=30.0,
+            description="seconds an open circuit fails calls fast before letting a probe through",
+        )
+        HEDGE_GETS: bool = Field(
+            default=False,
+            description="send a second copy of a GET that is slower than the upstream's p95 latency and use the first answer",
+        )
+        RATE_LIMIT_PER_SECOND: float = Field(
+            default=0.0,
+            description="interactive calls per second allowed to each API gateway, shared by all enterprise tools; 0 disables throttling",
+        )
+        RATE_LIMIT_BATCH_PER_SECOND: float = Field(
+            default=0.0,
+            description="batch calls (e.g. search_costs_many) per second allowed to each API gateway; 0 disables throttling",
+        )
+        RATE_LIMIT_BURST: int = Field(
+            default=10,
+            description="calls a gateway budget may send at once after being idle",
+        )
+        RETRY_MAX_ATTEMPTS: int = Field(
+            default=3,
+            description="retries of a call answered 429 or 503",
+        )
+        RETRY_BASE_DELAY: float = Field(
+            default=0.5,
+            description="first retry backoff in seconds, doubled per retry with full jitter, when no Retry-After is given",
+        )
+        RETRY_MAX_DELAY: float = Field(
+            default=20.0,
+            description="longest retry wait in seconds; a longer Retry-After is returned to the caller instead",
+        )
+        UPSTREAM_MAX_CONCURRENCY: int = Field(
+            default=20,
+            description="calls in flight to each upstream host, shared by all enterprise tools; 0 disables admission control",
+        )
+        UPSTREAM_QUEUE_SIZE: int = Field(
+            default=1000,
+            description="calls that may wait for a slot per upstream host; further calls are rejected",
+        )
+        UPSTREAM_MAX_WAIT: float = Field(
+            default=5.0,
+            description="seconds an interactive call may wait for a slot before it is rejected",
+        )
+        UPSTREAM_BATCH_MAX_WAIT: float = Field(
+            default=60.0,
+            description="seconds a batch call may wait for a slot before it is rejected",
+        )
+        SEARCH_CACHE_TTL: float = Field(
+            default=300.0,
+            description="seconds a search_internal_users result is fresh; 0 disables caching",
+        )
+        NAME_CACHE_TTL: float = Field(
+            default=900.0,
+            description="seconds a search_internal_users_by_name result is fresh; 0 disables caching",
+        )
+        CACHE_STALE_TTL: float = Field(
+            default=3600.0,
+            description="seconds an expired entry may still be served while it is refreshed",
+        )
+        CACHE_MAX_ENTRIES: int = Field(
+            default=1024, description="maximum number of cached Hub responses"
+        )
+        CACHE_MAX_BYTES: int = Field(
+            default=64 * 1024 * 1024,
+            description="maximum serialized size of all cached Hub responses in bytes",
+        )
+        CONDITIONAL_REQUESTS: bool = Field(
+            default=True,
+            description="refresh cached name lookups with If-None-Match/If-Modified-Since so an unchanged profile comes back as a bodiless 304",
+        )
+        LOCAL_INDEX_PATH: str = Field(
+            default="",
+            description="path of the SQLite people index synced by hub_search_mcp.py (HUB_MCP_PEOPLE_INDEX); empty always calls the Hub API",
+        )
+        LOCAL_INDEX_MAX_AGE: float = Field(
+            default=3600.0,
+            description="seconds since its last sync the local people index is answered from",
+        )
+        LOCAL_INDEX_RESULT_LIMIT: int = Field(
+            default=25, description="people returned by a local index lookup"
+        )
+        LOCAL_INDEX_AVAILABILITY_FIELD: str = Field(
+            default="",
+            description="people index field that marks availability for work; empty sends has_availability searches to the Hub API",
+        )
+        MULTI_SEARCH_RESULT_LIMIT: int = Field(
+            default=50,
+            description="people returned by search_internal_users_by_terms after merging",
+        )
+        EMIT_VERBOSITY: Literal["off", "status", "debug"] = Field(
+            default="status",
+            description="off: no events, status: one status event with phase timings per call, debug: every step as a chat message",
+        )
+        METRICS_FILE: str = Field(
+            default="",
+            description="path of a Prometheus textfile the call metrics are exported to; empty disables the export",
+        )
+        METRICS_FILE_INTERVAL: float = Field(
+            default=15.0, description="minimum seconds between rewrites of METRICS_FILE"
+        )
+        RECORD_CASSETTE_DIR: str = Field(
+            default="",
+            description="directory that sanitized upstream request/response pairs are appended to, for benchmarks/replay_cassettes.py; empty disables recording",
+        )
 
     _ENDPOINT = "https://apimdevgw.pnnl.gov/proof-of-concept-hub-mcp/v1/hub"
+    _SCOPE = "api://proof-of-concept.pnnl.gov/hub/.default"
 
     def __init__(self):
         """Initialize the Tool."""
         self.valves = self.Valves()
 
-    async def _get_access_token(self, __event_emitter__=None) -> str:
+    @property
+    def valves(self):
+        return self._valves
+
+    @valves.setter
+    def valves(self, valves) -> None:
+        # Open WebUI assigns the saved valves before every call; _warm_up only acts on a change.
+        self._valves = valves
+        _warm_up(valves, (self._SCOPE,), (self._ENDPOINT,))
+
+    def _record(self, method: str, emitter: _Emitter) -> None:
+        """Record one call's phase timings, status and size, and refresh METRICS_FILE."""
+        timings = {**emitter.timings, "total": time.perf_counter() - emitter.started}
+        _METRICS.record_call(
+            method, timings, emitter.status or "cached", emitter.response_bytes
+        )
+        _METRICS.write(self.valves.METRICS_FILE, self.valves.METRICS_FILE_INTERVAL)
+
+    async def _get_access_token(self, emitter: _Emitter) -> str:
         """
         Retrieve an access token from Azure AD using Client Credentials flow.
         This method uses the CLIENT_ID, CLIENT_SECRET, and TENANT_ID from the pipeline's valves.
         :return: Access token as a string.
         """
-        SCOPE = "api://proof-of-concept.pnnl.gov/hub/.default"
-        await __event_emitter__(
-            {
-                "type": "message",
-                "data": {"content": "Inside the _get_access_token method\n"},
-            }
-        )
+        SCOPE = self._SCOPE
+        await emitter.debug("Inside the _get_access_token method")
         try:
-            credential = ClientSecretCredential(
-                tenant_id=self.valves.TENANT_ID,
-                client_id=self.valves.CLIENT_ID,
-                client_secret=self.valves.CLIENT_SECRET,
-            )
-            token = credential.get_token(SCOPE).token
-
-            await __event_emitter__(
-                {
-                    "type": "message",
-                    "data": {"content": "The token was retrieved successfully.\n"},
-                }
-            )
+            with emitter.phase("token"):
+                token = await _TOKEN_BROKER.get_token(
+                    self.valves.TENANT_ID,
+                    self.valves.CLIENT_ID,
+                    self.valves.CLIENT_SECRET,
+                    SCOPE,
+                )
         except Exception as e:
-            await __event_emitter__(
-                {
-                    "type": "message",
-                    "data": {"content": "The token creation was NOT successful.\n"},
-                }
-            )
+            emitter.status = "exception"
+            await emitter.debug("The token creation was NOT successful.")
             raise Exception(f"Failed to create ClientSecretCredential: {str(e)}")
-        await __event_emitter__(
-            {
-                "type": "message",
-                "data": {"content": "The token creation was successful.\n"},
-            }
-        )
+        await emitter.debug("The token was retrieved successfully.")
 
         return token
 
+    async def _request(
+        self, method: str, params: dict, emitter: _Emitter, cache_key=None
+    ) -> dict:
+        """
+        Call the Hub endpoint and return the decoded JSON body or an error dictionary.
+        With `cache_key` and CONDITIONAL_REQUESTS, a GET revalidates the response cached under
+        that key: a 304 returns the cached value, with no body to download or decode. POST
+        searches are never revalidated.
+        """
+        token = await self._get_access_token(emitter)
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "User-Agent": "requests",  # Example curl User-Agent value
+        }
+        conditional = (
+            cache_key is not None
+            and method == "GET"
+            and self.valves.CONDITIONAL_REQUESTS
+        )
+        if conditional:
+            headers.update(_RESPONSE_CACHE.conditional_headers(cache_key))
+        await emitter.debug("The params are " + str(params))
+        try:
+            with emitter.phase("upstream"):
+                resp = await _send(
+                    method,
+                    self._ENDPOINT,
+                    params,
+                    headers,
+                    self.valves,
+                    emitter.timings,
+                )
+            emitter.status = resp.status_code
+            emitter.response_bytes = len(resp.content)
+            if resp.status_code == 304 and conditional:
+                cached = _RESPONSE_CACHE.not_modified(cache_key, resp)
+                if cached is not None:
+                    await emitter.debug("The cached response is still current.")
+                    return cached
+                # The entry was evicted meanwhile; fetch the full response instead.
+                return await self._request(method, params, emitter)
+            if resp.status_code == 200:
+                await emitter.debug("The endpoint was called successfully.")
+                if conditional:
+                    _RESPONSE_CACHE.note_validators(cache_key, resp)
+                with emitter.phase("decode"):
+                    return resp.json()
+            await emitter.debug(
+                "There was an error calling the endpoint. The error reads: " + resp.text
+            )
+            return {
+                "error": f"API request failed: Status {resp.status_code}",
+                "details": resp.text,
+            }
+        except _AdmissionRejected as e:
+            emitter.status = "rejected"
+            await emitter.debug("The call was rejected by admission control: " + str(e))
+            return {"error": "Upstream busy, call rejected", "details": str(e)}
+        except Exception as e:
+            emitter.status = (
+                "circuit_open" if isinstance(e, _CircuitOpenError) else "exception"
+            )
+            await emitter.debug(
+                "There was an exception calling the endpoint. The error reads: "
+                + str(e)
+            )
+            return {"error": "API call exception", "details": str(e)}
+
     async def search_internal_users(
         self, searchTerm: str, has_availability: bool = True, __event_emitter__=None
     ) -> dict:
@@ -84,63 +1541,131 @@ class Tools:
 
         :return: A dictionary containing the search results or an error message.
         """
+        emitter = _Emitter(__event_emitter__, self.valves.EMIT_VERBOSITY)
+        result = await self._search(searchTerm, has_availability, emitter)
+        await emitter.done("Hub search", result)
+        self._record("search_internal_users", emitter)
+        return result
 
-        token = await self._get_access_token(__event_emitter__)
-        await __event_emitter__(
-            {
-                "type": "message",
-                "data": {"content": "The token was retrieved successfully.\n"},
-            }
+    async def _search(
+        self, searchTerm: str, has_availability: bool, emitter: _Emitter
+    ) -> dict:
+        """Answer one search term from the local index, the response cache or the Hub."""
+        if self.valves.LOCAL_INDEX_PATH and (
+            not has_availability or self.valves.LOCAL_INDEX_AVAILABILITY_FIELD
+        ):
+            with emitter.phase("local_index"):
+                result = await asyncio.to_thread(
+                    _LOCAL_INDEX.search,
+                    self.valves.LOCAL_INDEX_PATH,
+                    self.valves.LOCAL_INDEX_MAX_AGE,
+                    searchTerm,
+                    None,
+                    self.valves.LOCAL_INDEX_RESULT_LIMIT,
+                    require_field=(
+                        self.valves.LOCAL_INDEX_AVAILABILITY_FIELD
+                        if has_availability
+                        else ""
+                    ),
+                )
+            if result is not None:
+                emitter.status = "local_index"
+                return result
+        # httpx form-encodes booleans as "true"/"false"; keep the "True"/"False" APIM expects.
+        params = {"searchTerm": searchTerm, "hasAvailability": str(has_availability)}
+        key = (
+            "search_internal_users",
+            _normalize_term(searchTerm),
+            bool(has_availability),
         )
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "User-Agent": "requests",  # Example curl User-Agent value
-        }
-        params = {"searchTerm": searchTerm, "hasAvailability": has_availability}
-        await __event_emitter__(
-            {
-                "type": "message",
-                "data": {"content": "The params are " + str(params) + "\n"},
-            }
+        return await _RESPONSE_CACHE.get_or_fetch(
+            key,
+            lambda: self._request("POST", params, emitter),
+            self.valves.SEARCH_CACHE_TTL,
+            self.valves,
+            refresh=lambda: self._request("POST", params, _Emitter(None)),
         )
-        try:
-            resp = requests.post(
-                self._ENDPOINT, data=params, headers=headers, timeout=10
+
+    async def search_internal_users_by_terms(
+        self,
+        searchTerms: list[str],
+        combinator: Literal["or", "and"] = "or",
+        has_availability: bool = True,
+        __event_emitter__=None,
+    ) -> dict:
+        """
+        Search for internal users matching several search terms at once, for example ["nuclear reactors", "thermal hydraulics", "MCNP"].
+        Use this instead of calling search_internal_users once per term: the searches run concurrently and the people are merged into one deduplicated list, ranked by how well they match across the terms.
+
+        :searchTerms: The search terms to query. A single string is searched as one term.
+        :combinator: "or" returns people matching any of the terms, "and" only people matching all of them. Default is "or".
+        :has_availability: Whether to filter by user availability for work. Default is True.
+
+        :return: A dictionary with the ranked "results" (each person with a "score" and the "matched_terms"), the number of people "matched", and "errors" keyed by the terms whose search failed.
+        """
+        emitter = _Emitter(__event_emitter__, self.valves.EMIT_VERBOSITY)
+        if isinstance(searchTerms, str):
+            searchTerms = [searchTerms]  # not one search per character
+        terms = {}
+        for term in searchTerms or []:
+            terms.setdefault(_normalize_term(term), " ".join(str(term).split()))
+        terms.pop("", None)
+        mode = str(combinator).strip().lower()
+        if mode not in ("or", "and"):
+            emitter.status = "invalid"
+            result = {
+                "error": "Invalid combinator",
+                "details": f'Expected "or" or "and", got {combinator!r}.',
+            }
+        elif not terms:
+            emitter.status = "invalid"
+            result = {"error": "No search terms given"}
+        else:
+            result = await self._search_terms(
+                list(terms.values()), mode, has_availability, emitter
             )
-            if resp.status_code == 200:
-                await __event_emitter__(
-                    {
-                        "type": "message",
-                        "data": {"content": "The endpoint was called successfully.\n"},
-                    }
-                )
-                return resp.json()
+        await emitter.done("Hub multi-term search", result)
+        self._record("search_internal_users_by_terms", emitter)
+        return result
+
+    async def _search_terms(
+        self, terms: list, combinator: str, has_availability: bool, emitter: _Emitter
+    ) -> dict:
+        """Run the searches of search_internal_users_by_terms concurrently and fuse them."""
+
+        async def search(term: str):
+            # Per-term steps are not streamed; only the merged search's status is emitted.
+            quiet = _Emitter(None)
+            result = await self._search(term, has_availability, quiet)
+            self._record("search_internal_users_by_terms_lookup", quiet)
+            return result
+
+        with emitter.phase("upstream"):
+            results = await asyncio.gather(*(search(t) for t in terms))
+        rankings = {}
+        errors = {}
+        for term, result in zip(terms, results):
+            if isinstance(result, dict) and "error" in result:
+                errors[term] = result
             else:
-                await __event_emitter__(
-                    {
-                        "type": "message",
-                        "data": {
-                            "content": "There was an error calling the endpoint. The error reads: "
-                            + resp.text
-                        },
-                    }
+                rankings[term] = _people(result)
+        if rankings:
+            with emitter.phase("merge"):
+                people, matched = _fuse_rankings(
+                    rankings, combinator, self.valves.MULTI_SEARCH_RESULT_LIMIT
                 )
-                return {
-                    "error": f"API request failed: Status {resp.status_code}",
-                    "details": resp.text,
-                }
-        except Exception as e:
-            await __event_emitter__(
-                {
-                    "type": "message",
-                    "data": {
-                        "content": "There was an exception calling the endpoint. The error reads: "
-                        + str(e)
-                        + "\n"
-                    },
-                }
-            )
-            return {"error": "API call exception", "details": str(e)}
+            emitter.status = "partial" if errors else 200
+            result = {
+                "terms": terms,
+                "combinator": combinator,
+                "matched": matched,
+                "results": people,
+                "errors": errors,
+            }
+        else:
+            emitter.status = "error"
+            result = {"error": "All searches failed", "details": errors}
+        return result
 
     async def search_internal_users_by_name(
         self, name: str, __event_emitter__=None
@@ -153,60 +1678,32 @@ class Tools:
 
         :return: A dictionary containing the search results or an error message.
         """
-
-        token = await self._get_access_token(__event_emitter__)
-        await __event_emitter__(
-            {
-                "type": "message",
-                "data": {"content": "The token was retrieved successfully.\n"},
-            }
-        )
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "User-Agent": "requests",  # Example curl User-Agent value
-        }
+        emitter = _Emitter(__event_emitter__, self.valves.EMIT_VERBOSITY)
+        if self.valves.LOCAL_INDEX_PATH:
+            with emitter.phase("local_index"):
+                result = await asyncio.to_thread(
+                    _LOCAL_INDEX.search,
+                    self.valves.LOCAL_INDEX_PATH,
+                    self.valves.LOCAL_INDEX_MAX_AGE,
+                    name,
+                    "name",
+                    self.valves.LOCAL_INDEX_RESULT_LIMIT,
+                    prefix=True,
+                )
+            if result is not None:
+                emitter.status = "local_index"
+                await emitter.done("Hub name search", result)
+                self._record("search_internal_users_by_name", emitter)
+                return result
         params = {"name": name}
-        await __event_emitter__(
-            {
-                "type": "message",
-                "data": {"content": "The params are " + str(params) + "\n"},
-            }
+        key = ("search_internal_users_by_name", _normalize_term(name))
+        result = await _RESPONSE_CACHE.get_or_fetch(
+            key,
+            lambda: self._request("GET", params, emitter, key),
+            self.valves.NAME_CACHE_TTL,
+            self.valves,
+            refresh=lambda: self._request("GET", params, _Emitter(None), key),
         )
-        try:
-            resp = requests.get(
-                self._ENDPOINT, params=params, headers=headers, timeout=10
-            )
-            if resp.status_code == 200:
-                await __event_emitter__(
-                    {
-                        "type": "message",
-                        "data": {"content": "The endpoint was called successfully.\n"},
-                    }
-                )
-                return resp.json()
-            else:
-                await __event_emitter__(
-                    {
-                        "type": "message",
-                        "data": {
-                            "content": "There was an error calling the endpoint. The error reads: "
-                            + resp.text
-                        },
-                    }
-                )
-                return {
-                    "error": f"API request failed: Status {resp.status_code}",
-                    "details": resp.text,
-                }
-        except Exception as e:
-            await __event_emitter__(
-                {
-                    "type": "message",
-                    "data": {
-                        "content": "There was an exception calling the endpoint. The error reads: "
-                        + str(e)
-                        + "\n"
-                    },
-                }
-            )
-            return {"error": "API call exception", "details": str(e)}
+        await emitter.done("Hub name search", result)
+        self._record("search_internal_users_by_name", emitter)
+        return result